@@ -0,0 +1,87 @@
+import os
+import sys
+import time
+import shutil
+import tempfile
+import argparse
+
+import numpy as np
+import polars as pl
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from generate_hit_regions_bed import read_hit_windows
+from interval_merging import merge_hit_windows
+
+"""
+Benchmark of the first step of 'generate_hit_regions_bed.py', which builds a window around every GWAS hit. It compares
+the original implementation (one single-row DataFrame appended per hit) against the single lazy scan in
+read_hit_windows(), on synthetic hit files. The original implementation is slow, so it is only run up to
+'--legacy_limit' hits. The time taken to merge the windows into regions (see 'interval_merging.py') is printed too.
+
+Usage: python benchmarks/benchmark_hit_regions.py -n 10000 100000 1000000
+"""
+
+
+def make_hit_files(num_hits: int, output_dir: str, num_files: int = 10, seed: int = 0) -> None:
+    """Write 'num_hits' synthetic hits, split over 'num_files' files with the columns of the extracted hits files."""
+    rng = np.random.default_rng(seed)
+    for i, idx in enumerate(np.array_split(np.arange(num_hits), num_files)):
+        pl.DataFrame({"pval": 10 ** -rng.uniform(6, 50, len(idx)),
+                      "chromosome": rng.integers(1, 24, len(idx)),
+                      "position": rng.integers(1, 250_000_000, len(idx)),
+                      "phenotype": f"Trait_{i}"}).write_csv(os.path.join(output_dir, f"Trait_{i}.txt"), separator="\t")
+
+
+def legacy_read_hit_windows(folder_path: str, interval_size: int) -> pl.DataFrame:
+    """The way the script used to do it, with the polars API updated."""
+    bed_df = pl.DataFrame(schema=[("chrom", pl.Int64), ("chromStart", pl.Int64), ("chromEnd", pl.Int64),
+                                  ("leadSnp_pos", pl.Int64), ("leadSnp_pval", pl.Float64), ("phenotypes", pl.Utf8)])
+    for file in sorted(os.listdir(folder_path)):
+        df = pl.read_csv(os.path.join(folder_path, file), separator="\t",
+                         columns=["pval", "chromosome", "position", "phenotype"])
+        for row in df.rows():
+            bed_df = bed_df.extend(pl.DataFrame({"chrom": [int(row[1])],
+                                                 "chromStart": [max(2, row[2] - interval_size)],
+                                                 "chromEnd": [row[2] + interval_size],
+                                                 "leadSnp_pos": [row[2]],
+                                                 "leadSnp_pval": [row[0]],
+                                                 "phenotypes": [row[3]]}))
+    return bed_df.sort([pl.col("chrom"), pl.col("chromStart")])
+
+
+def time_it(function, *function_args) -> tuple:
+    """Wall time of a single run, and the result."""
+    start = time.perf_counter()
+    result = function(*function_args)
+    return time.perf_counter() - start, result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the hit window step of 'generate_hit_regions_bed.py'.")
+    parser.add_argument("-n", "--num_hits", type=int, nargs="+", default=[10_000, 100_000, 1_000_000],
+                        help="Numbers of hits to try. Default: 10000 100000 1000000")
+    parser.add_argument("-l", "--legacy_limit", type=int, default=100_000,
+                        help="Largest number of hits the original implementation is run on. Default: 100000")
+    parser.add_argument("-s", "--interval_size", type=int, default=1_000_000, help="Default: 1000000")
+    args = parser.parse_args()
+
+    for num_hits in args.num_hits:
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            make_hit_files(num_hits, tmp_dir)
+            new_time, new_df = time_it(read_hit_windows, tmp_dir, args.interval_size)
+            print(f"Hits: {num_hits}")
+            merge_time, regions_df = time_it(merge_hit_windows, new_df)
+            print(f"  After (single lazy scan): {new_time:.3f} s")
+            print(f"  Merging into {regions_df.height} regions: {merge_time:.3f} s")
+            if num_hits <= args.legacy_limit:
+                legacy_time, legacy_df = time_it(legacy_read_hit_windows, tmp_dir, args.interval_size)
+                # Both implementations must give the same windows. Ties in the sort order may differ, so compare the
+                # windows as a whole.
+                assert legacy_df.sort(legacy_df.columns).equals(new_df.sort(new_df.columns))
+                print(f"  Before (row by row):      {legacy_time:.3f} s")
+                print(f"  Speed-up: {legacy_time / new_time:.0f}x")
+            else:
+                print("  Before (row by row):      skipped, see --legacy_limit")
+        finally:
+            shutil.rmtree(tmp_dir)
@@ -0,0 +1,68 @@
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+import polars as pl
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from marker_parsing import decode_markers, recode_chrx_marker_expr
+
+"""
+Benchmark of the Marker decoding step. It compares the original implementation (a Python lambda for the chrX -> chr23
+rewrite followed by two list comprehensions) against the native expressions in 'marker_parsing.py', on a synthetic
+table of markers. Results are printed as rows per second.
+
+Usage: python benchmarks/benchmark_marker_parsing.py -n 1000000
+"""
+
+
+def make_markers(num_rows: int, seed: int = 0) -> pl.DataFrame:
+    """Synthetic Marker column, roughly 5% of it on chromosome X."""
+    rng = np.random.default_rng(seed)
+    chroms = rng.integers(1, 24, num_rows).astype(str)
+    chroms[chroms == "23"] = "X"
+    positions = rng.integers(1, 250_000_000, num_rows).astype(str)
+    return pl.DataFrame({"Marker": np.char.add(np.char.add(np.char.add("chr", chroms), ":"), positions)})
+
+
+def legacy_decode(df: pl.DataFrame) -> pl.DataFrame:
+    """The way the pipeline used to do it: three interpreted passes over the strings."""
+    df = df.with_columns(pl.col("Marker").map_elements(lambda x: "chr23" + x[4:] if x.startswith("chrX") else x))
+    return df.with_columns([pl.Series("chromosome", [int(x.split(':')[0][3:]) for x in df["Marker"]]),
+                            pl.Series("position", [int(x.split(':')[1]) for x in df["Marker"]])])
+
+
+def native_decode(df: pl.DataFrame) -> pl.DataFrame:
+    return decode_markers(df.with_columns(recode_chrx_marker_expr()))
+
+
+def time_it(function, df: pl.DataFrame, repeats: int) -> float:
+    """Best wall time out of 'repeats' runs."""
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function(df)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the Marker decoding step, before and after.")
+    parser.add_argument("-n", "--num_rows", type=int, default=1_000_000, help="Number of markers. Default: 1000000")
+    parser.add_argument("-r", "--repeats", type=int, default=3, help="Number of runs, the best is kept. Default: 3")
+    args = parser.parse_args()
+
+    markers_df = make_markers(args.num_rows)
+
+    # Both implementations must agree before timing them
+    assert legacy_decode(markers_df.head(10000)).equals(native_decode(markers_df.head(10000)))
+
+    legacy_time = time_it(legacy_decode, markers_df, args.repeats)
+    native_time = time_it(native_decode, markers_df, args.repeats)
+
+    print(f"Rows: {args.num_rows}")
+    print(f"Before (lambda + list comprehensions): {args.num_rows / legacy_time:,.0f} rows/sec")
+    print(f"After (native expressions):            {args.num_rows / native_time:,.0f} rows/sec")
+    print(f"Speed-up: {legacy_time / native_time:.1f}x")
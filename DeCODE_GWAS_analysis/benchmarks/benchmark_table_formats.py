@@ -0,0 +1,76 @@
+import os
+import sys
+import time
+import shutil
+import tempfile
+import argparse
+
+import numpy as np
+import polars as pl
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from extract_variants_by_pval import HITS_COLUMNS
+from produce_all_hits_table import HITS_DTYPES
+from table_io import TABLE_FORMATS, read_table, table_file_name, write_table
+
+"""
+Benchmark of the formats of the tables handed off between the steps of the pipeline (see 'table_io.py'). A synthetic
+table with the columns of the hit tables and of the template is written and read back in every format, and the size of
+the file and the time taken are printed.
+
+Usage: python benchmarks/benchmark_table_formats.py -n 1000000 10000000
+"""
+
+
+def make_sumstats(num_rows: int, seed: int = 0) -> pl.DataFrame:
+    """Synthetic summary statistics, sorted by chromosome and position like the template."""
+    rng = np.random.default_rng(seed)
+    chromosome = np.sort(rng.integers(1, 24, num_rows))
+    position = rng.integers(1, 250_000_000, num_rows)
+    order = np.lexsort((position, chromosome))
+    chromosome, position = chromosome[order], position[order]
+    chi2 = rng.chisquare(1, num_rows)
+    return pl.DataFrame({"ID": [f"rs{i}" for i in rng.permutation(num_rows)],
+                         "beta": rng.normal(0, 0.05, num_rows).round(5),
+                         "chi2": chi2.round(5),
+                         "pval": np.exp(-chi2 / 2),
+                         "Marker": [f"chr{c}:{p}" for c, p in zip(chromosome, position)],
+                         "chromosome": chromosome,
+                         "position": position,
+                         "OA": rng.choice(["A", "C", "G", "T"], num_rows),
+                         "EA": rng.choice(["A", "C", "G", "T"], num_rows),
+                         "EAF": rng.random(num_rows).round(4),
+                         "Info": rng.uniform(0.8, 1, num_rows).round(3),
+                         "phenotype": "Trait_0",
+                         "variant_key": np.arange(num_rows)}).select(HITS_COLUMNS)
+
+
+def time_it(function, *function_args) -> tuple:
+    """Wall time of a single run, and the result."""
+    start = time.perf_counter()
+    result = function(*function_args)
+    return time.perf_counter() - start, result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the formats of the intermediate tables.")
+    parser.add_argument("-n", "--num_rows", type=int, nargs="+", default=[1000000],
+                        help="Number of rows of the synthetic table. Default: 1000000")
+    parser.add_argument("-s", "--seed", type=int, default=0)
+
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        print(f"{'rows':>10} {'format':>8} {'size (MB)':>10} {'write (s)':>10} {'read (s)':>10}")
+        for num_rows in args.num_rows:
+            table_df = make_sumstats(num_rows, args.seed)
+            for table_format in TABLE_FORMATS:
+                table_file = os.path.join(tmp_dir, table_file_name("table", table_format))
+                write_time, _ = time_it(write_table, table_df, table_file)
+                read_time, read_df = time_it(read_table, table_file, HITS_DTYPES)
+                assert read_df.equals(table_df)
+                print(f"{num_rows:>10} {table_format:>8} {os.path.getsize(table_file) / 1e6:>10.1f} "
+                      f"{write_time:>10.2f} {read_time:>10.2f}")
+    finally:
+        shutil.rmtree(tmp_dir)
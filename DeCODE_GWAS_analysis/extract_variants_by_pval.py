@@ -1,34 +1,40 @@
 import os
 import sys
+import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import polars as pl
-from scipy.stats import chi2
 import argparse
 
+from pvalues import pval_expr, neg_log10_pval_expr, pval_to_chi2
+from marker_parsing import recode_chrx_marker_expr
+from variant_info_store import open_variant_info_store, lookup_variants, source_fingerprint
+from table_io import TABLE_FORMATS, table_file_name, read_table, write_table
+from gwas_file_reader import RES_COLUMNS, RES_DTYPES, scan_gwas_file, list_gwas_files
+
 """
 This script takes a 'variant_info.txt' file and a number of GWAS output .rse files (ID, beta and chi-square columns).
 It then filters the output tables by a user specified p-value threshold.
 The resulting entries, together with additional info about the variants, are written to a new file.
-"""
 
-parser = argparse.ArgumentParser(description="Extract the entries with p-values lower than a specified threshold from "
-                                             "a set of GWAS output files.")
-parser.add_argument("variant_info_file",
-                    metavar="FILEPATH",
-                    help="Path to the variant info file.")
-parser.add_argument("files_filepath",
-                    metavar="FOLDER_PATH",
-                    help="Path to the directory containing the GWAS output files.")
-parser.add_argument("-p", "--pval_thresh", default=6,
-                    help="Negative logarithm of the p-value. This will be the exponent of the desired p-value "
-                         "threshold. E.g. 6 for p=1e-6. Only variants with p-values smaller than the corresponding "
-                         "threshold will be included in the output tables. Default: 6")
-parser.add_argument("-o", "--output_filepath",
-                    help="Path to the directory where the output files will be written to.")
+Several thresholds can be given at once (e.g. -p 4 6 7.3). Each file is then read only once, with the loosest of them,
+and the hits of every threshold are written to their own subfolder ('10E4.0/', '10E6.0/', ...). The hits of a tighter
+threshold are a subset of those of a looser one, so they are simply filtered from the same table.
 
-args = parser.parse_args()
+With a cache folder (-r), the rows of each file above the loosest threshold (ID, beta and chi2 only) are also kept in a
+small Parquet file per trait. Later runs with the same or tighter thresholds read the cache instead of the GWAS output
+file. A JSON sidecar records the threshold of the cache and the size and mtime of the GWAS file it was made from, so a
+cache is not used if the GWAS file changed or if the new threshold is looser.
+
+The .res files are never loaded in full. Each of them is scanned lazily with the chi2 threshold pushed down into the
+scan, so only the rows that pass the threshold are ever materialized. Several files can be processed at the same time.
+Gzipped .res.gz files are read as they are, decompressed as a stream (see 'gwas_file_reader.py').
+The variant info is read from the memory-mapped store built by 'variant_info_store.py', which must be up to date.
+"""
 
-# TODO: Input validation
+# 'variant_key' is the integer key of the variant in the variant info store. Later steps join on it instead of on ID.
+HITS_COLUMNS = ["ID", "beta", "chi2", "pval", "Marker", "chromosome", "position", "OA", "EA", "EAF", "Info",
+                "phenotype", "variant_key"]
 
 
 def print_status(percent):
@@ -37,47 +43,239 @@ def print_status(percent):
     sys.stdout.flush()
 
 
-# Read variant info file, then merge it with the GWAS output files
-var_info_df = pl.read_csv(args.variant_info_file, sep='\t', columns=["ID", "Marker", "OA", "EA", "EAF", "Info"])
+def phenotype_from_file_name(gwas_file_name: str) -> str:
+    """Phenotype name is only given by the file name. E.g. 'SWE_Swedes_Blood_variome_<pheno>_adjSexPhaCohPC_...'"""
+    return '_'.join(os.path.basename(gwas_file_name).rstrip('.txt').split('_')[4:-3])
+
+
+def tier_name(pval_thresh) -> str:
+    """Name of the output subfolder of a threshold when several are given. E.g. 6 -> '10E6.0', like the Snakefile."""
+    return "10E" + str(float(pval_thresh))
+
+
+def hits_cache_file(cache_dir: str, phenotype: str) -> str:
+    return os.path.join(cache_dir, phenotype + ".parquet")
+
+
+def read_hits_cache_metadata(cache_file: str):
+    """Contents of the JSON sidecar of a cache file, or None if there is no sidecar."""
+    if not os.path.isfile(cache_file + ".json"):
+        return None
+    with open(cache_file + ".json", "r") as f:
+        return json.load(f)
+
+
+def hits_cache_is_usable(cache_file: str, gwas_file: str, pval_thresh: float) -> bool:
+    """
+    Check whether a cache file holds every row of the GWAS output file with a p-value below the threshold: it has to
+    be made from the current version of the file (same size and mtime), with the same or a looser threshold.
+
+    :param cache_file: Path to the cache file
+    :param gwas_file: Path to the GWAS output file
+    :param pval_thresh: Negative logarithm of the p-value threshold
+    :return: True if the cache can be read instead of the GWAS output file
+    """
+    metadata = read_hits_cache_metadata(cache_file)
+    if not os.path.isfile(cache_file) or metadata is None:
+        return False
+    # The GWAS files are not hashed, it would take as long as reading them
+    current = source_fingerprint(gwas_file, with_hash=False)
+    return (current["size"] == metadata["size"] and current["mtime_ns"] == metadata["mtime_ns"] and
+            metadata["pval_thresh"] <= float(pval_thresh))
+
+
+def write_hits_cache(hits_df: pl.DataFrame, cache_file: str, gwas_file: str, pval_thresh: float) -> None:
+    """
+    Write the rows of a GWAS output file above a threshold to the cache, with its sidecar. The sidecar is removed first
+    and written last, so a cache left half-written by an interrupted job is never used.
+    """
+    fingerprint = source_fingerprint(gwas_file, with_hash=False)
+    fingerprint["pval_thresh"] = float(pval_thresh)
+    if os.path.isfile(cache_file + ".json"):
+        os.remove(cache_file + ".json")
+    write_table(hits_df.select(RES_COLUMNS), cache_file)
+    with open(cache_file + ".json", "w") as f:
+        json.dump(fingerprint, f, indent=2)
+
+
+def scan_res_file(gwas_file: str, chi2_threshold: float, decompression_threads: int = 1) -> pl.LazyFrame:
+    """
+    Lazily scan a single GWAS output .res file, keeping only the rows whose chi2 value exceeds the threshold.
+    The filter is pushed down into the CSV reader, so the full table is never held in memory. Gzipped files are
+    decompressed as a stream and filtered a chunk at a time (see 'gwas_file_reader.py').
+
+    :param gwas_file: Path to the .res file (space separated, no header, columns ID, beta and chi2), plain or gzipped
+    :param chi2_threshold: Rows with a chi2 value smaller than or equal to this are discarded
+    :param decompression_threads: Number of threads decompressing the file, if it is bgzipped
+    :return: LazyFrame with the columns ID, beta and chi2
+    """
+    return scan_gwas_file(gwas_file, lambda gwas_lf: gwas_lf.filter(pl.col("chi2") > chi2_threshold),
+                          threads=decompression_threads)
+
+
+def extract_variants_from_file(gwas_file: str, var_info_store: pl.DataFrame, pval_thresholds: dict,
+                               neg_log10_pval: bool = False, output_format: str = "tsv",
+                               decompression_threads: int = 1, cache_dir: str = None) -> list:
+    """
+    Extract the hits from a single .res file and write them, together with the variant info, to
+    '<output_dir>/<phenotype>.txt' (or '.parquet' / '.arrow', see 'table_io.py'). If there are no hits an empty table is
+    written instead, so that Snakemake still finds the expected output.
+    The file is read only once whatever the number of thresholds: the hits of the loosest threshold are extracted, and
+    those of the tighter thresholds are filtered from them.
+
+    :param gwas_file: Path to the .res file
+    :param var_info_store: Variant info store, as returned by variant_info_store.open_variant_info_store()
+    :param pval_thresholds: Negative logarithm of each p-value threshold -> directory where its hits will be written to
+    :param neg_log10_pval: If True, add a 'neg_log10_pval' column computed directly from chi2, which stays accurate
+     where the p-value underflows to 0
+    :param output_format: Format of the output files, one of TABLE_FORMATS. Default: tab-separated text
+    :param decompression_threads: Number of threads decompressing the .res file, if it is bgzipped
+    :param cache_dir: OPTIONAL. Directory of the hits cache. The cache of the phenotype is read instead of the .res file
+     if it is usable, and (re)written otherwise.
+    :return: Paths to the output files, in the order of 'pval_thresholds'
+    """
+    phenotype = phenotype_from_file_name(gwas_file)
+    output_columns = HITS_COLUMNS + ["neg_log10_pval"] if neg_log10_pval else HITS_COLUMNS
+    pval_columns = [pval_expr(), neg_log10_pval_expr()] if neg_log10_pval else [pval_expr()]
+    loosest_thresh = min(float(pval_thresh) for pval_thresh in pval_thresholds)
+    chi2_thresholds = [float(pval_to_chi2(10 ** -float(pval_thresh))) for pval_thresh in pval_thresholds]
+
+    # Only the rows above the loosest threshold are collected, and p-values are computed on whole batches.
+    cache_file = hits_cache_file(cache_dir, phenotype) if cache_dir else None
+    if cache_file and hits_cache_is_usable(cache_file, gwas_file, loosest_thresh):
+        hits_df = read_table(cache_file, RES_DTYPES).filter(pl.col("chi2") > min(chi2_thresholds))
+    else:
+        hits_df = scan_res_file(gwas_file, min(chi2_thresholds), decompression_threads).collect(streaming=True)
+        if cache_file:
+            write_hits_cache(hits_df, cache_file, gwas_file, loosest_thresh)
+    hits_df = hits_df.with_columns(pval_columns)
+
+    # The variant info for the hits is fetched with a binary search on the ID-sorted store. It already contains the
+    # chromosome, position and variant_key columns. We replace 'chrX' with 'chr23' in the Marker column, as the
+    # pipeline always has.
+    variant_rows = lookup_variants(var_info_store, hits_df["ID"])
+    gwas_df = (hits_df.join(variant_rows, on="ID", how="left")
+               .with_columns([recode_chrx_marker_expr(), pl.lit(phenotype).alias("phenotype")])
+               .select(output_columns)
+               .sort(["chromosome", "position"], nulls_last=True))
+
+    # Write to file, once per threshold. If there are no hits this is an empty table, written anyway to appease
+    # Snakemake.
+    output_files = []
+    for output_dir, chi2_threshold in zip(pval_thresholds.values(), chi2_thresholds):
+        output_file = os.path.join(output_dir, table_file_name(phenotype, output_format))
+        write_table(gwas_df.filter(pl.col("chi2") > chi2_threshold), output_file)
+        output_files.append(output_file)
+    return output_files
+
+
+def extract_variants_by_pval(variant_info_file: str, files_dir: str, pval_thresh, output_dir: str,
+                             workers: int = 1, neg_log10_pval: bool = False, store_file: str = None,
+                             output_format: str = "tsv", decompression_threads: int = 1,
+                             cache_dir: str = None) -> None:
+    """
+    Extract the hits from every .res (or .res.gz) file in a directory, or from a single file. The files are processed
+    concurrently by 'workers' threads.
+    Each worker streams through its own file, so peak memory is bounded by one chunk per worker plus the hits.
 
-pval_threshold = 10 ** -float(args.pval_thresh)
-chi2_threshold = chi2.isf(pval_threshold, 1)
+    :param variant_info_file: Path to the variant info file
+    :param files_dir: Directory containing the .res files, or path to a single .res file
+    :param pval_thresh: Negative logarithm of the p-value threshold. E.g. 6 for p=1e-6. It can also be a list of
+     thresholds, whose hits are then written to a subfolder of the output directory each (see tier_name())
+    :param output_dir: Directory where the output files will be written to
+    :param workers: Number of files processed at the same time
+    :param neg_log10_pval: If True, add a 'neg_log10_pval' column to the output files
+    :param store_file: Path to the variant info store. Default: see variant_info_store.default_store_path()
+    :param output_format: Format of the output files, one of TABLE_FORMATS. Default: tab-separated text
+    :param decompression_threads: Number of threads decompressing each .res file, if they are bgzipped
+    :param cache_dir: OPTIONAL. Directory of the hits cache, see extract_variants_from_file()
+    """
+    table_file_name("", output_format)  # Fail early on an unknown format
+    var_info_store = open_variant_info_store(variant_info_file, store_file)
 
+    # A single threshold writes straight to the output directory, as it always has
+    if not isinstance(pval_thresh, list):
+        pval_thresh = [pval_thresh]
+    pval_thresholds = sorted({float(thresh) for thresh in pval_thresh})
+    if len(pval_thresholds) == 1:
+        pval_thresholds = {pval_thresholds[0]: output_dir}
+    else:
+        pval_thresholds = {thresh: os.path.join(output_dir, tier_name(thresh)) for thresh in pval_thresholds}
+    for tier_dir in pval_thresholds.values():
+        os.makedirs(tier_dir, exist_ok=True)
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
 
-for i, gwas_file in enumerate(os.listdir(args.files_filepath)):
+    # List the directory only once
+    gwas_files = list_gwas_files(files_dir)
 
-    # Progress bar
-    percentage = int(i / len(os.listdir(args.files_filepath)) * 100)
-    print_status(percentage)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(extract_variants_from_file, gwas_file, var_info_store, pval_thresholds,
+                                   neg_log10_pval, output_format, decompression_threads, cache_dir)
+                   for gwas_file in gwas_files]
+        for i, future in enumerate(as_completed(futures)):
+            future.result()  # Re-raise any exception from the worker
+            print_status(int((i + 1) / len(gwas_files) * 100))  # Progress bar
 
-    if gwas_file.endswith('.res'):  # TODO: Maybe allow more extensions?
-        gwas_df = pl.read_csv(args.files_filepath + '/' + gwas_file, has_header=False,
-                              new_columns=["ID", "beta", "chi2"], sep=" ")
-        gwas_df = gwas_df.filter(gwas_df["chi2"] > chi2_threshold)
-        if gwas_df.is_empty():  # If there are no hits, write an empty file to appease Snakemake # TODO: sure it works?
-            mock_df = pl.DataFrame(columns=["ID", "beta", "chi2", "pval", "Marker", "chromosome", "position", "OA",
-                                            "EA", "EAF", "Info", "phenotype"])
-            phenotype = '_'.join(
-                gwas_file.rstrip('.txt').split('_')[4:-3])  # Phenotype name is only given by the file name
-            mock_df.write_csv(args.output_filepath + '/' + phenotype + '.txt', sep='\t', has_header=True)
-            continue
 
-        # Add 'pval' column
-        gwas_df.insert_at_idx(3, pl.Series("pval", [chi2.sf(x, 1) for x in gwas_df["chi2"]]))
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract the entries with p-values lower than a specified threshold "
+                                                 "from a set of GWAS output files.")
+    parser.add_argument("variant_info_file",
+                        metavar="FILEPATH",
+                        help="Path to the variant info file.")
+    parser.add_argument("files_filepath",
+                        metavar="FOLDER_PATH",
+                        help="Path to the directory containing the GWAS output files (.res, or gzipped .res.gz), or "
+                             "path to a single GWAS output file.")
+    parser.add_argument("-p", "--pval_thresh", nargs="+", default=[6],
+                        help="Negative logarithm of the p-value. This will be the exponent of the desired p-value "
+                             "threshold. E.g. 6 for p=1e-6. Only variants with p-values smaller than the corresponding "
+                             "threshold will be included in the output tables. Several thresholds can be given (e.g. "
+                             "-p 4 6 7.3): each file is then read only once, and the tables of each threshold are "
+                             "written to their own subfolder of the output directory ('10E4.0/', ...). Default: 6")
+    parser.add_argument("-w", "--workers", type=int, default=1,
+                        help="Number of GWAS output files processed concurrently. Peak memory grows with one streaming "
+                             "chunk per worker. Default: 1")
+    parser.add_argument("-c", "--chunk_size", type=int,
+                        help="OPTIONAL. Number of rows per streaming chunk. If none is given, polars picks one based "
+                             "on the number of columns and threads.")
+    parser.add_argument("-l", "--neg_log10_pval", action="store_true",
+                        help="Add a 'neg_log10_pval' column to the output. It is computed directly from chi2, so it "
+                             "stays accurate for very strong hits whose p-value underflows to 0.")
+    parser.add_argument("-s", "--variant_info_store",
+                        help="OPTIONAL. Path to the variant info store (see 'variant_info_store.py'). It must be built "
+                             "and up to date. Default: the variant info file path with the '.arrow' extension.")
+    parser.add_argument("-d", "--decompression_threads", type=int, default=1,
+                        help="Number of threads decompressing each GWAS output file, if they are bgzipped. Files "
+                             "compressed with plain gzip are decompressed on a single thread. Default: 1")
+    parser.add_argument("-f", "--output_format", choices=list(TABLE_FORMATS), default="tsv",
+                        help="Format of the output files: tab-separated text, or zstd-compressed Parquet or Arrow IPC. "
+                             "Default: tsv")
+    parser.add_argument("-r", "--cache_dir",
+                        help="OPTIONAL. Directory of the hits cache: the rows of each file above the loosest threshold "
+                             "are kept there, and later runs with the same or tighter thresholds read them instead of "
+                             "the GWAS output files.")
+    parser.add_argument("-o", "--output_filepath",
+                        help="Path to the directory where the output files will be written to.")
 
-        # Merge with variant info
-        gwas_df = gwas_df.join(var_info_df, on="ID", how="left")
+    args = parser.parse_args()
 
-        # Add chromosome and position columns, and sort the table with them.
-        # We replace 'chrX' with 'chr23' to allow sorting. We assume marker format to be chr<chr>:<pos>
-        gwas_df = gwas_df.with_column(pl.col("Marker").apply(lambda x: "chr23"+x[4:] if x.startswith("chrX") else x))
-        gwas_df.insert_at_idx(5, pl.Series("chromosome", [int(x.split(':')[0][3:]) for x in gwas_df["Marker"]]))
-        gwas_df.insert_at_idx(6, pl.Series("position", [int(x.split(':')[1]) for x in gwas_df["Marker"]]))
-        gwas_df = gwas_df.sort(["chromosome", "position"])
+    # Input validation
+    if not os.path.isfile(args.variant_info_file):
+        raise ValueError(f"Variant info file {args.variant_info_file} does not exist")
+    if not os.path.exists(args.files_filepath):
+        raise ValueError(f"GWAS output file or folder {args.files_filepath} does not exist")
+    if args.workers < 1:
+        raise ValueError("The number of workers must be at least 1")
+    if args.decompression_threads < 1:
+        raise ValueError("The number of decompression threads must be at least 1")
+    if any(float(pval_thresh) <= 0 for pval_thresh in args.pval_thresh):
+        raise ValueError("The p-value thresholds must be given as positive exponents, e.g. 6 for p=1e-6")
 
-        # Add 'phenotype' column
-        phenotype = '_'.join(gwas_file.rstrip('.txt').split('_')[4:-3])  # Phenotype name is only given by the file name
-        gwas_df.hstack([pl.Series("phenotype", [phenotype] * gwas_df.height)], in_place=True)
+    if args.chunk_size is not None:
+        pl.Config.set_streaming_chunk_size(args.chunk_size)
 
-        # Write to file
-        gwas_df.write_csv(args.output_filepath + '/' + phenotype + '.txt', sep='\t', has_header=True)
+    extract_variants_by_pval(args.variant_info_file, args.files_filepath, args.pval_thresh, args.output_filepath,
+                             args.workers, args.neg_log10_pval, args.variant_info_store, args.output_format,
+                             args.decompression_threads, args.cache_dir)
@@ -0,0 +1,194 @@
+import os
+import sys
+import argparse
+
+import numpy as np
+import polars as pl
+
+from marker_parsing import CHROMOSOME_CODES
+from variant_info_store import source_fingerprint, store_is_up_to_date, write_store_metadata, temporary_file_for
+
+"""
+Index of the gene records of a GTF annotation file (e.g. GENCODE v42), used to find the closest gene to a list of
+positions.
+
+The 'gene' rows of the GTF file are loaded once into numpy arrays sorted by chromosome and start position, and cached
+next to the GTF file as a '.npz' file. Like the variant info store, the cache has a JSON sidecar with the fingerprint of
+the GTF file, and it is rebuilt automatically when the GTF file changes.
+
+Chromosomes are coded the same way as in the rest of the pipeline (X -> 23, Y -> 24, M -> 26, see 'marker_parsing.py').
+Genes on other contigs are left out.
+
+Usage: python gene_index.py /path/to/gencode.v42.basic.annotation.gtf.gz -o /path/to/gencode.v42.gene_index.npz
+"""
+
+GTF_COLUMNS = ["seqname", "source", "feature", "start", "end", "score", "strand", "frame", "attribute"]
+INDEX_ARRAYS = ["chrom", "start", "end", "strand", "gene_id", "gene_name", "gene_type"]
+
+
+def default_index_path(gtf_file: str) -> str:
+    """Cache file used when none is given: next to the GTF file, with the '.gene_index.npz' extension."""
+    gtf_path = gtf_file[:-3] if gtf_file.endswith(".gz") else gtf_file
+    return os.path.splitext(gtf_path)[0] + ".gene_index.npz"
+
+
+def read_gene_records(gtf_file: str) -> pl.DataFrame:
+    """
+    Read the 'gene' rows of a GTF file (plain or gzipped).
+
+    :param gtf_file: Path to the GTF file
+    :return: DataFrame with the columns chrom, start, end, strand (1 or -1), gene_id, gene_name and gene_type, sorted by
+     chrom and start
+    """
+    gtf_df = pl.read_csv(gtf_file, separator="\t", has_header=False, new_columns=GTF_COLUMNS, comment_prefix="#",
+                         quote_char=None, infer_schema_length=0)  # Everything is read as text
+
+    contig = pl.col("seqname").str.strip_prefix("chr")
+    genes_df = gtf_df.filter(pl.col("feature") == "gene").select([
+        contig.replace(CHROMOSOME_CODES, default=contig.cast(pl.Int64, strict=False)).alias("chrom"),
+        pl.col("start").cast(pl.Int64),
+        pl.col("end").cast(pl.Int64),
+        pl.when(pl.col("strand") == "-").then(-1).otherwise(1).cast(pl.Int8).alias("strand"),
+        pl.col("attribute").str.extract(r'gene_id "([^"]*)"').fill_null("").alias("gene_id"),
+        pl.col("attribute").str.extract(r'gene_name "([^"]*)"').fill_null("").alias("gene_name"),
+        pl.col("attribute").str.extract(r'gene_type "([^"]*)"').fill_null("").alias("gene_type")])
+
+    return genes_df.filter(pl.col("chrom").is_not_null()).sort(["chrom", "start", "end"])
+
+
+def build_gene_index(gtf_file: str, index_file: str = None) -> str:
+    """
+    Read the gene records of the GTF file and save them as numpy arrays in the cache file.
+
+    :param gtf_file: Path to the GTF file
+    :param index_file: Path to the cache file. Default: see default_index_path()
+    :return: Path to the cache file
+    """
+    if index_file is None:
+        index_file = default_index_path(gtf_file)
+
+    fingerprint = source_fingerprint(gtf_file)
+    genes_df = read_gene_records(gtf_file)
+
+    tmp_index_file = temporary_file_for(index_file)
+    try:
+        with open(tmp_index_file, "wb") as f:
+            # Strings are saved as fixed width unicode arrays, so that the cache can be loaded without pickle
+            np.savez(f, **{name: genes_df[name].to_numpy().astype(str) if genes_df[name].dtype == pl.Utf8
+                           else genes_df[name].to_numpy() for name in INDEX_ARRAYS})
+        os.replace(tmp_index_file, index_file)
+    finally:
+        if os.path.exists(tmp_index_file):  # Only if writing it failed
+            os.remove(tmp_index_file)
+    write_store_metadata(index_file, fingerprint)
+
+    return index_file
+
+
+def ensure_gene_index(gtf_file: str, index_file: str = None) -> str:
+    """Build the cache if it does not exist or is out of date, and return its path."""
+    if index_file is None:
+        index_file = default_index_path(gtf_file)
+    if not store_is_up_to_date(gtf_file, index_file):
+        sys.stdout.write(f"Building gene index {index_file} from {gtf_file}...\n")
+        build_gene_index(gtf_file, index_file)
+    return index_file
+
+
+def load_gene_index(gtf_file: str, index_file: str = None) -> dict:
+    """
+    Load the gene index, (re)building the cache first if needed.
+
+    :param gtf_file: Path to the GTF file
+    :param index_file: Path to the cache file. Default: see default_index_path()
+    :return: Dictionary of numpy arrays (see INDEX_ARRAYS), sorted by chrom and start
+    """
+    index_file = ensure_gene_index(gtf_file, index_file)
+    with np.load(index_file) as cached:
+        return {name: cached[name] for name in INDEX_ARRAYS}
+
+
+def closest_genes(gene_index: dict, chrom, pos, max_distance: int = 1000000) -> pl.DataFrame:
+    """
+    Find the closest gene to each of the given positions.
+
+    The distance to a gene is 0 if the position falls inside the gene, and the distance to the nearest end of the gene
+    otherwise. All the positions of a chromosome are looked up at once with a binary search on the gene starts, plus a
+    running maximum of the gene ends for the genes starting before the position. Ties go to the gene starting before the
+    position.
+
+    :param gene_index: Gene index, as returned by load_gene_index()
+    :param chrom: Array-like with the chromosome of each position
+    :param pos: Array-like with the positions
+    :param max_distance: Genes further away than this are not reported. Default: 1000000 (1Mb)
+    :return: DataFrame with one row per position and the columns gene_name, gene_id, gene_distance and tss_distance
+     (position minus TSS, in the direction of transcription, i.e. negative upstream of the gene). Null if there is no
+     gene within 'max_distance'.
+    """
+    chrom = np.asarray(chrom)
+    pos = np.asarray(pos, dtype=np.int64)
+    best_gene = np.full(len(pos), -1, dtype=np.int64)
+    best_distance = np.full(len(pos), np.iinfo(np.int64).max, dtype=np.int64)
+
+    for c in np.unique(chrom):
+        lo = np.searchsorted(gene_index["chrom"], c, side="left")
+        hi = np.searchsorted(gene_index["chrom"], c, side="right")
+        if lo == hi:
+            continue
+        query = np.flatnonzero(chrom == c)
+        p = pos[query]
+        starts, ends = gene_index["start"][lo:hi], gene_index["end"][lo:hi]
+
+        # Among the genes starting at or before p, the closest is the one reaching the furthest
+        reach = np.maximum.accumulate(ends)
+        reach_gene = np.maximum.accumulate(np.where(ends == reach, np.arange(len(ends)), 0))
+        k = np.searchsorted(starts, p, side="right")  # Number of genes starting at or before p
+
+        has_left = k > 0
+        left_gene = reach_gene[np.maximum(k - 1, 0)]
+        left_distance = np.where(has_left, np.maximum(p - reach[np.maximum(k - 1, 0)], 0), best_distance[query])
+
+        # Among the genes starting after p, the closest is the next one
+        has_right = k < len(starts)
+        right_gene = np.minimum(k, len(starts) - 1)
+        right_distance = np.where(has_right, starts[right_gene] - p, best_distance[query])
+
+        use_left = left_distance <= right_distance
+        best_gene[query] = lo + np.where(use_left, left_gene, right_gene)
+        best_distance[query] = np.where(use_left, left_distance, right_distance)
+
+    found = (best_gene >= 0) & (best_distance <= max_distance)
+    gene = np.where(found, best_gene, 0)
+    strand = gene_index["strand"][gene].astype(np.int64)
+    tss = np.where(strand == 1, gene_index["start"][gene], gene_index["end"][gene])
+
+    genes_df = pl.DataFrame({"gene_name": gene_index["gene_name"][gene],
+                             "gene_id": gene_index["gene_id"][gene],
+                             "gene_distance": best_distance,
+                             "tss_distance": (pos - tss) * strand,
+                             "found": found})
+    return genes_df.select([pl.when(pl.col("found")).then(pl.col(name)).otherwise(None).alias(name)
+                            for name in ["gene_name", "gene_id", "gene_distance", "tss_distance"]])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the gene index cache of a GTF annotation file, used to look up "
+                                                 "the closest gene to a position.")
+    parser.add_argument("gtf_file",
+                        metavar="FILEPATH",
+                        help="Path to the GTF file (plain or gzipped).")
+    parser.add_argument("-o", "--output_file",
+                        help="Path to the cache file. Default: the GTF file path with the '.gene_index.npz' extension.")
+    parser.add_argument("-f", "--force", action="store_true",
+                        help="Rebuild the cache even if it is up to date.")
+
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.gtf_file):
+        raise ValueError(f"GTF file {args.gtf_file} does not exist")
+
+    if args.force:
+        index = build_gene_index(args.gtf_file, args.output_file)
+    else:
+        index = ensure_gene_index(args.gtf_file, args.output_file)
+    sys.stdout.write(f"Gene index ready: {index}\n")
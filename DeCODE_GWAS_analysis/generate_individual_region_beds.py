@@ -1,87 +1,150 @@
 import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
 import polars as pl
 import argparse
 
+from table_io import find_table, scan_table
+
 """
 This script will go through a BED-like file specifying the regions in the genome where we have GWAS hits, and will check
 all of the GWAS hits in the hits_only_sumstats folder for hits within that region. It will then output a BED file for
 each of the regions with positions, effect alleles, p-values and phenotypes of the hits within that region.
 
-Usage: python generate_individual_region_beds.py --regions_file /path/to/variant_regions.bed --hits_bed_files_folder 
+The hit tables are read only once. Each hit is assigned to its region with a binary search on the region starts, and the
+hits are then split by region and written out, optionally on several threads.
+
+Usage: python generate_individual_region_beds.py --regions_file /path/to/variant_regions.bed --hits_bed_files_folder
 /path/to/hits_only_sumstats/ --output_folder /path/to/output_folder/
 """
 
-parser = argparse.ArgumentParser(description="Make a BED file for each of the regions specified in the"
-                                             "'variant_regions.bed' file. Each file will contain the positions, effect"
-                                             " alleles, p-values and phenotypes of the hits within that region. "
-                                             "Optionally, create .gwas files instead of BED files for display in IGV.")
-parser.add_argument("--regions_file", type=str, required=True,
-                    help="Path to the BED-like file containing the regions in the genome where we have GWAS hits.")
-parser.add_argument("--hits_bed_files_folder", type=str, required=True,
-                    help="Path to the folder containing the GWAS hit tables.")
-parser.add_argument("--dot_gwas_file", default=False, action="store_true",
-                    help="Use this flag if instead of a BED file we want to produce an IGV-compatible .gwas file. See "
-                         "https://software.broadinstitute.org/software/igv/GWAS for details.")
-parser.add_argument("--output_folder", type=str, required=True,
-                    help="Path to the folder where the output files will be written to.")
-
-args = parser.parse_args()
-
-
-# Check if the paths are valid
-if not os.path.exists(args.regions_file):
-    raise ValueError("The given regions file does not exist.")
-if not os.path.exists(args.hits_bed_files_folder):
-    raise ValueError("The given hits BED files folder does not exist.")
-# Check if the output folder exists, if not create it
-if not os.path.exists(args.output_folder):
-    os.mkdir(args.output_folder)
-
-# If folder names do not end with a slash, add it
-if args.hits_bed_files_folder[-1] != "/":
-    args.hits_bed_files_folder += "/"
-if args.output_folder[-1] != "/":
-    args.output_folder += "/"
-
-# Output file extension
-if args.dot_gwas_file:
-    file_extension = ".gwas"
-else:
-    file_extension = ".bed"
-
-# Load regions file
-df = pl.read_csv(args.regions_file, sep='\t', columns=["chrom", "chromStart", "chromEnd", "phenotypes"])
-df = df.with_column(pl.col("phenotypes").str.split(by=","))  # Split phenotypes column into a list
-
-# Iterate row by row through the regions file
-for region_number in range(len(df)):
-    region_chrom = df[region_number, 0]
-    region_start = df[region_number, 1]
-    region_end = df[region_number, 2]
-    pheno_list = df[region_number, 3].to_list()  # List of phenotypes in the selected region
-
-    final_df = pl.DataFrame(columns=[("chromosome", pl.Int32),
-                                     ("position", pl.Int32),
-                                     ("EA", pl.Utf8),
-                                     ("pval", pl.Float64),
-                                     ("phenotype", pl.Utf8)])
-    # Read, filter and stack the "hit_tables" of each phenotype taking only hits in the selected region
-    for pheno in pheno_list:
-        hits_bed_file = args.hits_bed_files_folder + pheno + ".txt"
-        hits_bed_df = pl.read_csv(hits_bed_file, sep='\t',
-                                  columns=["pval", "chromosome", "position", "EA", "phenotype"],
-                                  dtypes={"chromosome": pl.Int32, "position": pl.Int32, "EA": pl.Utf8,
-                                          "pval": pl.Float64, "phenotype": pl.Utf8})
-        # Reorder columns
-        hits_bed_df = hits_bed_df.select(["chromosome", "position", "EA", "pval", "phenotype"])
-        hits_bed_df = hits_bed_df.filter(hits_bed_df["chromosome"] == df[region_number, 0])  # Same chromosome
-        hits_bed_df = hits_bed_df.filter(hits_bed_df["position"] >= df[region_number, 1])  # Within region
-        hits_bed_df = hits_bed_df.filter(hits_bed_df["position"] <= df[region_number, 2])
-
-        final_df = pl.concat([final_df, hits_bed_df])
-
-    if not args.dot_gwas_file:  # Default output is a BED file, which has ChromStart and ChromEnd columns.
-        final_df = final_df.insert_at_idx(2, final_df.to_series(1).alias("position2"))  # Add position2 (ChromEnd) col
-
-    final_df.write_csv(args.output_folder + f"region_{region_number+1}_chr{region_chrom}:{region_start}-{region_end}{file_extension}",
-                       sep='\t', has_header=True)
+HIT_COLUMNS = ["chromosome", "position", "EA", "pval", "phenotype"]
+
+
+def read_regions(regions_file: str) -> pl.DataFrame:
+    """Read the regions file, with the phenotypes column split into a list."""
+    regions_df = pl.read_csv(regions_file, separator='\t', columns=["chrom", "chromStart", "chromEnd", "phenotypes"])
+    return regions_df.with_columns(pl.col("phenotypes").str.split(by=","))
+
+
+def read_hits(hits_bed_files_folder: str, phenotypes: list) -> pl.DataFrame:
+    """
+    Read the hit tables of the given phenotypes, all in one go.
+
+    :param hits_bed_files_folder: Path to the folder containing the GWAS hit tables ('<phenotype>.txt', or '.parquet' /
+     '.arrow', see 'table_io.py')
+    :param phenotypes: Phenotypes to read the hits of
+    :return: DataFrame with the columns chromosome, position, EA, pval and phenotype. Hits without a chromosome (alt
+     contigs and unknown chromosome codes, see marker_parsing.decode_markers()) are left out, as they are in no region.
+    """
+    hits_lf = pl.concat([scan_table(find_table(hits_bed_files_folder, pheno),
+                                    {"chromosome": pl.Int32, "position": pl.Int32, "EA": pl.Utf8, "pval": pl.Float64,
+                                     "phenotype": pl.Utf8}).select(HIT_COLUMNS)
+                         for pheno in phenotypes])
+    return hits_lf.filter(pl.col("chromosome").is_not_null()).collect()
+
+
+def assign_hits_to_regions(hits_df: pl.DataFrame, regions_df: pl.DataFrame) -> np.ndarray:
+    """
+    Find the region each hit falls in. Chromosome and position are combined into a single sortable key, so all the hits
+    are looked up with a single binary search on the (non-overlapping) region starts.
+
+    :param hits_df: DataFrame with the chromosome and position of each hit
+    :param regions_df: DataFrame with the chrom, chromStart and chromEnd of each region
+    :return: numpy array with the row number of the region of each hit in regions_df, or -1 if it is in no region
+    """
+    def genomic_key(chrom, pos):
+        return (chrom.to_numpy().astype(np.int64) << 32) + pos.to_numpy().astype(np.int64)
+
+    region_starts = genomic_key(regions_df["chrom"], regions_df["chromStart"])
+    region_ends = genomic_key(regions_df["chrom"], regions_df["chromEnd"])
+    order = np.argsort(region_starts, kind="stable")
+    hit_keys = genomic_key(hits_df["chromosome"], hits_df["position"])
+
+    candidate = np.searchsorted(region_starts[order], hit_keys, side="right") - 1  # Last region starting before the hit
+    region = order[np.maximum(candidate, 0)]
+    inside = (candidate >= 0) & (hit_keys <= region_ends[region])
+    return np.where(inside, region, -1)
+
+
+def region_file_name(region_number: int, chrom, start, end, file_extension: str) -> str:
+    return f"region_{region_number + 1}_chr{chrom}:{start}-{end}{file_extension}"
+
+
+def generate_individual_region_beds(regions_file: str, hits_bed_files_folder: str, output_folder: str,
+                                    dot_gwas_file: bool = False, threads: int = 1) -> None:
+    """
+    Write a file for each region in the regions file with the hits within that region. Within a file, the hits are
+    grouped by phenotype, in the order of the 'phenotypes' column of the region.
+
+    :param regions_file: Path to the BED-like file containing the regions in the genome where we have GWAS hits
+    :param hits_bed_files_folder: Path to the folder containing the GWAS hit tables
+    :param output_folder: Path to the folder where the output files will be written to
+    :param dot_gwas_file: Write IGV-compatible .gwas files instead of BED files
+    :param threads: Number of files to write at the same time
+    """
+    file_extension = ".gwas" if dot_gwas_file else ".bed"
+
+    regions_df = read_regions(regions_file)
+    phenotypes = regions_df["phenotypes"].explode().unique(maintain_order=True).to_list()
+    hits_df = read_hits(hits_bed_files_folder, phenotypes)
+
+    # Only the hits of the phenotypes listed for their region are kept
+    hits_df = hits_df.with_columns(pl.Series("region", assign_hits_to_regions(hits_df, regions_df))).with_row_count()
+    region_phenotypes = regions_df.with_row_count("region").select([pl.col("region").cast(pl.Int64),
+                                                                     pl.col("phenotypes").alias("phenotype")])
+    region_phenotypes = region_phenotypes.explode("phenotype").with_row_count("pheno_order")
+    hits_df = hits_df.join(region_phenotypes, on=["region", "phenotype"], how="inner")
+    hits_df = hits_df.sort(["region", "pheno_order", "row_nr"])  # Hits of a phenotype stay in the file order
+
+    if not dot_gwas_file:  # Default output is a BED file, which has ChromStart and ChromEnd columns.
+        hits_df = hits_df.with_columns(pl.col("position").alias("position2"))
+        output_columns = ["chromosome", "position", "position2", "EA", "pval", "phenotype"]
+    else:
+        output_columns = HIT_COLUMNS
+    hits_by_region = hits_df.partition_by("region", as_dict=True)
+
+    def write_region(region_number: int) -> None:
+        region_df = hits_by_region.get(region_number, hits_df.clear()).select(output_columns)
+        file_name = region_file_name(region_number, *regions_df.row(region_number)[:3], file_extension)
+        region_df.write_csv(os.path.join(output_folder, file_name), separator='\t', include_header=True)
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        for _ in executor.map(write_region, range(regions_df.height)):
+            pass  # Re-raise any exception from the workers
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Make a BED file for each of the regions specified in the"
+                                                 "'variant_regions.bed' file. Each file will contain the positions, "
+                                                 "effect alleles, p-values and phenotypes of the hits within that "
+                                                 "region. Optionally, create .gwas files instead of BED files for "
+                                                 "display in IGV.")
+    parser.add_argument("--regions_file", type=str, required=True,
+                        help="Path to the BED-like file containing the regions in the genome where we have GWAS hits.")
+    parser.add_argument("--hits_bed_files_folder", type=str, required=True,
+                        help="Path to the folder containing the GWAS hit tables.")
+    parser.add_argument("--dot_gwas_file", default=False, action="store_true",
+                        help="Use this flag if instead of a BED file we want to produce an IGV-compatible .gwas file. "
+                             "See https://software.broadinstitute.org/software/igv/GWAS for details.")
+    parser.add_argument("--output_folder", type=str, required=True,
+                        help="Path to the folder where the output files will be written to.")
+    parser.add_argument("-t", "--threads", type=int, default=1,
+                        help="Number of region files to write at the same time. Default: 1")
+
+    args = parser.parse_args()
+
+    # Check if the paths are valid
+    if not os.path.exists(args.regions_file):
+        raise ValueError("The given regions file does not exist.")
+    if not os.path.exists(args.hits_bed_files_folder):
+        raise ValueError("The given hits BED files folder does not exist.")
+    if args.threads < 1:
+        raise ValueError("The number of threads must be at least 1.")
+    # Check if the output folder exists, if not create it
+    if not os.path.exists(args.output_folder):
+        os.mkdir(args.output_folder)
+
+    generate_individual_region_beds(args.regions_file, args.hits_bed_files_folder, args.output_folder,
+                                    args.dot_gwas_file, args.threads)
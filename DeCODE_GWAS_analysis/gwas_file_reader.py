@@ -0,0 +1,156 @@
+import os
+import gzip
+import zlib
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+import polars as pl
+
+"""
+Reader of the GWAS output .res files (ID, beta and chi2, space separated, no header), plain or compressed.
+
+DeCODE delivers the .res files gzipped. They can be read as they are, without copying and unzipping them first: the
+file is decompressed as a stream, a chunk of lines at a time, and every chunk is parsed and filtered before the next one
+is decompressed. Only the rows that pass the filter are kept, so the uncompressed file is never written to disk nor held
+in memory in full.
+
+Files compressed with bgzip (BGZF) are made of independent blocks, so they are decompressed on several threads. Other
+gzip files are decompressed on a single thread.
+"""
+
+RES_COLUMNS = ["ID", "beta", "chi2"]
+RES_DTYPES = {"ID": pl.Utf8, "beta": pl.Float64, "chi2": pl.Float64}
+CHUNK_SIZE = 64 * 1024 * 1024  # Bytes of uncompressed text parsed at a time
+BGZF_BLOCKS_PER_BATCH = 256  # Blocks of at most 64KB each, decompressed together
+
+
+def is_gzip_file(file_path: str) -> bool:
+    with open(file_path, "rb") as f:
+        return f.read(2) == b"\x1f\x8b"
+
+
+def is_bgzf_file(file_path: str) -> bool:
+    """BGZF files are gzip files whose first block has the 'BC' extra subfield with the size of the block."""
+    with open(file_path, "rb") as f:
+        header = f.read(18)
+    return len(header) == 18 and header[:4] == b"\x1f\x8b\x08\x04" and header[12:14] == b"BC"
+
+
+def read_bgzf_blocks(f, num_blocks: int) -> list:
+    """Read the next 'num_blocks' BGZF blocks of a file, as compressed (raw deflate) data."""
+    blocks = []
+    while len(blocks) < num_blocks:
+        header = f.read(12)
+        if len(header) < 12:
+            break
+        extra_length = struct.unpack("<H", header[10:12])[0]
+        extra = f.read(extra_length)
+        block_size = None
+        i = 0
+        while i < extra_length:  # Look for the 'BC' subfield among the extra subfields
+            subfield_length = struct.unpack("<H", extra[i + 2:i + 4])[0]
+            if extra[i:i + 2] == b"BC":
+                block_size = struct.unpack("<H", extra[i + 4:i + 6])[0] + 1
+            i += 4 + subfield_length
+        if block_size is None:
+            raise ValueError("Invalid BGZF block: the 'BC' extra subfield is missing.")
+        data = f.read(block_size - 12 - extra_length)
+        blocks.append(data[:-8])  # The last 8 bytes are the CRC32 and size of the uncompressed block
+    return blocks
+
+
+def iter_decompressed(file_path: str, chunk_size: int = CHUNK_SIZE, threads: int = 1):
+    """
+    Decompress a file as a stream, in pieces of about 'chunk_size' bytes. Plain text files are read as they are.
+
+    :param file_path: Path to the file (plain, gzip or BGZF)
+    :param chunk_size: Approximate size of the pieces, in bytes
+    :param threads: Number of threads decompressing BGZF blocks at the same time
+    :return: Generator of bytes
+    """
+    if is_bgzf_file(file_path):
+        with open(file_path, "rb") as f, ThreadPoolExecutor(max_workers=threads) as executor:
+            pieces, size = [], 0
+            while True:
+                blocks = read_bgzf_blocks(f, BGZF_BLOCKS_PER_BATCH * threads)
+                if not blocks:
+                    break
+                # zlib releases the GIL, so the blocks are really decompressed in parallel
+                for piece in executor.map(lambda block: zlib.decompress(block, -15), blocks):
+                    pieces.append(piece)
+                    size += len(piece)
+                    if size >= chunk_size:
+                        yield b"".join(pieces)
+                        pieces, size = [], 0
+            if pieces:
+                yield b"".join(pieces)
+    else:
+        opener = gzip.open if is_gzip_file(file_path) else open
+        with opener(file_path, "rb") as f:
+            while True:
+                piece = f.read(chunk_size)
+                if not piece:
+                    break
+                yield piece
+
+
+def iter_line_chunks(file_path: str, chunk_size: int = CHUNK_SIZE, threads: int = 1):
+    """Same as iter_decompressed(), but every piece ends at the end of a line."""
+    remainder = b""
+    for piece in iter_decompressed(file_path, chunk_size, threads):
+        piece = remainder + piece
+        last_newline = piece.rfind(b"\n")
+        if last_newline == -1:
+            remainder = piece
+            continue
+        remainder = piece[last_newline + 1:]
+        yield piece[:last_newline + 1]
+    if remainder:
+        yield remainder
+
+
+def scan_gwas_file(gwas_file: str, chunk_filter=None, chunk_size: int = CHUNK_SIZE, threads: int = 1) -> pl.LazyFrame:
+    """
+    Read a GWAS output .res file, plain or compressed, keeping only the rows selected by 'chunk_filter'.
+
+    Plain files are scanned lazily, with the filter pushed down into the reader. Compressed files are decompressed as a
+    stream, and the filter is applied to every chunk of lines as soon as it is parsed. The filter must work row by row,
+    so that it gives the same result on the chunks as on the whole file.
+
+    :param gwas_file: Path to the .res file. It can be gzipped (.res.gz), or bgzipped.
+    :param chunk_filter: OPTIONAL. Function taking and returning a LazyFrame with the columns ID, beta and chi2
+    :param chunk_size: Bytes of uncompressed text parsed at a time
+    :param threads: Number of threads decompressing the file, if it is bgzipped
+    :return: LazyFrame with the columns ID, beta and chi2, plus any column added by the filter
+    """
+    if chunk_filter is None:
+        def chunk_filter(gwas_lf):
+            return gwas_lf
+
+    if not is_gzip_file(gwas_file):
+        return chunk_filter(pl.scan_csv(gwas_file, has_header=False, separator=" ", new_columns=RES_COLUMNS,
+                                        dtypes=RES_DTYPES))
+
+    kept_chunks = [chunk_filter(pl.read_csv(chunk, has_header=False, separator=" ", new_columns=RES_COLUMNS,
+                                            dtypes=RES_DTYPES).lazy()).collect()
+                   for chunk in iter_line_chunks(gwas_file, chunk_size, threads)]
+    if not kept_chunks:  # Empty file
+        return chunk_filter(pl.DataFrame(schema=RES_DTYPES).lazy())
+    return pl.concat(kept_chunks).lazy()
+
+
+def is_gwas_file(file_name: str) -> bool:
+    """GWAS output files, plain or compressed. E.g. '...12102022.res' or '...12102022.res.gz'"""
+    return file_name.endswith(".res") or file_name.endswith(".res.gz") or file_name.endswith(".res.bgz")
+
+
+def list_gwas_files(files_path: str) -> list:
+    """
+    Paths to the GWAS output files in a directory, sorted by name. A single file can be given instead of a directory,
+    so that each trait can be processed by its own job.
+    """
+    if os.path.isfile(files_path):
+        return [files_path]
+    if not os.path.isdir(files_path):
+        raise ValueError(f"GWAS output file or folder {files_path} does not exist")
+    return [os.path.join(files_path, file) for file in sorted(os.listdir(files_path)) if is_gwas_file(file)]
@@ -0,0 +1,67 @@
+import numpy as np
+import polars as pl
+
+"""
+In-process merging of overlapping genomic intervals, used to collapse the windows around GWAS hits into regions.
+
+The intervals are swept once per chromosome, in order of start position, keeping track of the furthest end seen so far.
+An interval that starts after that end opens a new region. As in 'bedtools merge', intervals that only touch
+(book-ended) are merged too.
+"""
+
+
+def merge_interval_ids(chrom, start, end) -> np.ndarray:
+    """
+    Assign a region index to each interval, so that overlapping intervals share the same index. The intervals must be
+    sorted by chromosome and start position.
+
+    :param chrom: Array-like with the chromosome of each interval
+    :param start: Array-like with the start of each interval
+    :param end: Array-like with the end of each interval
+    :return: numpy array with the region index (0, 1, 2...) of each interval
+    """
+    chrom, start, end = np.asarray(chrom), np.asarray(start), np.asarray(end)
+    if len(start) == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    same_chrom = chrom[1:] == chrom[:-1]
+    if np.any(chrom[1:] < chrom[:-1]) or np.any(same_chrom & (start[1:] < start[:-1])):
+        raise ValueError("The intervals must be sorted by chromosome and start position.")
+
+    new_region = np.ones(len(start), dtype=bool)
+    chrom_bounds = np.concatenate([[0], np.flatnonzero(~same_chrom) + 1, [len(start)]])
+    for lo, hi in zip(chrom_bounds[:-1], chrom_bounds[1:]):  # One sweep per chromosome
+        reach = np.maximum.accumulate(end[lo:hi])
+        new_region[lo + 1:hi] = start[lo + 1:hi] > reach[:-1]
+
+    return np.cumsum(new_region) - 1
+
+
+def merge_hit_windows(bed_df: pl.DataFrame) -> pl.DataFrame:
+    """
+    Merge the windows around the GWAS hits into regions, and summarise the hits of each region.
+
+    The lead SNP of a region is the hit with the lowest p-value. Ties are broken by taking the smallest position.
+    Windows without a chromosome (e.g. alt contigs) are left out.
+
+    :param bed_df: Windows around each hit, with the columns chrom, chromStart, chromEnd, leadSnp_pos, leadSnp_pval and
+     phenotypes (one phenotype per row)
+    :return: DataFrame with one row per region and the columns chrom, chromStart, chromEnd, leadSnp_pos, leadSnp_pval,
+     num_included_variants, num_phenotypes and phenotypes (sorted list of the distinct phenotypes)
+    """
+    bed_df = bed_df.filter(pl.col("chrom").is_not_null()).sort(["chrom", "chromStart"])
+    region_ids = merge_interval_ids(bed_df["chrom"].to_numpy(), bed_df["chromStart"].to_numpy(),
+                                    bed_df["chromEnd"].to_numpy())
+
+    by_pval = ["leadSnp_pval", "leadSnp_pos"]
+    regions_df = bed_df.with_columns(pl.Series("region", region_ids)).group_by("region", maintain_order=True).agg([
+        pl.col("chrom").first(),
+        pl.col("chromStart").min(),
+        pl.col("chromEnd").max(),
+        pl.col("leadSnp_pos").sort_by(by_pval).first(),
+        pl.col("leadSnp_pval").sort_by(by_pval).first(),
+        pl.count().alias("num_included_variants"),
+        pl.col("phenotypes").n_unique().alias("num_phenotypes"),
+        pl.col("phenotypes").unique().sort()])
+
+    return regions_df.drop("region")
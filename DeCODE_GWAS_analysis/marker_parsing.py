@@ -0,0 +1,51 @@
+from typing import Union
+
+import polars as pl
+
+"""
+Native (expression based) decoding of DeCODE 'Marker' strings into typed chromosome and position columns.
+
+Markers are expected to look like 'chr<chrom>:<pos>', optionally followed by allele information, e.g. 'chr1:12345',
+'chrX:12345:A:G' or 'chr1:12345_A_G'. The 'chr' prefix is optional. Sex and mitochondrial chromosomes get the PLINK
+numeric codes so that the chromosome column can be sorted numerically:
+
+    X -> 23, Y -> 24, XY (pseudo-autosomal) -> 25, M/MT -> 26
+
+Alt, random and unplaced contigs (e.g. 'chr1_KI270706v1_random') have no numeric code. They keep their position but get
+a null chromosome, and end up at the end of the table when sorting by chromosome and position.
+"""
+
+CHROMOSOME_CODES = {"X": 23, "Y": 24, "XY": 25, "M": 26, "MT": 26}
+
+FrameType = Union[pl.DataFrame, pl.LazyFrame]
+
+
+def decode_markers(frame: FrameType, marker_col: str = "Marker") -> FrameType:
+    """
+    Add 'chromosome' (Int64) and 'position' (Int64) columns decoded from a marker column. The marker strings are split
+    once on ':' with native string kernels (no regex, no Python calls), and both DataFrames and LazyFrames are accepted
+    (the return type matches the input).
+
+    :param frame: DataFrame or LazyFrame with a marker column
+    :param marker_col: Name of the marker column
+    :return: Same frame with the 'chromosome' and 'position' columns added
+    """
+    frame = frame.with_columns(pl.col(marker_col).str.split_exact(":", 1)
+                               .struct.rename_fields(["chromosome", "position"])
+                               .alias("_decoded_marker")).unnest("_decoded_marker")
+
+    contig = pl.col("chromosome").str.strip_prefix("chr")
+    # Anything after the position, e.g. '_A_G' allele suffixes, is dropped. ':A:G' suffixes never reach this column.
+    position = pl.col("position").str.split_exact("_", 0).struct.field("field_0")
+
+    return frame.with_columns([contig.replace(CHROMOSOME_CODES, default=contig.cast(pl.Int64, strict=False))
+                               .alias("chromosome"),
+                               position.cast(pl.Int64, strict=False).alias("position")])
+
+
+def recode_chrx_marker_expr(marker_col: str = "Marker") -> pl.Expr:
+    """
+    Expression rewriting 'chrX:<pos>' markers to 'chr23:<pos>'. This is the format the pipeline has always written to
+    the Marker column of its output tables.
+    """
+    return pl.col(marker_col).str.replace("chrX:", "chr23:", literal=True)
@@ -0,0 +1,108 @@
+import os
+import argparse
+
+import numpy as np
+import polars as pl
+
+from pvalues import chi2_to_pval, chi2_to_neg_log10_pval
+from marker_parsing import recode_chrx_marker_expr
+from sumstats_store import parse_region
+from variant_info_store import open_variant_info_store, lookup_variants
+from trait_matrix import open_trait_matrix, read_matrix_rows, rows_of_variant_keys, rows_in_region
+from table_io import write_table
+
+"""
+PheWAS-style lookup: the results of one or more variants across all the traits, read from the cross-trait matrix built
+by 'trait_matrix.py'. Variants can be given by ID, or by region (all the variants within it).
+
+The output has one row per variant and trait, with the columns ID, Marker, chromosome, position, phenotype, beta, chi2,
+pval and neg_log10_pval, sorted by position and then by p-value. Traits with no result for a variant are left out.
+
+Usage: python phewas.py /path/to/trait_matrix /path/to/variant_info_extended.txt -i rs123 rs456 -p 1e-4
+"""
+
+PHEWAS_COLUMNS = ["ID", "Marker", "chromosome", "position", "phenotype", "beta", "chi2", "pval", "neg_log10_pval"]
+
+
+def phewas(matrix: dict, store_df: pl.DataFrame, ids: list = None, regions: list = None,
+           pval_thresh: float = None) -> pl.DataFrame:
+    """
+    Results of the given variants across all the traits of the matrix.
+
+    :param matrix: Matrix, as returned by trait_matrix.open_trait_matrix()
+    :param store_df: Variant info store the matrix was built from, see variant_info_store.open_variant_info_store()
+    :param ids: OPTIONAL. IDs of the variants. IDs that are not in the variant info store are left out.
+    :param regions: OPTIONAL. Regions, either as strings ('chr1:1000000-2000000') or as (chromosome, start, end) tuples
+    :param pval_thresh: OPTIONAL. Only keep the results with a p-value below this threshold
+    :return: DataFrame with the PHEWAS_COLUMNS, in long format
+    """
+    variant_keys = [lookup_variants(store_df, pl.Series(ids or [], dtype=pl.Utf8))["variant_key"].to_numpy()]
+    for region in regions or []:
+        chromosome, start, end = parse_region(region) if isinstance(region, str) else region
+        variant_keys.append(matrix["variant_keys"][rows_in_region(matrix, chromosome, start, end)])
+    variant_keys = np.unique(np.concatenate(variant_keys).astype(np.int64))
+
+    rows = rows_of_variant_keys(matrix, variant_keys)
+    values = read_matrix_rows(matrix, rows)
+    traits = matrix["traits"]
+
+    # Long format: one row per variant and trait. Traits with no result (NaN) are dropped.
+    variant_index = np.repeat(np.arange(len(variant_keys)), len(traits))
+    trait_index = np.tile(np.arange(len(traits)), len(variant_keys))
+    chi2 = values["chi2"].ravel().astype(np.float64)
+    found = ~np.isnan(chi2)
+    if pval_thresh is not None:
+        found &= chi2_to_pval(chi2) < pval_thresh
+    variant_index, trait_index, chi2 = variant_index[found], trait_index[found], chi2[found]
+
+    phewas_df = store_df[variant_keys[variant_index]].select(["ID", "Marker", "chromosome", "position"])
+    phewas_df = phewas_df.with_columns([pl.Series("phenotype", traits, dtype=pl.Utf8)[trait_index],
+                                        pl.Series("beta", values["beta"].ravel()[found].astype(np.float64)),
+                                        pl.Series("chi2", chi2),
+                                        pl.Series("pval", chi2_to_pval(chi2)),
+                                        pl.Series("neg_log10_pval", chi2_to_neg_log10_pval(chi2))])
+    return (phewas_df.with_columns(recode_chrx_marker_expr())
+            .sort(["chromosome", "position", "ID", "neg_log10_pval"], descending=[False, False, False, True])
+            .select(PHEWAS_COLUMNS))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Look up variants across all the traits of a trait matrix (see "
+                                                 "'trait_matrix.py').")
+    parser.add_argument("matrix_dir",
+                        metavar="FOLDER_PATH",
+                        help="Path to the trait matrix folder.")
+    parser.add_argument("variant_info_file",
+                        metavar="FILEPATH",
+                        help="Path to the variant info file the matrix was built from.")
+    parser.add_argument("-i", "--ids", nargs="+", default=[],
+                        help="IDs of the variants to look up.")
+    parser.add_argument("-r", "--regions", nargs="+", default=[],
+                        help="Regions to look up all the variants of, e.g. chr1:1000000-1001000. Start and end are "
+                             "included.")
+    parser.add_argument("-p", "--pval_thresh", type=float,
+                        help="OPTIONAL. Only output the results with a p-value below this threshold, e.g. 1e-4.")
+    parser.add_argument("-s", "--variant_info_store",
+                        help="OPTIONAL. Path to the variant info store (see 'variant_info_store.py'). Default: the "
+                             "variant info file path with the '.arrow' extension.")
+    parser.add_argument("-o", "--output_file",
+                        help="OPTIONAL. Path to the output file (tab-separated, or Parquet / Arrow IPC by extension, "
+                             "see 'table_io.py'). Default: print the results to the console.")
+
+    args = parser.parse_args()
+
+    # Input validation
+    if not os.path.isfile(args.variant_info_file):
+        raise ValueError(f"Variant info file {args.variant_info_file} does not exist")
+    if not args.ids and not args.regions:
+        raise ValueError("No variants given. Use -i and/or -r.")
+
+    trait_matrix = open_trait_matrix(args.matrix_dir, args.variant_info_file, args.variant_info_store)
+    phewas_df = phewas(trait_matrix, open_variant_info_store(args.variant_info_file, args.variant_info_store),
+                       args.ids, args.regions, args.pval_thresh)
+    if args.output_file:
+        write_table(phewas_df, args.output_file)
+        print(f"Found {phewas_df.height} results. Written to {args.output_file}")
+    else:
+        with pl.Config(tbl_rows=-1, tbl_cols=-1):
+            print(phewas_df)
@@ -24,7 +24,14 @@ fi
 
 # Global path of this script (credit: https://stackoverflow.com/questions/24112727/relative-paths-based-on-file-location-instead-of-current-working-directory)
 parent_path=$( cd "$(dirname "${BASH_SOURCE[0]}")" ; pwd -P )
-number_of_aliases=$( awk -f $parent_path/utils/count_aliases.awk $1 )
+# The number of aliases is read from the alias table written next to the input file by the pipeline. Like
+# utils/count_aliases.awk, the header line is counted too. Only if the table is missing is the whole input file scanned.
+alias_table="${1%.*}.aliases.txt"
+if [ -f "$alias_table" ]; then
+    number_of_aliases=$( wc -l < "$alias_table" )
+else
+    number_of_aliases=$( awk -f $parent_path/utils/count_aliases.awk $1 )
+fi
 color_list=$( python $parent_path/utils/pick_colors.py "$number_of_aliases")
 
 # $1 E.g. "/home/antton/Projects/Immune_GWAS/data/processed/BloodVariome_Taravero_preliminary_GWAS_2022-10-29/Frequency_and_Ratio/combined_manhattan.txt"\
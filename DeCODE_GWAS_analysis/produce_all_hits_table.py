@@ -1,76 +1,236 @@
 import os
 import sys
+import json
 import polars as pl
 import argparse
 
+from extract_variants_by_pval import HITS_COLUMNS
+from variant_info_store import source_fingerprint, hash_file
+from table_io import TABLE_FORMATS, is_table_file, scan_table, table_file_name, write_table
+
 """
 This script combines all the summary statistics files produced by 'extract_variants_by_pval.py' into a single file.
+
+All the hit tables are scanned lazily and parsed in parallel, and concatenated only once at the end.
+
+The hit tables can be in any of the formats of 'table_io.py' (tab-separated text, Parquet or Arrow IPC), and so can the
+output (-f/--output_format).
+
+With the -c/--cache_dir option, the parsed tables are also kept as Arrow IPC files in a cache directory, together with a
+manifest of the size, modification time and hash of every input file. On the next run only the tables that changed (e.g.
+a single trait that was re-delivered) are parsed again; the others are memory-mapped from the cache.
 """
 
-parser = argparse.ArgumentParser(description="Combine all summary statistics files produced by "
-                                             "'extract_variants_by_pval.py' into one.")
-parser.add_argument("files_filepath",
-                    metavar="FOLDER_PATH",
-                    help="Path to the directory containing the files to be merged.")
-parser.add_argument("gwas_run_name",
-                    metavar="GWAS_RUN_NAME",
-                    help="Name of the GWAS run. This is used to name the output file.")
-parser.add_argument("-p", "--pval_threshold", default="", type=str,
-                    help="P-value threshold that was used when filtering variants. This is used to name the output"
-                         " file. If non is given none will be added to the file name.")
-parser.add_argument("-r", "--include_repeats", action="store_true",
-                    help="by default, only the most significant phenotype will be included in the final file. If this "
-                         "flag is present, all the significant associations for each variant will be included instead.")
-parser.add_argument("-o", "--output_filepath",
-                    help="Path to the directory where the output file will be written to.")
-
-args = parser.parse_args()
-
-full_hits_table_df = pl.DataFrame()
-
-if not os.path.exists(args.files_filepath):
-    raise ValueError("The given directory is empty.")
-
-# Iterate through the files, concat contents into a df
-num_all_tables = len(os.listdir(args.files_filepath))
-for i, hit_table_file in enumerate(os.listdir(args.files_filepath)):
-    if hit_table_file.endswith('.tsv') or hit_table_file.endswith('.txt'):
-        # Table made from current file
-        table_df = pl.read_csv(args.files_filepath + '/' + hit_table_file, sep="\t",
-                               columns=["ID", "beta", "chi2", "pval", "Marker", "chromosome", "position", "OA", "EA",
-                                        "EAF", "Info", "phenotype"])
-        if table_df.is_empty():
-            continue
-        full_hits_table_df = pl.concat([full_hits_table_df, table_df])
-
-        if (num_all_tables > 100) & (i % 100 == 0):  # Print every 100 if # of files > 100 files, every 10 if < 100
-            print(f"Table  {i} / {num_all_tables}")
-        elif (num_all_tables < 100) & (i % 10 == 0):
-            print(f"Table  {i} / {num_all_tables}")
-else:
-    print(f"Table  {i+1} / {num_all_tables}\nDONE!")
-
-if args.pval_threshold != "":
-    pval_threshold_str = "_10E" + args.pval_threshold
-else:
-    pval_threshold_str = ""
-
-if not args.include_repeats:  # Each variant only once
-    # For each row with the same ID, keep the one with the lowest p-value. See README for more info.
-    # This is the default behaviour.
-    # TODO: ensure this works correctly
-    full_hits_table_df = full_hits_table_df.sort(['pval']).groupby('ID').head(1)  # First is smallest after sorting
-    full_hits_table_df = full_hits_table_df.sort(['chromosome', 'position'])
-
-    hit_table_file_name = f'{args.gwas_run_name}_hits_only{pval_threshold_str}_one_pheno_only_per_variant.txt'
-    print("Rows of the final table that contains all hits (counting each variant only once): ",
-          len(full_hits_table_df["ID"]))
-
-else:  # each variant can appear multiple times if it has multiple associations with different phenotypes
-    full_hits_table_df = full_hits_table_df.sort(['chromosome', 'position'])
-    hit_table_file_name = f'{args.gwas_run_name}_hits_only{pval_threshold_str}_all_phenotypes_per_variant.txt'
-    print("Rows of the final table that contains all hits (same variant can be counted several times): ",
-          len(full_hits_table_df["ID"]))
-
-# Save the final table to file
-full_hits_table_df.write_csv(args.output_filepath + '/' + hit_table_file_name, sep="\t")
+HITS_DTYPES = {"ID": pl.Utf8, "beta": pl.Float64, "chi2": pl.Float64, "pval": pl.Float64, "Marker": pl.Utf8,
+               "chromosome": pl.Int64, "position": pl.Int64, "OA": pl.Utf8, "EA": pl.Utf8, "EAF": pl.Float64,
+               "Info": pl.Float64, "phenotype": pl.Utf8, "variant_key": pl.Int64}
+MANIFEST_FILE = "manifest.json"
+
+
+def list_hit_tables(files_dir: str) -> list:
+    """Names of the hit tables in the directory (in any of the formats of 'table_io.py'), sorted."""
+    return sorted(file for file in os.listdir(files_dir) if is_table_file(file))
+
+
+def scan_hit_table(hit_table_file: str) -> pl.LazyFrame:
+    return scan_table(hit_table_file, HITS_DTYPES).select(HITS_COLUMNS)
+
+
+def file_is_unchanged(filepath: str, fingerprint: dict) -> bool:
+    """
+    Compare a file against its fingerprint in the manifest. The file is only hashed if its size or mtime changed, and
+    the fingerprint is refreshed in place if the contents turn out to be the same.
+    """
+    if fingerprint is None:
+        return False
+    current = source_fingerprint(filepath, with_hash=False)
+    if current["size"] == fingerprint["size"] and current["mtime_ns"] == fingerprint["mtime_ns"]:
+        return True
+    if current["size"] != fingerprint["size"] or hash_file(filepath) != fingerprint["hash"]:
+        return False
+    fingerprint.update(current)  # Same contents, only refresh the mtime
+    return True
+
+
+def update_hits_cache(files_dir: str, hit_table_files: list, cache_dir: str) -> list:
+    """
+    Bring the cache directory up to date with the hit tables: parse the new and changed tables (all at once, in
+    parallel), and drop the tables that are not in the input directory anymore.
+
+    :param files_dir: Path to the directory containing the hit tables
+    :param hit_table_files: Names of the hit tables to combine
+    :param cache_dir: Path to the cache directory. It is created if it does not exist.
+    :return: Paths to the cached Arrow IPC file of every hit table, in the same order as 'hit_table_files'
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    manifest_path = os.path.join(cache_dir, MANIFEST_FILE)
+    manifest = {}
+    if os.path.isfile(manifest_path):
+        with open(manifest_path, "r") as f:
+            manifest = json.load(f)
+
+    cached_files = [os.path.join(cache_dir, file + ".arrow") for file in hit_table_files]
+    changed = [i for i, file in enumerate(hit_table_files)
+               if not (os.path.isfile(cached_files[i]) and
+                       file_is_unchanged(os.path.join(files_dir, file), manifest.get(file)))]
+    sys.stdout.write(f"{len(hit_table_files) - len(changed)} hit tables are up to date in the cache, "
+                     f"{len(changed)} will be parsed.\n")
+
+    for file in set(manifest) - set(hit_table_files):  # Tables that were removed from the input directory
+        del manifest[file]
+        if os.path.isfile(os.path.join(cache_dir, file + ".arrow")):
+            os.remove(os.path.join(cache_dir, file + ".arrow"))
+
+    parsed_tables = pl.collect_all([scan_hit_table(os.path.join(files_dir, hit_table_files[i])) for i in changed])
+    for i, table_df in zip(changed, parsed_tables):
+        # Fingerprint first, so that a table modified while it is parsed is picked up again on the next run
+        manifest[hit_table_files[i]] = source_fingerprint(os.path.join(files_dir, hit_table_files[i]))
+        table_df.write_ipc(cached_files[i] + ".tmp", compression="uncompressed")
+        os.replace(cached_files[i] + ".tmp", cached_files[i])
+
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    return cached_files
+
+
+def scan_all_hit_tables(files_dir: str, cache_dir: str = None) -> list:
+    """
+    One LazyFrame per hit table, in the order of the sorted file names.
+
+    :param files_dir: Path to the directory containing the hit tables
+    :param cache_dir: OPTIONAL. Path to the cache directory, to only parse the tables that changed since the last run
+    :return: List of LazyFrames
+    """
+    hit_table_files = list_hit_tables(files_dir)
+    if cache_dir is None:
+        return [scan_hit_table(os.path.join(files_dir, file)) for file in hit_table_files]
+    return [pl.scan_ipc(file, memory_map=True) for file in update_hits_cache(files_dir, hit_table_files, cache_dir)]
+
+
+def empty_hits_table() -> pl.DataFrame:
+    return pl.DataFrame(schema={column: HITS_DTYPES[column] for column in HITS_COLUMNS})
+
+
+def read_all_hit_tables(files_dir: str, cache_dir: str = None) -> pl.DataFrame:
+    """
+    Read all the hit tables into a single DataFrame, with a single concatenation at the end.
+
+    :param files_dir: Path to the directory containing the hit tables
+    :param cache_dir: OPTIONAL. Path to the cache directory, to only parse the tables that changed since the last run
+    :return: DataFrame with all the hits, in the order of the sorted file names
+    """
+    sources = scan_all_hit_tables(files_dir, cache_dir)
+    if len(sources) == 0:
+        return empty_hits_table()
+    return pl.concat(sources, parallel=True).collect()
+
+
+def top_hit_per_variant(hits_df: pl.DataFrame) -> pl.DataFrame:
+    """
+    Keep a single row per variant: the strongest association. Ties are broken deterministically:
+
+        1. highest chi2 (p-values underflow to 0.0 for chi2 above ~1400, so they cannot rank the strongest hits)
+        2. then lowest p-value
+        3. then the phenotype that comes first alphabetically
+        4. then the row that comes first in the input (only exact duplicates are left at this point)
+
+    Rows are grouped by 'variant_key' (and by ID as well, so that variants missing from the variant info store, which
+    have no key, are not merged together). The reduction uses hash-based window aggregates, so the table is not sorted.
+
+    :param hits_df: DataFrame with the hits, with the HITS_COLUMNS columns
+    :return: DataFrame with one row per variant, in the order of the input
+    """
+    variant = ["variant_key", "ID"]
+    hits_df = hits_df.filter(pl.col("chi2") == pl.col("chi2").max().over(variant))
+    hits_df = hits_df.filter(pl.col("pval") == pl.col("pval").min().over(variant))
+    hits_df = hits_df.filter(pl.col("phenotype") == pl.col("phenotype").min().over(variant))
+    return hits_df.unique(subset=variant, keep="first", maintain_order=True)
+
+
+def reduce_top_hits(sources: list, batch_size: int = 50) -> pl.DataFrame:
+    """
+    Stream the hit tables in batches of 'batch_size' tables and fold them into the best row per variant (see
+    top_hit_per_variant()), so that only one row per variant plus one batch of tables is held in memory at a time. The
+    result does not depend on the batch size. It is sorted once at the end by chromosome, position and variant key.
+
+    :param sources: LazyFrames of the hit tables, as returned by scan_all_hit_tables()
+    :param batch_size: Number of tables read at the same time
+    :return: DataFrame with one row per variant
+    """
+    top_hits_df = empty_hits_table()
+    for i in range(0, len(sources), batch_size):
+        batch_df = pl.concat(sources[i:i + batch_size], parallel=True).collect()
+        top_hits_df = top_hit_per_variant(pl.concat([top_hits_df, batch_df]))
+    return top_hits_df.sort(["chromosome", "position", "variant_key"], nulls_last=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Combine all summary statistics files produced by "
+                                                 "'extract_variants_by_pval.py' into one.")
+    parser.add_argument("files_filepath",
+                        metavar="FOLDER_PATH",
+                        help="Path to the directory containing the files to be merged.")
+    parser.add_argument("gwas_run_name",
+                        metavar="GWAS_RUN_NAME",
+                        help="Name of the GWAS run. This is used to name the output file.")
+    parser.add_argument("-p", "--pval_threshold", default="", type=str,
+                        help="P-value threshold that was used when filtering variants. This is used to name the output"
+                             " file. If non is given none will be added to the file name.")
+    parser.add_argument("-r", "--include_repeats", action="store_true",
+                        help="by default, only the most significant phenotype will be included in the final file. If "
+                             "this flag is present, all the significant associations for each variant will be included "
+                             "instead.")
+    parser.add_argument("-c", "--cache_dir",
+                        help="OPTIONAL. Directory where the parsed hit tables are cached between runs. Only the tables "
+                             "that changed since the last run are parsed again.")
+    parser.add_argument("-b", "--batch_size", type=int, default=50,
+                        help="Number of hit tables read at the same time when keeping only the most significant "
+                             "phenotype per variant. Default: 50")
+    parser.add_argument("-f", "--output_format", choices=list(TABLE_FORMATS), default="tsv",
+                        help="Format of the output file: tab-separated text, or zstd-compressed Parquet or Arrow IPC. "
+                             "Default: tsv")
+    parser.add_argument("-t", "--tsv_export_filepath",
+                        help="OPTIONAL. Directory where a tab-separated copy of the output file is written to, when "
+                             "the output is Parquet or Arrow IPC.")
+    parser.add_argument("-o", "--output_filepath",
+                        help="Path to the directory where the output file will be written to.")
+
+    args = parser.parse_args()
+
+    if not os.path.exists(args.files_filepath):
+        raise ValueError("The given directory is empty.")
+
+    if args.batch_size < 1:
+        raise ValueError("The batch size must be at least 1.")
+
+    hit_table_sources = scan_all_hit_tables(args.files_filepath, args.cache_dir)
+
+    if args.pval_threshold != "":
+        pval_threshold_str = "_10E" + args.pval_threshold
+    else:
+        pval_threshold_str = ""
+
+    if not args.include_repeats:  # Each variant only once
+        # For each variant, keep the row with the highest chi2. See README and top_hit_per_variant() for more info.
+        # This is the default behaviour. Variants are grouped by their integer 'variant_key' instead of the string ID.
+        full_hits_table_df = reduce_top_hits(hit_table_sources, args.batch_size)
+
+        hit_table_name = f'{args.gwas_run_name}_hits_only{pval_threshold_str}_one_pheno_only_per_variant'
+        print("Rows of the final table that contains all hits (counting each variant only once): ",
+              len(full_hits_table_df["ID"]))
+
+    else:  # each variant can appear multiple times if it has multiple associations with different phenotypes
+        if len(hit_table_sources) == 0:
+            full_hits_table_df = empty_hits_table()
+        else:
+            full_hits_table_df = pl.concat(hit_table_sources, parallel=True).collect()
+        full_hits_table_df = full_hits_table_df.sort(['chromosome', 'position', 'phenotype'], nulls_last=True)
+        hit_table_name = f'{args.gwas_run_name}_hits_only{pval_threshold_str}_all_phenotypes_per_variant'
+        print("Rows of the final table that contains all hits (same variant can be counted several times): ",
+              len(full_hits_table_df["ID"]))
+
+    # Save the final table to file
+    write_table(full_hits_table_df, os.path.join(args.output_filepath, table_file_name(hit_table_name,
+                                                                                       args.output_format)))
+    if args.tsv_export_filepath:  # Human-readable copy
+        write_table(full_hits_table_df, os.path.join(args.tsv_export_filepath, table_file_name(hit_table_name)))
@@ -1,14 +1,27 @@
 import os
 
 import polars as pl
-from scipy.stats import chi2
 import argparse
 
+from pvalues import chi2_to_pval, chi2_to_neg_log10_pval
+from marker_parsing import recode_chrx_marker_expr
+from variant_info_store import scan_variant_info_store
+from table_io import TABLE_FORMATS, table_file_name, write_table
+from gwas_file_reader import scan_gwas_file, list_gwas_files
+from sumstats_store import write_sumstats_store
+
 """
 This script takes a 'variant_info.txt' file and a GWAS output .rse file (ID, beta and chi-square columns), and combines
 them to produce a full summary statistics file. The columns of the output file are: ID, beta, chi2, pval, Marker,
-chromosome, position, OA, EA, EAF, Info and	phenotype.
-Note that this script might take a while to run, as it needs to do calculations for each row of the GWAS output file.
+chromosome, position, OA, EA, EAF, Info, phenotype and variant_key (integer key of the variant in the variant info
+store, used by later steps to join on instead of ID).
+P-values are computed for the whole column at once. Use the -l flag to also add a 'neg_log10_pval' column, which stays
+accurate for the strongest hits whose p-value underflows to 0.
+The variant info is read from the memory-mapped store built by 'variant_info_store.py', which must be up to date.
+The GWAS output file can be gzipped (.res.gz). The output is tab-separated by default. Use -f to write it as
+zstd-compressed Parquet or Arrow IPC instead.
+Use -d to add the trait to a summary statistics store instead (or as well), partitioned by chromosome and sorted by
+position for region queries (see 'sumstats_store.py').
 """
 
 parser = argparse.ArgumentParser(description="Extract the contents of a 'variant_info.txt' and a '.res' file into a"
@@ -18,44 +31,67 @@ parser.add_argument("variant_info_file",
                     help="Path to the variant info file.")
 parser.add_argument("files_filepath",
                     metavar="FOLDER_PATH",
-                    help="Path to the directory containing the GWAS output files.")
+                    help="Path to the directory containing the GWAS output files, or to a single GWAS output file.")
+parser.add_argument("-l", "--neg_log10_pval", action="store_true",
+                    help="Add a 'neg_log10_pval' column computed directly from chi2.")
+parser.add_argument("-s", "--variant_info_store",
+                    help="OPTIONAL. Path to the variant info store (see 'variant_info_store.py'). It must be built and "
+                         "up to date. Default: the variant info file path with the '.arrow' extension.")
+parser.add_argument("-f", "--output_format", choices=list(TABLE_FORMATS), default="tsv",
+                    help="Format of the output file: tab-separated text, or zstd-compressed Parquet or Arrow IPC. "
+                         "Default: tsv")
+parser.add_argument("-d", "--store_dir",
+                    help="OPTIONAL. Path to a summary statistics store (see 'sumstats_store.py'). The trait is added to "
+                         "it, replacing any previous version.")
 parser.add_argument("-o", "--output_filepath",
-                    help="Path to the directory where the output file will be written to.")
+                    help="Path to the directory where the output file will be written to. Not needed if the trait is "
+                         "only added to a store (-d).")
 
 args = parser.parse_args()
+if not args.output_filepath and not args.store_dir:
+    parser.error("one of -o/-d is required")
 
 # TODO: Input validation
 
-# Read variant info file, then merge it with the GWAS output file
-var_info_df = pl.read_csv(args.variant_info_file, sep='\t', columns=["ID", "Marker", "OA", "EA", "EAF", "Info"])
+# Memory-map the variant info store, then merge it with the GWAS output file
+var_info_lf = scan_variant_info_store(args.variant_info_file, args.variant_info_store)
 
-# TODO: Add the option to select the phenotype we want
-gwas_file_name = os.listdir(args.files_filepath)[0]  # We take the first file. It doesn't matter which one we take.
+# To select the phenotype we want, give its file instead of the directory
+gwas_file = list_gwas_files(args.files_filepath)[0]  # We take the first file. It doesn't matter which one we take.
+gwas_file_name = os.path.basename(gwas_file)
 print("Commencing generation of full summary statistics file. This can take several minutes.\n"
       f"The selected trait was {gwas_file_name}")
 
-gwas_df = pl.read_csv(args.files_filepath + '/' + gwas_file_name, has_header=False,
-                      new_columns=["ID", "beta", "chi2"], sep=" ")
+# Gzipped files are decompressed as a stream, see 'gwas_file_reader.py'
+gwas_df = scan_gwas_file(gwas_file).collect()
 
 print("Finished loading GWAS output file. Adding p-values column...")
 # Add 'pval' column
-gwas_df.insert_at_idx(3, pl.Series("pval", [chi2.sf(x, 1) for x in gwas_df["chi2"]]))
+gwas_df.insert_column(3, pl.Series("pval", chi2_to_pval(gwas_df["chi2"].to_numpy())))
 
 print("Commencing merge with variant info file...")
 # Merge with variant info
-gwas_df = gwas_df.join(var_info_df, on="ID", how="left")
-
-# Add chromosome and position columns, and sort the table with them.
-# We replace 'chrX' with 'chr23' to allow sorting. We assume marker format to be chr<chr>:<pos>
-gwas_df = gwas_df.with_column(pl.col("Marker").apply(lambda x: "chr23" + x[4:] if x.startswith("chrX") else x))
-gwas_df.insert_at_idx(5, pl.Series("chromosome", [int(x.split(':')[0][3:]) for x in gwas_df["Marker"]]))
-gwas_df.insert_at_idx(6, pl.Series("position", [int(x.split(':')[1]) for x in gwas_df["Marker"]]))
-gwas_df = gwas_df.sort(["chromosome", "position"])
+# The store already has the chromosome and position columns. We sort the table with them.
+# We replace 'chrX' with 'chr23' in the Marker column, as the pipeline has always done.
+gwas_df = gwas_df.lazy().join(var_info_lf, on="ID", how="left").collect()
+gwas_df = gwas_df.with_columns(recode_chrx_marker_expr())
+gwas_df = gwas_df.select(["ID", "beta", "chi2", "pval", "Marker", "chromosome", "position", "OA", "EA", "EAF", "Info",
+                          "variant_key"])
+gwas_df = gwas_df.sort(["chromosome", "position"], nulls_last=True)
 
 print("Almost done! Adding phenotype column...")
 # Add 'phenotype' column
 phenotype = '_'.join(gwas_file_name.rstrip('.txt').split('_')[4:-3])  # Phenotype name is only given by the file name
-gwas_df.hstack([pl.Series("phenotype", [phenotype] * gwas_df.height)], in_place=True)
+gwas_df = gwas_df.with_columns(pl.lit(phenotype).alias("phenotype"))
+gwas_df = gwas_df.select(pl.exclude("variant_key"), pl.col("variant_key"))  # Keep the same column order as the hits
+if args.neg_log10_pval:
+    gwas_df = gwas_df.with_columns(pl.Series("neg_log10_pval", chi2_to_neg_log10_pval(gwas_df["chi2"].to_numpy())))
 
-gwas_df.write_csv(args.output_filepath + '/template_manhattan.txt', sep='\t', has_header=True)
-print("Done! Full summary statistics file written to " + args.output_filepath + '/template_manhattan.txt')
+if args.store_dir:
+    store_files = write_sumstats_store(gwas_df, args.store_dir, phenotype)
+    print(f"Trait {phenotype} added to the summary statistics store {args.store_dir} "
+          f"({len(store_files)} chromosomes)")
+if args.output_filepath:
+    output_file = os.path.join(args.output_filepath, table_file_name('template_manhattan', args.output_format))
+    write_table(gwas_df, output_file)
+    print("Done! Full summary statistics file written to " + output_file)
@@ -0,0 +1,129 @@
+import os
+import math
+
+import polars as pl
+import argparse
+
+from extract_variants_by_pval import HITS_COLUMNS, phenotype_from_file_name
+from pvalues import pval_expr, neg_log10_pval_expr
+from marker_parsing import recode_chrx_marker_expr
+from variant_info_store import scan_variant_info_store
+from gwas_file_reader import scan_gwas_file, list_gwas_files
+from produce_all_hits_table import HITS_DTYPES
+from table_io import read_table
+from swap_in_hits_into_template_sumstats_file import add_alias_column, swap_in_hits, count_aliases, \
+    write_alias_table
+
+"""
+This script produces the input file of the Manhattan plot ('combined_manhattan.txt') straight from a GWAS output .res
+file and the table of hits, without going through the full-genome template file.
+
+The grey background of the plot is drawn from a single trait. Only a thinned-out version of it is kept:
+    - every variant with a p-value below the '--keep_pval' threshold (default 1e-3) is kept
+    - below that, the variants are binned by -log10(p), and each bin is sampled with its own fraction. The fraction goes
+      up log-linearly from '--background_fraction' (default 0.5%) at p = 1 to 100% at the '--keep_pval' threshold, so the
+      sparse upper part of the background, which is what can be seen in the plot, is left nearly untouched.
+The output is around 1-2% of the size of the template, with the same plot. Sampling is deterministic: a variant is kept
+or not depending on the hash of its ID, so the same variants are kept on every run.
+All the hits are then swapped in, as 'swap_in_hits_into_template_sumstats_file.py' does.
+"""
+
+
+def thin_background(gwas_lf: pl.LazyFrame, keep_pval: float = 1e-3, background_fraction: float = 0.005,
+                    bin_width: float = 0.1, seed: int = 0) -> pl.LazyFrame:
+    """
+    Stratified downsampling of the background variants by -log10(p) bins.
+
+    :param gwas_lf: LazyFrame with the 'ID' and 'chi2' columns of a GWAS output file
+    :param keep_pval: Variants with a p-value below this are all kept
+    :param background_fraction: Fraction of variants kept in the lowest -log10(p) bin
+    :param bin_width: Width of the -log10(p) bins
+    :param seed: Seed of the ID hash used to pick the variants
+    :return: Thinned LazyFrame, with a 'neg_log10_pval' column added
+    """
+    if not 0 < keep_pval < 1:
+        raise ValueError("The p-value threshold must be between 0 and 1.")
+    if not 0 <= background_fraction <= 1:
+        raise ValueError("The background fraction must be between 0 and 1.")
+
+    keep_neg_log10 = -math.log10(keep_pval)
+    bin_start = (pl.col("neg_log10_pval") / bin_width).floor() * bin_width
+    # background_fraction at -log10(p) = 0, 1 at -log10(p) = keep_neg_log10
+    bin_fraction = pl.lit(background_fraction).pow(1 - bin_start / keep_neg_log10)
+    uniform = pl.col("ID").hash(seed).cast(pl.Float64) / 2.0 ** 64  # Deterministic, uniform in [0, 1)
+
+    return gwas_lf.with_columns(neg_log10_pval_expr()).filter(
+        (pl.col("neg_log10_pval") >= keep_neg_log10) | (uniform < bin_fraction))
+
+
+def produce_background(variant_info_file: str, gwas_file: str, store_file: str = None, **thinning) -> pl.DataFrame:
+    """
+    Read a GWAS output .res file, thin it out (see thin_background()) and add the variant info, with the same columns as
+    the template file.
+
+    :param variant_info_file: Path to the variant info file
+    :param gwas_file: Path to the GWAS output .res file, plain or gzipped
+    :param store_file: Path to the variant info store. Default: see 'variant_info_store.py'
+    :param thinning: Keyword arguments of thin_background()
+    :return: Thinned background, with the HITS_COLUMNS columns, sorted by chromosome and position
+    """
+    # The thinning works row by row, so gzipped files are thinned out a chunk at a time as they are decompressed
+    background_lf = scan_gwas_file(gwas_file, lambda gwas_lf: thin_background(gwas_lf, **thinning))
+    background_lf = background_lf.with_columns(pval_expr())
+    background_lf = background_lf.join(scan_variant_info_store(variant_info_file, store_file), on="ID", how="left")
+    background_lf = background_lf.with_columns([recode_chrx_marker_expr(),
+                                                pl.lit(phenotype_from_file_name(gwas_file)).alias("phenotype"),
+                                                pl.col("variant_key").cast(pl.Int64)])  # Same type as in the hits
+    # Sorted like the template, for the sorted merge of the hits
+    return background_lf.select(HITS_COLUMNS).collect().sort(["chromosome", "position"], nulls_last=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Produce the input file of the Manhattan plot from a GWAS output file "
+                                                 "and the table of hits, keeping all the hits and a thinned-out "
+                                                 "background.")
+    parser.add_argument("variant_info_file",
+                        metavar="FILEPATH",
+                        help="Path to the variant info file.")
+    parser.add_argument("files_filepath",
+                        metavar="FOLDER_PATH",
+                        help="Path to the directory containing the GWAS output files. The first one is used as the "
+                             "background. A single GWAS output file can be given instead.")
+    parser.add_argument("hits_file",
+                        metavar="HITS_FILEPATH",
+                        help="Path to the table of hits produced by 'produce_all_hits_table.py' (tab-separated, "
+                             "Parquet or Arrow IPC).")
+    parser.add_argument('-a', '--alias_file', metavar="ALIAS_FILEPATH",
+                        help="Path to the file containing the aliases for the traits.")
+    parser.add_argument("-k", "--keep_pval", type=float, default=1e-3,
+                        help="All background variants with a p-value below this are kept. Default: 1e-3")
+    parser.add_argument("-f", "--background_fraction", type=float, default=0.005,
+                        help="Fraction of the background variants kept in the lowest -log10(p) bin. Default: 0.005")
+    parser.add_argument("-b", "--bin_width", type=float, default=0.1,
+                        help="Width of the -log10(p) bins. Default: 0.1")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Seed used to pick the background variants. Default: 0")
+    parser.add_argument("-s", "--variant_info_store",
+                        help="OPTIONAL. Path to the variant info store (see 'variant_info_store.py'). It must be built "
+                             "and up to date. Default: the variant info file path with the '.arrow' extension.")
+    parser.add_argument("-o", "--output_filepath",
+                        help="Path to the directory where the output file will be written to.")
+
+    args = parser.parse_args()
+
+    # To select the phenotype we want, give its file instead of the directory
+    gwas_file = list_gwas_files(args.files_filepath)[0]  # It doesn't matter which one we take.
+    print(f"Thinning out the background from {os.path.basename(gwas_file)}...")
+    background_df = produce_background(args.variant_info_file, gwas_file,
+                                       args.variant_info_store, keep_pval=args.keep_pval,
+                                       background_fraction=args.background_fraction, bin_width=args.bin_width,
+                                       seed=args.seed)
+    print(f"Kept {background_df.height} background variants.")
+
+    hits_df = read_table(args.hits_file, HITS_DTYPES, HITS_COLUMNS)
+    hits_df = add_alias_column(hits_df, args.alias_file)
+
+    out_df = swap_in_hits(background_df, hits_df)
+    out_df.write_csv(args.output_filepath + '/combined_manhattan.txt', separator='\t')
+    write_alias_table(count_aliases(out_df), args.output_filepath + '/combined_manhattan.txt')
+    print("Done! Manhattan plot input written to " + args.output_filepath + '/combined_manhattan.txt')
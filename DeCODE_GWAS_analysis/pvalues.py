@@ -0,0 +1,73 @@
+import numpy as np
+import polars as pl
+from scipy.special import log_ndtr
+from scipy.stats import chi2
+
+"""
+Vectorized conversions between chi-square statistics (1 degree of freedom) and p-values.
+
+Every function works on whole buffers (numpy arrays, polars Series or anything numpy can view, like Arrow arrays), so
+there is a single call into scipy per column instead of one per row.
+
+For very large chi2 values the p-value underflows to 0 in double precision (around chi2 > 1400). The -log10(p) is
+therefore computed directly from the log of the normal CDF instead of taking the log of the p-value, which keeps it
+exact in the tail.
+"""
+
+LN_10 = np.log(10)
+
+
+def chi2_to_pval(chi2_values) -> np.ndarray:
+    """
+    Convert chi-square statistics with 1 degree of freedom to p-values.
+
+    :param chi2_values: Array-like of chi2 values
+    :return: numpy array with the p-values
+    """
+    return chi2.sf(np.asarray(chi2_values, dtype=np.float64), 1)
+
+
+def pval_to_chi2(pvals) -> np.ndarray:
+    """
+    Convert p-values to the chi-square statistic with 1 degree of freedom. Used to turn p-value thresholds into chi2
+    thresholds.
+
+    :param pvals: Array-like of p-values (or a single p-value)
+    :return: numpy array with the chi2 values
+    """
+    return chi2.isf(np.asarray(pvals, dtype=np.float64), 1)
+
+
+def chi2_to_neg_log10_pval(chi2_values) -> np.ndarray:
+    """
+    Convert chi-square statistics with 1 degree of freedom straight to -log10(p), without going through the p-value.
+    With 1 df, p = 2 * Phi(-sqrt(chi2)), so log(p) = log(2) + log_ndtr(-sqrt(chi2)). log_ndtr does not underflow, so
+    the result is still accurate where chi2.sf() returns 0.
+
+    :param chi2_values: Array-like of chi2 values
+    :return: numpy array with the -log10(p) values
+    """
+    z = np.sqrt(np.asarray(chi2_values, dtype=np.float64))
+    return -(np.log(2) + log_ndtr(-z)) / LN_10
+
+
+def pval_to_neg_log10(pvals) -> np.ndarray:
+    """
+    Convert p-values to -log10(p). P-values of 0 are turned into inf, so use chi2_to_neg_log10_pval() instead if the
+    chi2 values are available.
+
+    :param pvals: Array-like of p-values
+    :return: numpy array with the -log10(p) values
+    """
+    with np.errstate(divide="ignore"):
+        return -np.log10(np.asarray(pvals, dtype=np.float64))
+
+
+def pval_expr(chi2_col: str = "chi2", name: str = "pval") -> pl.Expr:
+    """Polars expression computing the p-value from a chi2 column, one scipy call per batch."""
+    return pl.col(chi2_col).map_batches(lambda s: pl.Series(chi2_to_pval(s.to_numpy()))).alias(name)
+
+
+def neg_log10_pval_expr(chi2_col: str = "chi2", name: str = "neg_log10_pval") -> pl.Expr:
+    """Polars expression computing -log10(p) from a chi2 column, one scipy call per batch."""
+    return pl.col(chi2_col).map_batches(lambda s: pl.Series(chi2_to_neg_log10_pval(s.to_numpy()))).alias(name)
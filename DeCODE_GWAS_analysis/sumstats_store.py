@@ -0,0 +1,163 @@
+import os
+import shutil
+import argparse
+
+import polars as pl
+
+from marker_parsing import CHROMOSOME_CODES
+from table_io import COMPRESSION, read_table, write_table
+
+"""
+Store of full summary statistics, for region queries ("all the variants in chr:start-end for these traits").
+
+Every trait has its own folder in the store, with one Parquet file per chromosome, sorted by position:
+
+    <store>/<phenotype>/chr1.parquet, chr2.parquet, ..., chr23.parquet
+
+The files are written in small row groups, and Parquet keeps the minimum and maximum position of every row group. A
+region query only opens the files of the chromosomes it asks for, and the position filter is checked against those
+statistics, so only the row groups that overlap the region are read and decompressed. Querying a few regions is then a
+matter of milliseconds per trait, whatever the size of the files.
+
+The store is written by 'produce_full_sumstats_for_single_trait.py' (option -d). Variants with no chromosome (not in the
+variant info file, or on contigs with no numeric code) can't be queried by region and are left out.
+
+Usage: python sumstats_store.py /path/to/sumstats_store -r chr1:1000000-2000000 chrX:5000-6000 -p Trait_A Trait_B
+"""
+
+ROW_GROUP_SIZE = 65536  # Rows per row group. Smaller groups make region queries read less, but the files larger.
+REGION_SCHEMA = {"region": pl.UInt32, "chrom": pl.Int64, "chromStart": pl.Int64, "chromEnd": pl.Int64}
+
+
+def chromosome_file(store_dir: str, phenotype: str, chromosome: int) -> str:
+    return os.path.join(store_dir, phenotype, f"chr{chromosome}.parquet")
+
+
+def write_sumstats_store(sumstats_df: pl.DataFrame, store_dir: str, phenotype: str = None,
+                         row_group_size: int = ROW_GROUP_SIZE) -> list:
+    """
+    Write the full summary statistics of a trait to the store, replacing any previous version of the trait.
+
+    :param sumstats_df: Full summary statistics, with (at least) the chromosome and position columns
+    :param store_dir: Path to the store
+    :param phenotype: OPTIONAL. Name of the trait in the store. Default: the value of the 'phenotype' column
+    :param row_group_size: Number of rows per row group
+    :return: Paths to the files written, one per chromosome
+    """
+    if phenotype is None:
+        phenotype = sumstats_df["phenotype"][0]
+    trait_dir = os.path.join(store_dir, phenotype)
+    if os.path.isdir(trait_dir):
+        shutil.rmtree(trait_dir)
+    os.makedirs(trait_dir)
+
+    store_files = []
+    sumstats_df = sumstats_df.filter(pl.col("chromosome").is_not_null())
+    for chromosome, chromosome_df in sorted(sumstats_df.partition_by("chromosome", as_dict=True).items()):
+        store_file = chromosome_file(store_dir, phenotype, chromosome)
+        chromosome_df.sort("position").write_parquet(store_file, compression=COMPRESSION,
+                                                     row_group_size=row_group_size, statistics=True)
+        store_files.append(store_file)
+    return store_files
+
+
+def list_store_phenotypes(store_dir: str) -> list:
+    """Traits in the store, sorted by name."""
+    if not os.path.isdir(store_dir):
+        raise ValueError(f"Summary statistics store {store_dir} does not exist")
+    return sorted(folder for folder in os.listdir(store_dir) if os.path.isdir(os.path.join(store_dir, folder)))
+
+
+def parse_region(region: str) -> tuple:
+    """
+    Chromosome, start and end of a region given as 'chr<chrom>:<start>-<end>'. The 'chr' prefix is optional, and the
+    sex and mitochondrial chromosomes get their numeric codes (see 'marker_parsing.py'). E.g. 'chrX:100-200' -> (23,
+    100, 200)
+    """
+    try:
+        chromosome, positions = region.split(":")
+        start, end = positions.replace(",", "").split("-")
+        chromosome = chromosome[3:] if chromosome.startswith("chr") else chromosome
+        chromosome, start, end = int(CHROMOSOME_CODES.get(chromosome, chromosome)), int(start), int(end)
+    except ValueError:
+        raise ValueError(f"Invalid region '{region}'. Regions must look like 'chr1:1000000-2000000'")
+    if start > end:
+        raise ValueError(f"Invalid region '{region}': the start is after the end")
+    return chromosome, start, end
+
+
+def read_regions_file(regions_file: str) -> list:
+    """Regions of a BED-like file with the chrom, chromStart and chromEnd columns, e.g. 'variant_regions.bed'."""
+    regions_df = read_table(regions_file, columns=["chrom", "chromStart", "chromEnd"])
+    return list(regions_df.iter_rows())
+
+
+def query_regions(store_dir: str, regions: list, phenotypes: list = None, columns: list = None) -> pl.DataFrame:
+    """
+    All the variants of the given traits within the given regions, in one go. The queries of all regions and traits
+    are collected together, so polars reads the files in parallel.
+
+    :param store_dir: Path to the store
+    :param regions: Regions, either as strings ('chr1:1000000-2000000') or as (chromosome, start, end) tuples. Start
+     and end are both included.
+    :param phenotypes: OPTIONAL. Traits to query. Default: all the traits in the store
+    :param columns: OPTIONAL. Columns of the summary statistics to return. Default: all
+    :return: DataFrame with the columns region, chrom, chromStart and chromEnd (the region the variant was found in),
+     followed by the summary statistics columns. Sorted by region, then in the order of 'phenotypes', then by position.
+    """
+    if phenotypes is None:
+        phenotypes = list_store_phenotypes(store_dir)
+    regions = [parse_region(region) if isinstance(region, str) else tuple(region) for region in regions]
+
+    region_lfs = []
+    for i, (chromosome, start, end) in enumerate(regions):
+        for phenotype in phenotypes:
+            store_file = chromosome_file(store_dir, phenotype, chromosome)
+            if not os.path.isfile(store_file):
+                continue
+            region_lf = pl.scan_parquet(store_file).filter(pl.col("position").is_between(start, end))
+            region_columns = [pl.lit(value, dtype).alias(name)
+                              for (name, dtype), value in zip(REGION_SCHEMA.items(), [i, chromosome, start, end])]
+            region_lfs.append(region_lf.select(region_columns + [pl.col(columns) if columns else pl.all()]))
+    if not region_lfs:
+        return pl.DataFrame(schema=REGION_SCHEMA)
+    return pl.concat(pl.collect_all(region_lfs), how="diagonal")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query the full summary statistics store for all the variants in a "
+                                                 "list of regions, across many traits.")
+    parser.add_argument("store_dir",
+                        metavar="FOLDER_PATH",
+                        help="Path to the summary statistics store (see 'produce_full_sumstats_for_single_trait.py').")
+    parser.add_argument("-r", "--regions", nargs="+", default=[],
+                        help="Regions to query, e.g. chr1:1000000-2000000 chrX:5000-6000. Start and end are included.")
+    parser.add_argument("-b", "--regions_file",
+                        help="OPTIONAL. BED-like file with the regions to query in its chrom, chromStart and chromEnd "
+                             "columns, e.g. 'variant_regions.bed'.")
+    parser.add_argument("-p", "--phenotypes", nargs="+",
+                        help="OPTIONAL. Traits to query. Default: all the traits in the store.")
+    parser.add_argument("-c", "--columns", nargs="+",
+                        help="OPTIONAL. Columns of the summary statistics to output. Default: all")
+    parser.add_argument("-o", "--output_file",
+                        help="OPTIONAL. Path to the output file (tab-separated, or Parquet / Arrow IPC by extension, "
+                             "see 'table_io.py'). Default: print the variants to the console.")
+
+    args = parser.parse_args()
+
+    # Input validation
+    if not os.path.isdir(args.store_dir):
+        raise ValueError(f"Summary statistics store {args.store_dir} does not exist")
+    if args.regions_file is not None and not os.path.isfile(args.regions_file):
+        raise ValueError(f"Regions file {args.regions_file} does not exist")
+    regions = args.regions + (read_regions_file(args.regions_file) if args.regions_file else [])
+    if not regions:
+        raise ValueError("No regions given. Use -r and/or -b.")
+
+    variants_df = query_regions(args.store_dir, regions, args.phenotypes, args.columns)
+    if args.output_file:
+        write_table(variants_df, args.output_file)
+        print(f"Found {variants_df.height} variants. Written to {args.output_file}")
+    else:
+        with pl.Config(tbl_rows=-1, tbl_cols=-1):
+            print(variants_df)
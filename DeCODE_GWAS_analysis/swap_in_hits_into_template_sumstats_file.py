@@ -1,73 +1,236 @@
 import os
 
+import numpy as np
 import polars as pl
 import argparse
 
-parser = argparse.ArgumentParser(description="Take a template summary statistics file and swap in the hits obtained"
-                                             " from GWAS. It takes a full summary statistics file for a single trait"
-                                             " and another file containing the GWAS hits from multiple traits. It then"
-                                             " swaps in the hits from the GWAS hits file into the full summary"
-                                             " statistics file. The resulting file can be used to generate a Manhattan"
-                                             " plot that will show all of the hits across several traits.")
-parser.add_argument("template_file",
-                    metavar="TEMPLATE_FILEPATH",
-                    help="Path to the template sumstats file.")
-parser.add_argument("hits_file",
-                    metavar="HITS_FILEPATH",
-                    help="Path to the directory containing the GWAS hits files.")
-parser.add_argument('-a', '--alias_file', metavar="ALIAS_FILEPATH",
-                    help="Path to the file containing the aliases for the traits.")
-parser.add_argument("-o", "--output_filepath",
-                    help="Path to the directory where the output file will be written to.")
-
-args = parser.parse_args()
-
-
-hits_df = pl.read_csv(args.hits_file, sep='\t',
-                      columns=["ID", "beta", "chi2", "pval", "Marker", "chromosome", "position", "OA", "EA",
-                               "EAF", "Info", "phenotype"])
-
-# If there is an alias file, read it and add the alias column to the hits_df
-if args.alias_file:
-    if not os.path.isfile(args.alias_file):
+from extract_variants_by_pval import HITS_COLUMNS
+from produce_all_hits_table import HITS_DTYPES
+from table_io import read_table, iter_table_batches
+
+"""
+This script takes a template summary statistics file (a full summary statistics file for a single trait) and a table of
+GWAS hits from multiple traits, and swaps in the hits into the template. The resulting file can be used to generate a
+Manhattan plot that will show all of the hits across several traits.
+
+Both files are sorted by chromosome and position, so the hits are swapped in with a sorted merge: the template is read
+and written one batch at a time, and its rows are replaced in place.
+"""
+
+NULL_CHROMOSOME_CODE = 2 ** 30  # Sort key of the rows without a chromosome, after every real chromosome
+
+
+def read_alias_table(alias_file: str) -> pl.DataFrame:
+    """
+    Read the alias file into a table used to assign an alias to each phenotype. Each line of the file has the phenotype
+    and its alias, separated by a comma. Phenotypes without an alias are given the alias 'Other'.
+
+    :param alias_file: Path to the alias file
+    :return: DataFrame with the columns 'phenotype' and 'alias', one row per phenotype (the last line wins)
+    """
+    if not os.path.isfile(alias_file):
         raise ValueError('The provided alias file does not exist.')
 
-    # Dictionary used to assign alias to each phenotype
-    alias_dict = {}
-    with open(args.alias_file, 'r') as in_file:
-        for line in in_file:
-            split_line = line.split(',')
-            if len(split_line) == 2:
-                alias_dict[split_line[0].replace(' ', '')] = split_line[1].rstrip()
-            elif len(split_line) < 2:
-                alias_dict[split_line[0].replace(' ', '')] = "Other"
-            else:
-                raise ValueError('The alias file is not formatted correctly. Each line must have 2 entries max.')
-    print(f"Using provided alias file {args.alias_file} to assign aliases to the traits.")
-    # add column 'alias' to the hits_df dataframe using the alias_dict to map the values
-    hits_df = hits_df.with_columns((pl.col('phenotype').apply(lambda x: alias_dict[x] if x in alias_dict.keys() else "<no data>")).alias('alias'))
-
-else:
-    hits_df = hits_df.with_columns((pl.col('phenotype')).alias('alias'))  # If no alias file, just repeat the phenotype
-
-template_df = pl.read_csv(args.template_file, sep="\t",
-                          columns=["ID", "beta", "chi2", "pval", "Marker", "chromosome", "position", "OA", "EA",
-                                   "EAF", "Info", "phenotype"])
-
-# Add the alias column to the template_df. We fill it with '<no data>' so that manhattan_maker will ignore them later
-template_df = template_df.with_columns(pl.lit("<no data>").alias('alias'))
-
-# Replace the relevant entries in the templateGWAS_df dataframe with the contents of the hits_df dataframe
-out_df = pl.concat([template_df, hits_df])
-
-# Sort the created sumstats by chromosome and position before writing to file
-# If chromosome names start with 'chr', remove it before sorting
-if str(out_df.head(1).select('chromosome')[0, 0]).startswith('chr'):
-    out_df.chromosome = out_df.with_column(pl.col('chromosome').str.replace('chr', ''))
-# Drop duplicates (ignores the alias column)
-out_df = out_df.unique(subset=['ID', 'beta', 'chi2', 'pval', 'Marker', 'chromosome', 'position', 'OA', 'EA', 'EAF',
-                               'Info', 'phenotype'])
-out_df = out_df.sort([pl.col('chromosome'), pl.col('position')])  # sort by column chromosome
-
-# Write the output_manhattan_file
-out_df.write_csv(args.output_filepath + '/combined_manhattan.txt', sep='\t')
+    with open(alias_file, 'r') as in_file:  # A few lines, one per phenotype
+        fields = pl.Series("fields", in_file.read().splitlines(), dtype=pl.Utf8).str.split(",")
+    fields = fields.filter(fields.list.get(0) != "")  # Empty lines
+    if (fields.list.len() > 2).any():
+        raise ValueError('The alias file is not formatted correctly. Each line must have 2 entries max.')
+
+    alias_df = pl.DataFrame({"phenotype": fields.list.get(0).str.replace_all(" ", ""),
+                             "alias": fields.list.get(1).str.strip_chars_end().fill_null("Other")})
+    return alias_df.unique(subset="phenotype", keep="last", maintain_order=True)
+
+
+def add_alias_column(hits_df: pl.DataFrame, alias_file: str = None) -> pl.DataFrame:
+    """
+    Add the 'alias' column to the hits. Phenotypes that are not in the alias file get '<no data>'. If there is no alias
+    file, the alias is just the phenotype.
+    """
+    if alias_file:
+        alias_df = read_alias_table(alias_file)
+        print(f"Using provided alias file {alias_file} to assign aliases to the traits.")
+        # Join on the categorical codes of the phenotypes, the few distinct phenotype strings are only hashed once
+        with pl.StringCache():
+            hits_df = hits_df.with_columns(pl.col("phenotype").cast(pl.Categorical)).join(
+                alias_df.with_columns(pl.col("phenotype").cast(pl.Categorical)), on="phenotype", how="left")
+        return hits_df.with_columns([pl.col("phenotype").cast(pl.Utf8), pl.col("alias").fill_null("<no data>")])
+
+    return hits_df.with_columns((pl.col('phenotype')).alias('alias'))  # If no alias file, just repeat the phenotype
+
+
+def count_aliases(combined_df: pl.DataFrame) -> pl.DataFrame:
+    """Number of variants of each alias in (a batch of) the combined file."""
+    return combined_df.group_by("alias").agg(pl.count().cast(pl.Int64).alias("num_variants"))
+
+
+def alias_table_path(combined_file: str) -> str:
+    """The alias table is written next to the combined file, with the '.aliases.txt' extension."""
+    return os.path.splitext(combined_file)[0] + ".aliases.txt"
+
+
+def write_alias_table(alias_counts_df: pl.DataFrame, combined_file: str) -> None:
+    """
+    Write the aliases found in the combined file, with their number of variants, next to it (see alias_table_path()).
+    'plot_manhattan.sh' reads the number of aliases from this table instead of scanning the combined file.
+
+    :param alias_counts_df: Output of count_aliases(), possibly for several batches
+    :param combined_file: Path to the combined file
+    """
+    alias_counts_df = alias_counts_df.group_by("alias").agg(pl.col("num_variants").sum()).sort("alias")
+    alias_counts_df.write_csv(alias_table_path(combined_file), separator='\t')
+
+
+def genomic_keys(df: pl.DataFrame) -> np.ndarray:
+    """
+    Sort key of each row: chromosome and position packed in a single integer. Rows without a chromosome (alt contigs)
+    get the largest key, as they are at the end of the template.
+    """
+    chrom = df["chromosome"].fill_null(NULL_CHROMOSOME_CODE).to_numpy().astype(np.int64)
+    return (chrom << 32) + df["position"].fill_null(0).to_numpy().astype(np.int64)
+
+
+def take_rows_in_order(parts_df: pl.DataFrame, final_positions: np.ndarray) -> pl.DataFrame:
+    """Reorder rows so that row i ends up at final_positions[i]. Linear, as opposed to sorting."""
+    order = np.empty(len(final_positions), dtype=np.int64)
+    order[final_positions] = np.arange(len(final_positions))
+    return parts_df[order]
+
+
+def merge_sorted(batch_df: pl.DataFrame, batch_keys: np.ndarray, insert_df: pl.DataFrame,
+                 insert_keys: np.ndarray) -> pl.DataFrame:
+    """
+    Merge two DataFrames that are both sorted by key, without sorting. Rows with the same key keep the rows of
+    'batch_df' first.
+    """
+    if insert_df.height == 0:
+        return batch_df
+    batch_positions = np.arange(len(batch_keys)) + np.searchsorted(insert_keys, batch_keys, side="left")
+    insert_positions = np.arange(len(insert_keys)) + np.searchsorted(batch_keys, insert_keys, side="right")
+    return take_rows_in_order(pl.concat([batch_df, insert_df]), np.concatenate([batch_positions, insert_positions]))
+
+
+def swap_in_hits_batches(template_batches, hits_df: pl.DataFrame):
+    """
+    Walk the template and the hits in lockstep, in (chromosome, position) order, and swap in the hits:
+        - a template row of a variant that has a hit (same 'variant_key') is replaced in place by the row of the hit
+        - hits of variants that are not in the template are inserted at their position, after the template rows with
+          the same chromosome and position
+    Only the current template batch is held in memory, and the template is never hashed or sorted. Template rows get
+    '<no data>' as alias, so that manhattan_maker ignores them later.
+
+    :param template_batches: Iterable of DataFrames with the HITS_COLUMNS columns, together sorted by chromosome and
+     position (nulls last), as written by 'produce_full_sumstats_for_single_trait.py'
+    :param hits_df: Hits, with the HITS_COLUMNS columns plus the 'alias' column. One row per variant.
+    :return: Generator of combined DataFrames, with the 'alias' column, in order
+    """
+    if hits_df["variant_key"].drop_nulls().is_duplicated().any():
+        raise ValueError("The hits table must have a single row per variant (see 'produce_all_hits_table.py').")
+
+    hits_df = hits_df.with_columns(pl.col("variant_key").cast(pl.Int64))
+    hits_df = hits_df.sort(["chromosome", "position"], nulls_last=True)
+    hit_keys = genomic_keys(hits_df)
+    hit_matched = np.zeros(hits_df.height, dtype=bool)
+    hit_variant_keys = hits_df["variant_key"]
+    next_hit = 0  # The hits before this one have been written out already
+    previous_key = np.iinfo(np.int64).min
+
+    for template_df in template_batches:
+        if template_df.height == 0:
+            continue
+        template_df = template_df.with_columns([pl.col("variant_key").cast(pl.Int64),
+                                                pl.lit("<no data>").alias("alias")])
+        template_keys = genomic_keys(template_df)
+        if template_keys[0] < previous_key or np.any(template_keys[1:] < template_keys[:-1]):
+            raise ValueError("The template file must be sorted by chromosome and position.")
+        previous_key = template_keys[-1]
+
+        # Replace the template rows of the variants with a hit, in place
+        matched = template_df["variant_key"].is_in(hit_variant_keys).fill_null(False).to_numpy().astype(bool)
+        if matched.any():
+            kept_rows, replaced_rows = np.flatnonzero(~matched), np.flatnonzero(matched)
+            replaced_df = template_df[replaced_rows].select("variant_key").join(
+                hits_df, on="variant_key", how="left").select(template_df.columns)
+            hit_matched |= hit_variant_keys.is_in(replaced_df["variant_key"]).fill_null(False).to_numpy().astype(bool)
+            template_df = take_rows_in_order(pl.concat([template_df[kept_rows], replaced_df]),
+                                             np.concatenate([kept_rows, replaced_rows]))
+
+        # Hits before the last position of the batch cannot match any later template row. Those that did not match any
+        # template row are inserted in this batch.
+        last_hit = np.searchsorted(hit_keys, template_keys[-1], side="left")
+        unmatched = np.flatnonzero(~hit_matched[next_hit:last_hit]) + next_hit
+        yield merge_sorted(template_df, template_keys, hits_df[unmatched].select(template_df.columns),
+                           hit_keys[unmatched])
+        next_hit = max(next_hit, last_hit)
+
+    unmatched = np.flatnonzero(~hit_matched[next_hit:]) + next_hit  # Hits after the end of the template
+    if len(unmatched) > 0:
+        yield hits_df[unmatched].select(HITS_COLUMNS + ["alias"])
+
+
+def swap_in_hits(template_df: pl.DataFrame, hits_df: pl.DataFrame) -> pl.DataFrame:
+    """
+    In-memory version of swap_in_hits_batches(), for a template that fits in memory.
+
+    :param template_df: Template sumstats, with the HITS_COLUMNS columns, sorted by chromosome and position (nulls last)
+    :param hits_df: Hits, with the HITS_COLUMNS columns plus the 'alias' column. One row per variant.
+    :return: Combined sumstats, with the 'alias' column
+    """
+    return pl.concat(list(swap_in_hits_batches([template_df], hits_df)))
+
+
+def swap_in_hits_file(template_file: str, hits_df: pl.DataFrame, output_file: str, batch_size: int = 1000000) -> None:
+    """
+    Swap in the hits into a template file (see swap_in_hits_batches()), reading the template and writing the output
+    one batch of rows at a time, so that memory use does not depend on the size of the template. The alias table of the
+    output is written next to it (see write_alias_table()).
+
+    :param template_file: Path to the template sumstats file, in any of the formats of 'table_io.py'
+    :param hits_df: Hits, with the HITS_COLUMNS columns plus the 'alias' column. One row per variant.
+    :param output_file: Path to the output file
+    :param batch_size: Number of template rows read at a time
+    """
+    template_batches = (batch_df.select(HITS_COLUMNS)
+                        for batch_df in iter_table_batches(template_file, batch_size, HITS_DTYPES))
+
+    alias_counts = [count_aliases(pl.DataFrame(schema={"alias": pl.Utf8}))]
+    with open(output_file, "w") as f:
+        write_header = True
+        for out_df in swap_in_hits_batches(template_batches, hits_df):
+            out_df.write_csv(f, separator='\t', include_header=write_header)
+            alias_counts.append(count_aliases(out_df))
+            write_header = False
+        if write_header:  # Empty template and no hits
+            pl.DataFrame(schema=HITS_COLUMNS + ["alias"]).write_csv(f, separator='\t')
+    write_alias_table(pl.concat(alias_counts), output_file)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Take a template summary statistics file and swap in the hits obtained"
+                                                 " from GWAS. It takes a full summary statistics file for a single "
+                                                 "trait and another file containing the GWAS hits from multiple traits."
+                                                 " It then swaps in the hits from the GWAS hits file into the full "
+                                                 "summary statistics file. The resulting file can be used to generate a"
+                                                 " Manhattan plot that will show all of the hits across several "
+                                                 "traits.")
+    parser.add_argument("template_file",
+                        metavar="TEMPLATE_FILEPATH",
+                        help="Path to the template sumstats file (tab-separated, Parquet or Arrow IPC).")
+    parser.add_argument("hits_file",
+                        metavar="HITS_FILEPATH",
+                        help="Path to the table of hits produced by 'produce_all_hits_table.py' (tab-separated, "
+                             "Parquet or Arrow IPC).")
+    parser.add_argument('-a', '--alias_file', metavar="ALIAS_FILEPATH",
+                        help="Path to the file containing the aliases for the traits.")
+    parser.add_argument("-b", "--batch_size", type=int, default=1000000,
+                        help="Number of template rows read at a time. Default: 1000000")
+    parser.add_argument("-o", "--output_filepath",
+                        help="Path to the directory where the output file will be written to.")
+
+    args = parser.parse_args()
+
+    hits_df = read_table(args.hits_file, HITS_DTYPES, HITS_COLUMNS)
+    hits_df = add_alias_column(hits_df, args.alias_file)
+
+    # Replace the relevant entries in the template with the contents of the hits table, and write to file
+    swap_in_hits_file(args.template_file, hits_df, args.output_filepath + '/combined_manhattan.txt', args.batch_size)
@@ -0,0 +1,139 @@
+import os
+
+import polars as pl
+import pyarrow as pa
+import pyarrow.ipc
+import pyarrow.parquet
+
+"""
+Reading and writing of the tables handed off between the steps of the pipeline.
+
+A table can be a tab-separated text file (the format the pipeline has always used) or a zstd-compressed columnar file,
+either Parquet or Arrow IPC. Columnar files are several times smaller, keep the column types, and are read without any
+parsing or schema inference. The format of a file is given by its extension, so the readers in this module work with
+any of them, and each script that writes a hand-off table has an option to pick the format (see TABLE_FORMATS).
+Final, human-facing outputs are always written as text.
+
+Columnar files are written in chunks of CHUNK_ROWS rows (Parquet row groups, Arrow IPC record batches), so that they can
+be streamed back one chunk at a time with iter_table_batches(). The chunks are read with pyarrow.
+"""
+
+TABLE_FORMATS = {"tsv": ".txt", "parquet": ".parquet", "ipc": ".arrow"}  # Format name -> extension of the files
+TABLE_EXTENSIONS = {".txt": "tsv", ".tsv": "tsv", ".parquet": "parquet", ".arrow": "ipc", ".ipc": "ipc"}
+COMPRESSION = "zstd"
+CHUNK_ROWS = 1 << 17  # Rows per Parquet row group / Arrow IPC record batch
+
+
+def table_format(table_file: str) -> str:
+    """Format of a table file, given by its extension. Files with an unknown extension are read as text."""
+    return TABLE_EXTENSIONS.get(os.path.splitext(table_file)[1], "tsv")
+
+
+def is_table_file(file_name: str) -> bool:
+    return os.path.splitext(file_name)[1] in TABLE_EXTENSIONS
+
+
+def table_file_name(name: str, table_format: str = "tsv") -> str:
+    """File name of the table 'name' in the given format. E.g. 'Trait_A' -> 'Trait_A.parquet'"""
+    if table_format not in TABLE_FORMATS:
+        raise ValueError(f"Unknown table format '{table_format}'. Choose one of: {', '.join(TABLE_FORMATS)}")
+    return name + TABLE_FORMATS[table_format]
+
+
+def find_table(folder_path: str, name: str) -> str:
+    """Path to the table 'name' in the folder, in whichever format it was written."""
+    for extension in TABLE_EXTENSIONS:
+        if os.path.isfile(os.path.join(folder_path, name + extension)):
+            return os.path.join(folder_path, name + extension)
+    raise ValueError(f"There is no table '{name}' in the folder {folder_path}.")
+
+
+def cast_columns(table_lf: pl.LazyFrame, dtypes: dict) -> pl.LazyFrame:
+    """Cast the columns of a columnar table to the types the text reader would have used."""
+    schema = table_lf.schema
+    return table_lf.with_columns([pl.col(column).cast(dtype) for column, dtype in dtypes.items()
+                                  if column in schema and schema[column] != dtype])
+
+
+def scan_table(table_file: str, dtypes: dict = None) -> pl.LazyFrame:
+    """
+    Lazily scan a table file in any of the formats.
+
+    :param table_file: Path to the table file
+    :param dtypes: OPTIONAL. Types of (some of) the columns. Text tables are parsed with these types, the columns of
+     columnar tables are cast to them.
+    :return: LazyFrame
+    """
+    file_format = table_format(table_file)
+    if file_format == "tsv":
+        return pl.scan_csv(table_file, separator="\t", dtypes=dtypes)
+    table_lf = pl.scan_parquet(table_file) if file_format == "parquet" else pl.scan_ipc(table_file, memory_map=False)
+    return cast_columns(table_lf, dtypes) if dtypes else table_lf
+
+
+def read_table(table_file: str, dtypes: dict = None, columns: list = None) -> pl.DataFrame:
+    """Read a table file in any of the formats. See scan_table()."""
+    table_lf = scan_table(table_file, dtypes)
+    return table_lf.select(columns).collect() if columns else table_lf.collect()
+
+
+def iter_table_batches(table_file: str, batch_size: int, dtypes: dict = None):
+    """
+    Read a table file in batches of about 'batch_size' rows, in order, so that it is never held in memory in full.
+    Every part of the file is read only once: text tables with the batched CSV reader, Parquet tables one row group at a
+    time, and Arrow IPC tables one record batch at a time.
+
+    :param table_file: Path to the table file
+    :param batch_size: Number of rows per batch. Text tables may give batches of a slightly different size, and
+     columnar tables give smaller batches at the end of each of their chunks.
+    :param dtypes: OPTIONAL. Types of (some of) the columns, see scan_table()
+    :return: Generator of DataFrames
+    """
+    if table_format(table_file) == "tsv":
+        # The batched reader needs the type of every column of the file. Those not given are inferred, like scan_table()
+        schema = scan_table(table_file, dtypes).schema
+        reader = pl.read_csv_batched(table_file, separator="\t", batch_size=batch_size, dtypes=list(schema.values()))
+        while True:
+            batches = reader.next_batches(1)
+            if not batches:
+                return
+            yield batches[0]
+    else:
+        for record_batch in iter_columnar_batches(table_file, batch_size):
+            batch_df = pl.from_arrow(record_batch)
+            yield cast_columns(batch_df.lazy(), dtypes).collect() if dtypes else batch_df
+
+
+def iter_columnar_batches(table_file: str, batch_size: int):
+    """Arrow record batches of at most 'batch_size' rows of a Parquet or Arrow IPC file, reading each chunk once."""
+    if table_format(table_file) == "parquet":
+        yield from pyarrow.parquet.ParquetFile(table_file).iter_batches(batch_size=batch_size)
+    else:
+        with pa.memory_map(table_file) as source:
+            reader = pyarrow.ipc.open_file(source)
+            for i in range(reader.num_record_batches):
+                record_batch = reader.get_batch(i)
+                for offset in range(0, record_batch.num_rows, batch_size):
+                    yield record_batch.slice(offset, batch_size)
+
+
+def write_table(table_df: pl.DataFrame, table_file: str, null_value: str = None) -> None:
+    """
+    Write a table in the format given by the extension of the file: tab-separated text, or zstd-compressed Parquet or
+    Arrow IPC.
+
+    :param table_df: DataFrame to write
+    :param table_file: Path to the table file
+    :param null_value: OPTIONAL. How nulls are written in text tables. Default: empty field
+    """
+    file_format = table_format(table_file)
+    if file_format == "parquet":
+        table_df.write_parquet(table_file, compression=COMPRESSION, row_group_size=CHUNK_ROWS)
+    elif file_format == "ipc":
+        table = table_df.to_arrow()
+        options = pyarrow.ipc.IpcWriteOptions(compression=COMPRESSION)
+        with pyarrow.ipc.new_file(table_file, table.schema, options=options) as writer:
+            for record_batch in table.to_batches(max_chunksize=CHUNK_ROWS):
+                writer.write_batch(record_batch)
+    else:
+        table_df.write_csv(table_file, separator="\t", include_header=True, null_value=null_value)
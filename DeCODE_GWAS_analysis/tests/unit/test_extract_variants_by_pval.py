@@ -0,0 +1,62 @@
+import os
+
+import polars as pl
+
+from extract_variants_by_pval import extract_variants_by_pval, hits_cache_file, hits_cache_is_usable, tier_name
+from variant_info_store import build_variant_info_store
+
+VARIANT_INFO = "ID\tMarker\tOA\tEA\tEAF\tInfo\n" + "".join(f"rs{i}\tchr{i % 3 + 1}:{i * 100}\tA\tG\t0.1\t0.9\n"
+                                                           for i in range(20))
+# chi2 of 17, 25 and 35 are p-values of about 4e-5, 6e-7 and 3e-9
+RES_TEXT = "".join(f"rs{i} 0.01 {[0.5, 17, 25, 35][i % 4]}\n" for i in range(20))
+GWAS_FILE_NAME = "SWE_Swedes_Blood_variome_Trait_A_adjSexPhaCohPC_InvNorm_12102022.res"
+
+
+def make_inputs(tmp_path):
+    (tmp_path / "variant_info_extended.txt").write_text(VARIANT_INFO)
+    (tmp_path / "res").mkdir()
+    (tmp_path / "res" / GWAS_FILE_NAME).write_text(RES_TEXT)
+    build_variant_info_store(str(tmp_path / "variant_info_extended.txt"))
+    return str(tmp_path / "variant_info_extended.txt"), str(tmp_path / "res")
+
+
+def test_multiple_thresholds(tmp_path):
+    variant_info_file, res_dir = make_inputs(tmp_path)
+    extract_variants_by_pval(variant_info_file, res_dir, 6, str(tmp_path / "single"))
+    extract_variants_by_pval(variant_info_file, res_dir, ["4", "6", "8"], str(tmp_path / "multi"))
+
+    num_hits = {}
+    for pval_thresh in [4, 6, 8]:
+        hits_df = pl.read_csv(tmp_path / "multi" / tier_name(pval_thresh) / "Trait_A.txt", separator="\t")
+        num_hits[pval_thresh] = hits_df.height
+        assert (hits_df["pval"] < 10 ** -pval_thresh).all()
+    assert num_hits == {4: 15, 6: 10, 8: 5}  # Nested subsets
+    assert (tmp_path / "single" / "Trait_A.txt").read_text() == \
+           (tmp_path / "multi" / tier_name(6) / "Trait_A.txt").read_text()
+
+
+def test_hits_cache(tmp_path):
+    variant_info_file, res_dir = make_inputs(tmp_path)
+    gwas_file = os.path.join(res_dir, GWAS_FILE_NAME)
+    cache_dir = str(tmp_path / "cache")
+    extract_variants_by_pval(variant_info_file, res_dir, [4, 6], str(tmp_path / "first"), cache_dir=cache_dir)
+
+    cache_file = hits_cache_file(cache_dir, "Trait_A")
+    assert pl.read_parquet(cache_file).columns == ["ID", "beta", "chi2"]
+    assert pl.read_parquet(cache_file).height == 15
+    assert hits_cache_is_usable(cache_file, gwas_file, 8)
+    assert not hits_cache_is_usable(cache_file, gwas_file, 3)  # Looser than the cache
+
+    # Same size and mtime, different contents: the hits of a tighter threshold come from the cache, not from the file
+    stat = os.stat(gwas_file)
+    (tmp_path / "res" / GWAS_FILE_NAME).write_text(RES_TEXT.replace(" 17\n", " 47\n"))
+    os.utime(gwas_file, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    extract_variants_by_pval(variant_info_file, res_dir, 6, str(tmp_path / "second"), cache_dir=cache_dir)
+    assert pl.read_csv(tmp_path / "second" / "Trait_A.txt", separator="\t").height == 10
+
+    # Once the file is modified, the cache is rebuilt from it
+    os.utime(gwas_file)
+    assert not hits_cache_is_usable(cache_file, gwas_file, 6)
+    extract_variants_by_pval(variant_info_file, res_dir, 6, str(tmp_path / "third"), cache_dir=cache_dir)
+    assert pl.read_csv(tmp_path / "third" / "Trait_A.txt", separator="\t").height == 15
+    assert hits_cache_is_usable(cache_file, gwas_file, 6)
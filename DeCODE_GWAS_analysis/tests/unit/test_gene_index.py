@@ -0,0 +1,45 @@
+import gzip
+import os
+
+from gene_index import load_gene_index, closest_genes, default_index_path
+
+GTF_LINES = [
+    "##description: test annotation",
+    'chr1\tHAVANA\tgene\t1000\t5000\t.\t+\t.\tgene_id "G1"; gene_type "protein_coding"; gene_name "AAA";',
+    'chr1\tHAVANA\ttranscript\t1000\t5000\t.\t+\t.\tgene_id "G1"; transcript_id "T1"; gene_name "AAA";',
+    'chr1\tHAVANA\tgene\t3000\t200000\t.\t-\t.\tgene_id "G2"; gene_type "lncRNA"; gene_name "BBB";',
+    'chr1\tHAVANA\tgene\t500000\t600000\t.\t-\t.\tgene_id "G3"; gene_type "protein_coding"; gene_name "CCC";',
+    'chrX\tHAVANA\tgene\t100\t200\t.\t+\t.\tgene_id "G4"; gene_type "protein_coding"; gene_name "XXX";',
+]
+
+
+def write_gtf(path):
+    with gzip.open(path, "wt") as f:
+        f.write("\n".join(GTF_LINES) + "\n")
+
+
+def test_closest_genes(tmp_path):
+    gtf_file = str(tmp_path / "test.gtf.gz")
+    write_gtf(gtf_file)
+
+    gene_index = load_gene_index(gtf_file)
+    genes_df = closest_genes(gene_index, [1, 1, 1, 23, 1, 2], [2000, 250000, 400000, 150, 3000000, 5])
+
+    assert genes_df["gene_name"].to_list() == ["AAA", "BBB", "CCC", "XXX", None, None]
+    assert genes_df["gene_distance"].to_list() == [0, 50000, 100000, 0, None, None]
+    # Minus strand genes have their TSS at the end, and are transcribed towards smaller positions
+    assert genes_df["tss_distance"].to_list() == [1000, -50000, 200000, 50, None, None]
+
+
+def test_gene_index_cache(tmp_path):
+    gtf_file = str(tmp_path / "test.gtf.gz")
+    write_gtf(gtf_file)
+
+    load_gene_index(gtf_file)
+    index_file = default_index_path(gtf_file)
+    assert index_file == str(tmp_path / "test.gene_index.npz")
+    cache_mtime = os.stat(index_file).st_mtime_ns
+
+    gene_index = load_gene_index(gtf_file)  # Second time, the cache is used as is
+    assert os.stat(index_file).st_mtime_ns == cache_mtime
+    assert gene_index["gene_name"].tolist() == ["AAA", "BBB", "CCC", "XXX"]
@@ -0,0 +1,20 @@
+import polars as pl
+from generate_hit_regions_bed import read_hit_windows
+
+
+def write_hits(path, phenotype, chromosomes, positions, pvals):
+    pl.DataFrame({"ID": [f"rs{i}" for i in range(len(positions))], "pval": pvals, "chromosome": chromosomes,
+                  "position": positions, "phenotype": phenotype}).write_csv(path, separator="\t")
+
+
+def test_read_hit_windows(tmp_path):
+    write_hits(tmp_path / "Trait_A.txt", "Trait_A", [2, 1], [5_000_000, 500], [1e-10, 1e-8])
+    write_hits(tmp_path / "Trait_B.txt", "Trait_B", [1], [3_000_000], [1e-20])
+
+    bed_df = read_hit_windows(str(tmp_path), 1_000_000)
+
+    assert bed_df.columns == ["chrom", "chromStart", "chromEnd", "leadSnp_pos", "leadSnp_pval", "phenotypes"]
+    assert bed_df["chrom"].to_list() == [1, 1, 2]
+    assert bed_df["chromStart"].to_list() == [2, 2_000_000, 4_000_000]  # Windows never start before position 2
+    assert bed_df["chromEnd"].to_list() == [1_000_500, 4_000_000, 6_000_000]
+    assert bed_df["phenotypes"].to_list() == ["Trait_A", "Trait_B", "Trait_A"]
@@ -0,0 +1,43 @@
+import warnings
+
+import polars as pl
+from generate_individual_region_beds import assign_hits_to_regions, generate_individual_region_beds, read_hits
+
+
+def test_assign_hits_to_regions():
+    regions_df = pl.DataFrame({"chrom": [2, 1, 1], "chromStart": [2, 2, 5000], "chromEnd": [1000, 1000, 6000]})
+    hits_df = pl.DataFrame({"chromosome": [1, 1, 1, 2, 3], "position": [500, 3000, 6000, 1000, 500]})
+
+    assert assign_hits_to_regions(hits_df, regions_df).tolist() == [1, -1, 2, 0, -1]
+
+
+def test_generate_individual_region_beds(tmp_path):
+    pl.DataFrame({"chrom": [1, 2], "chromStart": [2, 100], "chromEnd": [1000, 2000],
+                  "phenotypes": ["B,A", "A"]}).write_csv(tmp_path / "variant_regions.bed", separator="\t")
+    for pheno, chromosomes, positions in [("A", [1, 2], [20, 150]), ("B", [1, 1], [10, 30])]:
+        pl.DataFrame({"pval": 1e-8, "chromosome": chromosomes, "position": positions, "EA": "G",
+                      "phenotype": pheno}).write_csv(tmp_path / f"{pheno}.txt", separator="\t")
+    output_folder = tmp_path / "regions"
+    output_folder.mkdir()
+
+    generate_individual_region_beds(str(tmp_path / "variant_regions.bed"), str(tmp_path), str(output_folder),
+                                    threads=2)
+
+    assert sorted(f.name for f in output_folder.iterdir()) == ["region_1_chr1:2-1000.bed", "region_2_chr2:100-2000.bed"]
+    region_df = pl.read_csv(output_folder / "region_1_chr1:2-1000.bed", separator="\t")
+    assert region_df.columns == ["chromosome", "position", "position2", "EA", "pval", "phenotype"]
+    assert region_df["position"].to_list() == [10, 30, 20]  # Grouped by phenotype, in the order of the regions file
+    assert region_df["phenotype"].to_list() == ["B", "B", "A"]
+
+
+def test_read_hits_drops_hits_without_chromosome(tmp_path):
+    # Alt contigs and unknown chromosome codes are decoded to a null chromosome
+    pl.DataFrame({"pval": 1e-8, "chromosome": [1, None, 2], "position": [10, 20, 30], "EA": "G",
+                  "phenotype": "A"}).write_csv(tmp_path / "A.txt", separator="\t")
+    regions_df = pl.DataFrame({"chrom": [1], "chromStart": [2], "chromEnd": [1000]})
+
+    hits_df = read_hits(str(tmp_path), ["A"])
+    assert hits_df["position"].to_list() == [10, 30]
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")  # No null chromosome cast to an integer
+        assert assign_hits_to_regions(hits_df, regions_df).tolist() == [0, -1]
@@ -0,0 +1,65 @@
+import gzip
+import zlib
+import struct
+
+import polars as pl
+import pytest
+
+from gwas_file_reader import is_bgzf_file, iter_line_chunks, list_gwas_files, scan_gwas_file
+
+RES_TEXT = "".join(f"rs{i} {i / 1000:.3f} {i % 50}.5\n" for i in range(2000)).encode()
+
+
+def write_bgzf(path, data, block_size=1000):
+    """Minimal bgzip: independent deflate blocks with the 'BC' extra subfield, and the empty end-of-file block."""
+    with open(path, "wb") as f:
+        for i in range(0, len(data) + 1, block_size):  # The last block is empty (end-of-file marker)
+            block = data[i:i + block_size]
+            compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+            compressed = compressor.compress(block) + compressor.flush()
+            f.write(b"\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00" +
+                    struct.pack("<H", len(compressed) + 25) + compressed +
+                    struct.pack("<II", zlib.crc32(block), len(block)))
+
+
+@pytest.fixture
+def res_files(tmp_path):
+    (tmp_path / "trait.res").write_bytes(RES_TEXT)
+    with gzip.open(tmp_path / "trait.res.gz", "wb") as f:
+        f.write(RES_TEXT)
+    write_bgzf(tmp_path / "trait_bgzf.res.gz", RES_TEXT)
+    return {name: str(tmp_path / file) for name, file in
+            [("plain", "trait.res"), ("gzip", "trait.res.gz"), ("bgzf", "trait_bgzf.res.gz")]}
+
+
+def test_is_bgzf_file(res_files):
+    assert [is_bgzf_file(res_files[name]) for name in ["plain", "gzip", "bgzf"]] == [False, False, True]
+
+
+@pytest.mark.parametrize("name", ["gzip", "bgzf"])
+def test_iter_line_chunks(res_files, name):
+    chunks = list(iter_line_chunks(res_files[name], chunk_size=777, threads=2))
+    assert len(chunks) > 1
+    assert all(chunk.endswith(b"\n") for chunk in chunks)
+    assert b"".join(chunks) == RES_TEXT
+
+
+@pytest.mark.parametrize("name", ["gzip", "bgzf"])
+def test_scan_gwas_file(res_files, name):
+    def chunk_filter(gwas_lf):
+        return gwas_lf.filter(pl.col("chi2") > 40)
+
+    expected_df = scan_gwas_file(res_files["plain"], chunk_filter).collect()
+    gwas_df = scan_gwas_file(res_files[name], chunk_filter, chunk_size=1000, threads=2).collect()
+
+    assert expected_df.height == 400
+    assert gwas_df.equals(expected_df)
+    assert scan_gwas_file(res_files[name]).collect().height == 2000
+
+
+def test_list_gwas_files(res_files, tmp_path):
+    (tmp_path / "notes.txt").write_text("not a GWAS output file")
+    assert list_gwas_files(str(tmp_path)) == sorted(res_files.values())
+    assert list_gwas_files(res_files["gzip"]) == [res_files["gzip"]]
+    with pytest.raises(ValueError):
+        list_gwas_files(str(tmp_path / "missing"))
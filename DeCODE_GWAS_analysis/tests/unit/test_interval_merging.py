@@ -0,0 +1,39 @@
+import numpy as np
+import polars as pl
+import pytest
+from interval_merging import merge_interval_ids, merge_hit_windows
+
+
+def test_merge_interval_ids():
+    chrom = [1, 1, 1, 1, 2, 2]
+    start = [10, 15, 30, 40, 10, 12]
+    end = [20, 30, 35, 50, 100, 20]  # 15-30 touches 30-35 (book-ended), 40-50 is on its own
+    assert merge_interval_ids(chrom, start, end).tolist() == [0, 0, 0, 1, 2, 2]
+
+
+def test_merge_interval_ids_does_not_merge_across_chromosomes():
+    assert merge_interval_ids([1, 2], [10, 20], [1000, 30]).tolist() == [0, 1]
+    assert merge_interval_ids(np.array([]), np.array([]), np.array([])).tolist() == []
+
+
+def test_merge_interval_ids_unsorted():
+    with pytest.raises(ValueError):
+        merge_interval_ids([1, 1], [20, 10], [30, 40])
+
+
+def test_merge_hit_windows():
+    bed_df = pl.DataFrame({"chrom": [1, 1, 1, 2],
+                           "chromStart": [100, 2, 5000, 10],
+                           "chromEnd": [300, 200, 6000, 20],
+                           "leadSnp_pos": [200, 100, 5500, 15],
+                           "leadSnp_pval": [1e-8, 1e-8, 1e-9, 1e-7],
+                           "phenotypes": ["B", "A", "A", "B"]})
+
+    regions_df = merge_hit_windows(bed_df)
+
+    assert regions_df["chromStart"].to_list() == [2, 5000, 10]
+    assert regions_df["chromEnd"].to_list() == [300, 6000, 20]
+    assert regions_df["leadSnp_pos"].to_list() == [100, 5500, 15]  # p-value tie broken by the smallest position
+    assert regions_df["num_included_variants"].to_list() == [2, 1, 1]
+    assert regions_df["num_phenotypes"].to_list() == [2, 1, 1]
+    assert regions_df["phenotypes"].to_list() == [["A", "B"], ["A"], ["B"]]
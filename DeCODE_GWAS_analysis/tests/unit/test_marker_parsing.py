@@ -0,0 +1,25 @@
+import polars as pl
+from marker_parsing import decode_markers, recode_chrx_marker_expr
+
+
+def test_decode_markers():
+    df = pl.DataFrame({"Marker": ["chr1:123", "chr22:45", "chrX:55", "chrY:9", "chrM:3", "chrMT:4", "7:8"]})
+    out_df = decode_markers(df)
+
+    assert out_df.columns == ["Marker", "chromosome", "position"]
+    assert out_df.dtypes == [pl.Utf8, pl.Int64, pl.Int64]
+    assert out_df["chromosome"].to_list() == [1, 22, 23, 24, 26, 26, 7]
+    assert out_df["position"].to_list() == [123, 45, 55, 9, 3, 4, 8]
+
+
+def test_decode_markers_with_alleles_and_alt_contigs():
+    df = pl.DataFrame({"Marker": ["chr1:123:A:G", "chr2:456_C_T", "chr1_KI270706v1_random:77"]})
+    out_df = decode_markers(df.lazy()).collect()  # LazyFrames are accepted too
+
+    assert out_df["chromosome"].to_list() == [1, 2, None]  # Alt contigs have no numeric code
+    assert out_df["position"].to_list() == [123, 456, 77]
+
+
+def test_recode_chrx_marker_expr():
+    df = pl.DataFrame({"Marker": ["chrX:55", "chr1:123"]}).with_columns(recode_chrx_marker_expr())
+    assert df["Marker"].to_list() == ["chr23:55", "chr1:123"]
@@ -0,0 +1,35 @@
+import numpy as np
+
+from phewas import PHEWAS_COLUMNS, phewas
+from trait_matrix import build_trait_matrix, open_trait_matrix
+from variant_info_store import build_variant_info_store, open_variant_info_store
+
+VARIANT_INFO = ("ID\tMarker\tOA\tEA\tEAF\tInfo\n"
+                "rs1\tchr1:100\tA\tG\t0.1\t0.9\n"
+                "rs2\tchr1:200\tA\tG\t0.1\t0.9\n"
+                "rs3\tchrX:300\tA\tG\t0.1\t0.9\n")
+
+
+def test_phewas(tmp_path):
+    (tmp_path / "variant_info_extended.txt").write_text(VARIANT_INFO)
+    (tmp_path / "res").mkdir()
+    for trait, chi2 in [("Trait_A", [1, 30, 5]), ("Trait_B", [40, 2, 6])]:
+        (tmp_path / "res" / f"SWE_Swedes_Blood_variome_{trait}_adjSexPhaCohPC_InvNorm_12102022.res").write_text(
+            "".join(f"rs{i + 1} 0.1 {value}\n" for i, value in enumerate(chi2) if not (trait == "Trait_B" and i == 2)))
+    variant_info_file = str(tmp_path / "variant_info_extended.txt")
+    build_variant_info_store(variant_info_file)
+    matrix = open_trait_matrix(build_trait_matrix(variant_info_file, str(tmp_path / "res"), str(tmp_path / "matrix")))
+    store_df = open_variant_info_store(variant_info_file)
+
+    phewas_df = phewas(matrix, store_df, ids=["rs2", "rs3", "missing"])
+    assert phewas_df.columns == PHEWAS_COLUMNS
+    assert phewas_df.select(["ID", "phenotype"]).rows() == [("rs2", "Trait_A"), ("rs2", "Trait_B"),
+                                                            ("rs3", "Trait_A")]  # Trait_B has no result for rs3
+    assert phewas_df["Marker"][2] == "chr23:300"
+    np.testing.assert_allclose(phewas_df["chi2"], [30, 2, 5])
+
+    # By region, and only the results below a p-value threshold
+    phewas_df = phewas(matrix, store_df, regions=["chr1:1-150", "chr1:150-250"], pval_thresh=1e-4)
+    assert phewas_df.select(["ID", "phenotype"]).rows() == [("rs1", "Trait_B"), ("rs2", "Trait_A")]
+
+    assert phewas(matrix, store_df, ids=["missing"]).height == 0
@@ -0,0 +1,72 @@
+import os
+
+import polars as pl
+from extract_variants_by_pval import HITS_COLUMNS
+from produce_all_hits_table import read_all_hit_tables, scan_all_hit_tables, reduce_top_hits
+
+
+def write_hit_table(path, phenotype, variant_keys, pvals, chi2s=30.0):
+    pl.DataFrame({"ID": [f"rs{k}" for k in variant_keys], "beta": 0.1, "chi2": chi2s, "pval": pvals,
+                  "Marker": [f"chr1:{k}" for k in variant_keys], "chromosome": 1, "position": variant_keys,
+                  "OA": "A", "EA": "G", "EAF": 0.5, "Info": 0.99, "phenotype": phenotype,
+                  "variant_key": variant_keys}).select(HITS_COLUMNS).write_csv(path, separator="\t")
+
+
+def test_read_all_hit_tables(tmp_path):
+    write_hit_table(tmp_path / "B.txt", "B", [3, 1], [1e-8, 1e-9])
+    write_hit_table(tmp_path / "A.txt", "A", [2], [1e-10])
+    write_hit_table(tmp_path / "C.txt", "C", [], [])  # Empty tables are fine
+
+    hits_df = read_all_hit_tables(str(tmp_path))
+
+    assert hits_df.columns == HITS_COLUMNS
+    assert hits_df["phenotype"].to_list() == ["A", "B", "B"]  # In the order of the file names
+
+
+def test_read_all_hit_tables_with_cache(tmp_path):
+    files_dir, cache_dir = tmp_path / "hits", tmp_path / "cache"
+    files_dir.mkdir()
+    write_hit_table(files_dir / "A.txt", "A", [2], [1e-10])
+    write_hit_table(files_dir / "B.txt", "B", [3, 1], [1e-8, 1e-9])
+
+    first_df = read_all_hit_tables(str(files_dir), str(cache_dir))
+    assert sorted(os.listdir(cache_dir)) == ["A.txt.arrow", "B.txt.arrow", "manifest.json"]
+    cached_a_mtime = os.stat(cache_dir / "A.txt.arrow").st_mtime_ns
+
+    # Re-deliver B only
+    write_hit_table(files_dir / "B.txt", "B", [3], [1e-8])
+    second_df = read_all_hit_tables(str(files_dir), str(cache_dir))
+
+    assert first_df.height == 3
+    assert second_df["variant_key"].to_list() == [2, 3]
+    assert os.stat(cache_dir / "A.txt.arrow").st_mtime_ns == cached_a_mtime  # A was not parsed again
+
+    # Tables removed from the input directory are dropped from the cache too
+    os.remove(files_dir / "A.txt")
+    assert read_all_hit_tables(str(files_dir), str(cache_dir))["phenotype"].to_list() == ["B"]
+    assert not os.path.exists(cache_dir / "A.txt.arrow")
+
+
+def test_reduce_top_hits(tmp_path):
+    # Variant 1: C wins on p-value. Variant 2: A and B tie on p-value, A wins alphabetically.
+    write_hit_table(tmp_path / "A.txt", "A", [1, 2], [1e-8, 1e-9])
+    write_hit_table(tmp_path / "B.txt", "B", [2, 3], [1e-9, 1e-7])
+    write_hit_table(tmp_path / "C.txt", "C", [1], [1e-12])
+
+    for batch_size in [1, 2, 50]:  # The result does not depend on how the tables are batched
+        top_hits_df = reduce_top_hits(scan_all_hit_tables(str(tmp_path)), batch_size)
+        assert top_hits_df.columns == HITS_COLUMNS
+        assert top_hits_df["variant_key"].to_list() == [1, 2, 3]
+        assert top_hits_df["phenotype"].to_list() == ["C", "A", "B"]
+        assert top_hits_df["pval"].to_list() == [1e-12, 1e-9, 1e-7]
+
+
+def test_reduce_top_hits_beyond_pval_underflow(tmp_path):
+    # Both p-values underflow to 0.0: the variant goes to B, the phenotype with the highest chi2, not to A
+    write_hit_table(tmp_path / "A.txt", "A", [1], [0.0], [1500.0])
+    write_hit_table(tmp_path / "B.txt", "B", [1], [0.0], [2500.0])
+
+    for batch_size in [1, 50]:
+        top_hits_df = reduce_top_hits(scan_all_hit_tables(str(tmp_path)), batch_size)
+        assert top_hits_df["phenotype"].to_list() == ["B"]
+        assert top_hits_df["chi2"].to_list() == [2500.0]
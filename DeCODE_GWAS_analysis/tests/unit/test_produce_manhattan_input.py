@@ -0,0 +1,22 @@
+import numpy as np
+import polars as pl
+from scipy.stats import chi2
+
+from produce_manhattan_input import thin_background
+
+
+def test_thin_background():
+    pvals = np.random.default_rng(0).random(200_000)
+    gwas_lf = pl.LazyFrame({"ID": [f"rs{i}" for i in range(len(pvals))], "beta": 0.1, "chi2": chi2.isf(pvals, 1)})
+
+    thinned_df = thin_background(gwas_lf, keep_pval=1e-3, background_fraction=0.005).collect()
+
+    assert thinned_df.filter(pl.col("neg_log10_pval") >= 3).height == (pvals <= 1e-3).sum()  # All kept
+    assert 0.01 < thinned_df.height / len(pvals) < 0.025
+    # The upper bins are sampled more than the lower ones
+    kept_low = thinned_df.filter(pl.col("neg_log10_pval") < 0.5).height / ((pvals > 10 ** -0.5).sum())
+    kept_high = thinned_df.filter(pl.col("neg_log10_pval").is_between(2, 3, closed="left")).height / \
+        (((pvals > 1e-3) & (pvals <= 1e-2)).sum())
+    assert kept_low < 0.02 < 0.3 < kept_high
+    # The same variants are kept every time
+    assert thin_background(gwas_lf).collect()["ID"].to_list() == thinned_df["ID"].to_list()
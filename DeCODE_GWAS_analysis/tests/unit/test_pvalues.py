@@ -0,0 +1,43 @@
+import numpy as np
+import polars as pl
+from scipy.stats import chi2
+from pvalues import chi2_to_pval, pval_to_chi2, chi2_to_neg_log10_pval, pval_to_neg_log10, pval_expr, \
+    neg_log10_pval_expr
+
+
+def test_chi2_to_pval():
+    chi2_values = np.array([0.0, 0.5, 3.84, 23.93, 100.0])
+    expected = np.array([chi2.sf(x, 1) for x in chi2_values])
+
+    assert np.allclose(chi2_to_pval(chi2_values), expected, rtol=1e-12)
+    # polars Series are accepted as well
+    assert np.allclose(chi2_to_pval(pl.Series(chi2_values)), expected, rtol=1e-12)
+
+
+def test_pval_to_chi2_round_trip():
+    pvals = np.array([1e-4, 1e-6, 5e-8])
+    assert np.allclose(chi2_to_pval(pval_to_chi2(pvals)), pvals, rtol=1e-9)
+
+
+def test_chi2_to_neg_log10_pval():
+    chi2_values = np.array([0.5, 3.84, 23.93, 100.0])
+    expected = -np.log10([chi2.sf(x, 1) for x in chi2_values])
+    assert np.allclose(chi2_to_neg_log10_pval(chi2_values), expected, rtol=1e-10)
+
+    # The p-value underflows to 0 here, but -log10(p) must stay finite and keep increasing
+    extreme = chi2_to_neg_log10_pval(np.array([2000.0, 4000.0]))
+    assert chi2_to_pval(np.array([2000.0]))[0] == 0.0
+    assert np.all(np.isfinite(extreme))
+    assert 430 < extreme[0] < extreme[1]
+
+
+def test_pval_to_neg_log10():
+    assert np.allclose(pval_to_neg_log10([1e-6, 1.0]), [6.0, 0.0])
+    assert np.isinf(pval_to_neg_log10([0.0])[0])
+
+
+def test_pval_expressions():
+    df = pl.DataFrame({"chi2": [3.84, 23.93]}).with_columns([pval_expr(), neg_log10_pval_expr()])
+
+    assert df.columns == ["chi2", "pval", "neg_log10_pval"]
+    assert np.allclose(df["pval"].to_numpy(), chi2.sf(df["chi2"].to_numpy(), 1))
@@ -0,0 +1,61 @@
+import os
+
+import polars as pl
+import pytest
+
+from sumstats_store import chromosome_file, list_store_phenotypes, parse_region, query_regions, write_sumstats_store
+
+
+def make_sumstats(phenotype, num_variants=1000):
+    """Variants on chromosomes 1, 2 and 23 (and one with no chromosome), not sorted by position."""
+    return pl.DataFrame({"ID": [f"rs{i}" for i in range(num_variants)],
+                         "chi2": [float(i % 7) for i in range(num_variants)],
+                         "chromosome": [[1, 2, 23][i % 3] if i else None for i in range(num_variants)],
+                         "position": [(i * 7919) % 100000 for i in range(num_variants)],
+                         "phenotype": phenotype})
+
+
+def test_parse_region():
+    assert parse_region("chr1:1000-2000") == (1, 1000, 2000)
+    assert parse_region("X:1,000-2,000") == (23, 1000, 2000)
+    with pytest.raises(ValueError):
+        parse_region("chr1:2000-1000")
+    with pytest.raises(ValueError):
+        parse_region("chr1_1000")
+
+
+def test_write_sumstats_store(tmp_path):
+    store_files = write_sumstats_store(make_sumstats("Trait_A"), str(tmp_path), row_group_size=50)
+
+    assert store_files == [chromosome_file(str(tmp_path), "Trait_A", chrom) for chrom in [1, 2, 23]]
+    assert list_store_phenotypes(str(tmp_path)) == ["Trait_A"]
+    chrom_df = pl.read_parquet(store_files[0])
+    assert chrom_df["position"].is_sorted()
+    assert (chrom_df["chromosome"] == 1).all()
+    # The variant with no chromosome is left out
+    assert sum(pl.read_parquet(file).height for file in store_files) == 999
+
+    # Writing a trait again replaces it
+    write_sumstats_store(make_sumstats("Trait_A").filter(pl.col("chromosome") == 1), str(tmp_path))
+    assert os.listdir(tmp_path / "Trait_A") == ["chr1.parquet"]
+
+
+def test_query_regions(tmp_path):
+    for phenotype in ["Trait_A", "Trait_B"]:
+        write_sumstats_store(make_sumstats(phenotype), str(tmp_path), row_group_size=50)
+
+    variants_df = query_regions(str(tmp_path), ["chr2:10000-30000", (23, 0, 5000), "chr5:1-100"],
+                                columns=["ID", "position", "phenotype"])
+    assert variants_df.columns == ["region", "chrom", "chromStart", "chromEnd", "ID", "position", "phenotype"]
+
+    in_regions = (((pl.col("chromosome") == 2) & pl.col("position").is_between(10000, 30000)) |
+                  ((pl.col("chromosome") == 23) & (pl.col("position") <= 5000)))
+    expected_df = make_sumstats("Trait_A").filter(in_regions)
+    trait_a_df = variants_df.filter(pl.col("phenotype") == "Trait_A")
+    assert sorted(trait_a_df["ID"].to_list()) == sorted(expected_df["ID"].to_list())
+    assert variants_df.height == 2 * expected_df.height
+    assert variants_df["region"].unique().to_list() == [0, 1]  # Nothing on chromosome 5
+    assert variants_df.filter(pl.col("region") == 0)["phenotype"].unique(maintain_order=True).to_list() == \
+           ["Trait_A", "Trait_B"]
+
+    assert query_regions(str(tmp_path), ["chr5:1-100"]).height == 0
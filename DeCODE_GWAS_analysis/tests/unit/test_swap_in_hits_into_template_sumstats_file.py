@@ -0,0 +1,89 @@
+import polars as pl
+import pytest
+
+from extract_variants_by_pval import HITS_COLUMNS
+from produce_all_hits_table import HITS_DTYPES
+from swap_in_hits_into_template_sumstats_file import swap_in_hits, swap_in_hits_batches, swap_in_hits_file, \
+    read_alias_table, add_alias_column, alias_table_path
+
+
+def sumstats(ids, chromosomes, positions, variant_keys, phenotype):
+    n = len(ids)
+    return pl.DataFrame({"ID": ids, "beta": [0.1] * n, "chi2": [1.0] * n, "pval": [0.3] * n,
+                         "Marker": [f"chr{c}:{p}" for c, p in zip(chromosomes, positions)],
+                         "chromosome": chromosomes, "position": positions, "OA": ["A"] * n, "EA": ["G"] * n,
+                         "EAF": [0.5] * n, "Info": [0.99] * n, "phenotype": [phenotype] * n,
+                         "variant_key": variant_keys},
+                        schema_overrides={"chromosome": pl.Int64, "position": pl.Int64, "variant_key": pl.Int64})
+
+
+@pytest.fixture
+def template_df():
+    return sumstats(["rs1", "rs2", "rs3", "rs4", "rs5", "rs6"], [1, 1, 1, 2, 2, None], [10, 20, 20, 5, 50, None],
+                    [1, 2, 3, 4, 5, 6], "Template")
+
+
+@pytest.fixture
+def hits_df():
+    # rs3 and rs5 are in the template, rs7 to rs10 are not
+    return sumstats(["rs9", "rs3", "rs7", "rs5", "rs8", "rs10"], [3, 1, 1, 2, 1, 1], [1, 20, 15, 50, 20, 1],
+                    [9, 3, 7, 5, 8, 10], "Trait").with_columns(pl.lit("Alias").alias("alias"))
+
+
+def test_swap_in_hits(template_df, hits_df):
+    out_df = swap_in_hits(template_df, hits_df)
+
+    assert out_df.columns == HITS_COLUMNS + ["alias"]
+    # Template rows replaced in place, new hits inserted after the template rows at the same position
+    assert out_df["ID"].to_list() == ["rs10", "rs1", "rs7", "rs2", "rs3", "rs8", "rs4", "rs5", "rs9", "rs6"]
+    assert out_df["alias"].to_list() == ["Alias", "<no data>", "Alias", "<no data>", "Alias", "Alias", "<no data>",
+                                         "Alias", "Alias", "<no data>"]
+    assert out_df.filter(pl.col("ID") == "rs3")["phenotype"].to_list() == ["Trait"]
+
+
+@pytest.mark.parametrize("batch_size", [1, 2, 4])
+def test_swap_in_hits_does_not_depend_on_batches(template_df, hits_df, batch_size):
+    batches = [template_df.slice(i, batch_size) for i in range(0, template_df.height, batch_size)]
+    assert pl.concat(list(swap_in_hits_batches(batches, hits_df))).equals(swap_in_hits(template_df, hits_df))
+
+
+def test_swap_in_hits_file(tmp_path, template_df, hits_df):
+    template_df.with_columns(pl.lit(1.0).alias("neg_log10_pval")).write_csv(tmp_path / "template.txt", separator="\t")
+
+    swap_in_hits_file(str(tmp_path / "template.txt"), hits_df, str(tmp_path / "out.txt"), batch_size=2)
+
+    out_df = pl.read_csv(tmp_path / "out.txt", separator="\t", dtypes=HITS_DTYPES)
+    assert out_df.equals(swap_in_hits(template_df, hits_df))
+    alias_df = pl.read_csv(alias_table_path(str(tmp_path / "out.txt")), separator="\t")
+    assert alias_df.rows() == [("<no data>", 4), ("Alias", 6)]
+
+
+def test_swap_in_hits_unsorted_template(template_df, hits_df):
+    with pytest.raises(ValueError):
+        swap_in_hits(template_df.reverse(), hits_df)
+
+
+def test_swap_in_hits_duplicated_hits(template_df, hits_df):
+    with pytest.raises(ValueError):
+        swap_in_hits(template_df, pl.concat([hits_df, hits_df]))
+
+
+def test_read_alias_table(tmp_path):
+    (tmp_path / "alias.csv").write_text("Trait A ,Lymph\nTrait_B\n\nTrait_C,Myeloid \n")
+    alias_df = read_alias_table(str(tmp_path / "alias.csv"))
+    assert alias_df.rows() == [("TraitA", "Lymph"), ("Trait_B", "Other"), ("Trait_C", "Myeloid")]
+
+    (tmp_path / "bad_alias.csv").write_text("Trait_A,Lymph,Myeloid\n")
+    with pytest.raises(ValueError):
+        read_alias_table(str(tmp_path / "bad_alias.csv"))
+
+
+def test_add_alias_column(tmp_path):
+    (tmp_path / "alias.csv").write_text("Trait_A,Lymph\nTrait_B\n")
+    hits_df = pl.DataFrame({"ID": ["rs1", "rs2", "rs3", "rs4"],
+                            "phenotype": ["Trait_B", "Trait_C", "Trait_A", "Trait_B"]})
+
+    assert add_alias_column(hits_df, str(tmp_path / "alias.csv")).rows() == [
+        ("rs1", "Trait_B", "Other"), ("rs2", "Trait_C", "<no data>"), ("rs3", "Trait_A", "Lymph"),
+        ("rs4", "Trait_B", "Other")]
+    assert add_alias_column(hits_df)["alias"].to_list() == hits_df["phenotype"].to_list()
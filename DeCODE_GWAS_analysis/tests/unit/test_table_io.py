@@ -0,0 +1,73 @@
+import numpy as np
+import polars as pl
+import pytest
+
+import table_io
+from table_io import TABLE_FORMATS, find_table, is_table_file, iter_table_batches, read_table, table_file_name, \
+    write_table
+
+
+@pytest.fixture
+def table_df():
+    return pl.DataFrame({"ID": ["rs1", "rs2", "rs3", "rs4", "rs5"], "chromosome": [1, 1, 2, None, 23],
+                         "pval": [1e-8, 0.5, 1e-300, 0.01, 1.0], "variant_key": [4, 3, 2, 1, 0]},
+                        schema_overrides={"variant_key": pl.UInt32})
+
+
+@pytest.mark.parametrize("table_format", list(TABLE_FORMATS))
+def test_write_and_read_table(tmp_path, table_df, table_format):
+    table_file = str(tmp_path / table_file_name("table", table_format))
+    write_table(table_df, table_file)
+
+    read_df = read_table(table_file, {"chromosome": pl.Int64, "variant_key": pl.Int64})
+    assert read_df.dtypes == [pl.Utf8, pl.Int64, pl.Float64, pl.Int64]  # Same types whatever the format
+    assert read_df.equals(table_df.with_columns(pl.col("variant_key").cast(pl.Int64)))
+    assert read_table(table_file, columns=["ID"]).columns == ["ID"]
+    assert find_table(str(tmp_path), "table") == table_file
+
+
+@pytest.mark.parametrize("table_format", list(TABLE_FORMATS))
+def test_iter_table_batches(tmp_path, table_df, table_format):
+    table_file = str(tmp_path / table_file_name("table", table_format))
+    write_table(table_df, table_file)
+
+    batches = list(iter_table_batches(table_file, 2, {"variant_key": pl.UInt32}))
+    assert pl.concat(batches).equals(table_df)
+
+
+@pytest.mark.parametrize("table_format", ["parquet", "ipc"])
+def test_iter_table_batches_reads_each_chunk_once(tmp_path, monkeypatch, table_format):
+    monkeypatch.setattr(table_io, "CHUNK_ROWS", 1000)
+    rng = np.random.default_rng(0)
+    big_df = pl.DataFrame({"variant_key": np.arange(20000), "chi2": rng.exponential(size=20000)})
+    table_file = str(tmp_path / table_file_name("table", table_format))
+    write_table(big_df, table_file)
+
+    batches = iter_table_batches(table_file, 500)
+    first_batch = next(batches)
+
+    # Corrupt the first chunk of the file (5% into it, the file has 20 chunks) once it has been read: the other batches
+    # must not read it again
+    with open(table_file, "r+b") as f:
+        f.seek(len(f.read()) // 20)
+        f.write(b"\xff" * 256)
+    remaining = list(batches)
+    assert all(batch_df.height == 500 for batch_df in remaining)
+    assert pl.concat([first_batch] + remaining).equals(big_df)
+
+    # Whereas reading the file again reads the corrupted chunk: it either fails or gives different rows
+    try:
+        reread_df = pl.concat(list(iter_table_batches(table_file, 500)))
+    except Exception:
+        reread_df = None
+    assert reread_df is None or not reread_df.head(1000).equals(big_df.head(1000))
+
+
+def test_table_file_names(tmp_path):
+    assert table_file_name("Trait_A") == "Trait_A.txt"
+    assert table_file_name("Trait_A", "parquet") == "Trait_A.parquet"
+    with pytest.raises(ValueError):
+        table_file_name("Trait_A", "xlsx")
+    assert is_table_file("Trait_A.arrow") and not is_table_file("manifest.json")
+    with pytest.raises(ValueError):
+        find_table(str(tmp_path), "Trait_A")
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from trait_matrix import build_trait_matrix, compress_chunk, decompress_chunk, open_trait_matrix, read_matrix_rows, \
+    rows_in_region, rows_of_variant_keys
+from variant_info_store import build_variant_info_store
+
+NUM_VARIANTS = 50
+VARIANT_INFO = "ID\tMarker\tOA\tEA\tEAF\tInfo\n" + "".join(f"rs{i}\tchr{i % 2 + 1}:{1000 - i}\tA\tG\t0.1\t0.9\n"
+                                                           for i in range(NUM_VARIANTS))
+
+
+def write_inputs(tmp_path):
+    (tmp_path / "variant_info_extended.txt").write_text(VARIANT_INFO)
+    (tmp_path / "res").mkdir()
+    for trait in range(3):  # Trait 2 has no result for the odd variants
+        (tmp_path / "res" / f"SWE_Swedes_Blood_variome_Trait_{trait}_adjSexPhaCohPC_InvNorm_12102022.res").write_text(
+            "".join(f"rs{i} {trait + i / 100} {trait * 100 + i}\n" for i in range(NUM_VARIANTS)
+                    if trait < 2 or i % 2 == 0))
+    build_variant_info_store(str(tmp_path / "variant_info_extended.txt"))
+    return str(tmp_path / "variant_info_extended.txt"), str(tmp_path / "res")
+
+
+def test_compress_chunk():
+    chunk = np.random.default_rng(0).normal(size=(10, 3)).astype(np.float32)
+    chunk[2, 1] = np.nan
+    np.testing.assert_array_equal(decompress_chunk(compress_chunk(chunk), 3), chunk)
+
+
+def test_build_trait_matrix(tmp_path):
+    variant_info_file, res_dir = write_inputs(tmp_path)
+    matrix_dir = build_trait_matrix(variant_info_file, res_dir, str(tmp_path / "matrix"), chunk_rows=8)
+
+    matrix = open_trait_matrix(matrix_dir, variant_info_file)
+    assert matrix["traits"] == ["Trait_0", "Trait_1", "Trait_2"]
+    assert matrix["num_variants"] == NUM_VARIANTS
+    assert np.all(np.diff(matrix["genomic_keys"]) >= 0)
+
+    # The store is sorted by ID: rs0, rs1, rs10, rs11, ... The variant_key of rs3 is 23 and that of rs4 is 34.
+    values = read_matrix_rows(matrix, rows_of_variant_keys(matrix, [23, 34]))
+    np.testing.assert_allclose(values["chi2"], [[3, 103, np.nan], [4, 104, 204]])
+    np.testing.assert_allclose(values["beta"], [[0.03, 1.03, np.nan], [0.04, 1.04, 2.04]], rtol=1e-6)
+
+    # Chromosome 1 has the even variants, at positions 1000 - i
+    rows = rows_in_region(matrix, 1, 990, 996)
+    np.testing.assert_allclose(read_matrix_rows(matrix, rows)["chi2"][:, 0], [10, 8, 6, 4])
+
+    with pytest.raises(ValueError):
+        open_trait_matrix(str(tmp_path / "missing"))
@@ -0,0 +1,76 @@
+import os
+import polars as pl
+import pytest
+from variant_info_store import build_variant_info_store, ensure_variant_info_store, open_variant_info_store, \
+    store_is_up_to_date, check_variant_info_store, lookup_variants
+
+VARIANT_INFO = ("ID\tMarker\tOA\tEA\tEAF\tInfo\n"
+                "rs3\tchr2:300\tA\tG\t0.1\t0.9\n"
+                "rs1\tchrX:100\tC\tT\t0.2\t0.8\n"
+                "rs2\tchr1:200\tG\tA\t0.3\t0.7\n")
+
+
+def write_variant_info(path, contents=VARIANT_INFO):
+    with open(path, "w") as f:
+        f.write(contents)
+    return str(path)
+
+
+def test_build_variant_info_store(tmp_path):
+    variant_info_file = write_variant_info(tmp_path / "variant_info_extended.txt")
+    store_file = build_variant_info_store(variant_info_file)
+
+    assert store_file == str(tmp_path / "variant_info_extended.arrow")
+    df = pl.read_ipc(store_file, memory_map=False)
+    assert df.columns == ["variant_key", "ID", "Marker", "chromosome", "position", "OA", "EA", "EAF", "Info"]
+    assert df["ID"].to_list() == ["rs1", "rs2", "rs3"]  # Sorted by ID
+    assert df["variant_key"].to_list() == [0, 1, 2]
+    assert df["chromosome"].to_list() == [23, 1, 2]
+    assert df["position"].to_list() == [100, 200, 300]
+
+
+def test_store_invalidation(tmp_path):
+    variant_info_file = write_variant_info(tmp_path / "variant_info_extended.txt")
+    store_file = ensure_variant_info_store(variant_info_file)
+    assert store_is_up_to_date(variant_info_file, store_file)
+
+    # Only the mtime changes: the hash is the same, so the store is kept
+    os.utime(variant_info_file, ns=(0, 0))
+    assert store_is_up_to_date(variant_info_file, store_file)
+
+    # The contents change: the store has to be rebuilt, and readers refuse to use it until then
+    write_variant_info(variant_info_file, VARIANT_INFO + "rs4\tchr3:400\tA\tC\t0.4\t0.6\n")
+    assert not store_is_up_to_date(variant_info_file, store_file)
+    with pytest.raises(ValueError, match="out of date"):
+        open_variant_info_store(variant_info_file)
+    ensure_variant_info_store(variant_info_file)
+    assert open_variant_info_store(variant_info_file).height == 4
+
+
+def test_readers_never_build_the_store(tmp_path, monkeypatch):
+    variant_info_file = write_variant_info(tmp_path / "variant_info_extended.txt")
+    with pytest.raises(ValueError, match="does not exist"):
+        open_variant_info_store(variant_info_file)
+
+    store_file = build_variant_info_store(variant_info_file)
+    # Readers don't hash the source, even when its mtime changed
+    os.utime(variant_info_file, ns=(0, 0))
+    monkeypatch.setattr("variant_info_store.hash_file", lambda filepath: pytest.fail("Source file hashed by a reader"))
+    with pytest.raises(ValueError, match="out of date"):
+        check_variant_info_store(variant_info_file)
+    assert sorted(os.listdir(tmp_path)) == ["variant_info_extended.arrow", "variant_info_extended.arrow.json",
+                                            "variant_info_extended.txt"]  # No temporary file is left behind
+    monkeypatch.undo()
+
+    # The build step re-hashes the source and only refreshes the sidecar
+    assert ensure_variant_info_store(variant_info_file) == store_file
+    assert check_variant_info_store(variant_info_file) == store_file
+
+
+def test_lookup_variants(tmp_path):
+    variant_info_file = write_variant_info(tmp_path / "variant_info_extended.txt")
+    build_variant_info_store(variant_info_file)
+    store_df = open_variant_info_store(variant_info_file)
+
+    rows = lookup_variants(store_df, pl.Series(["rs3", "rs1", "missing", "rs3", "zz"]))
+    assert sorted(rows["ID"].to_list()) == ["rs1", "rs3"]
@@ -0,0 +1,248 @@
+import os
+import sys
+import json
+import zlib
+import shutil
+import argparse
+
+import numpy as np
+import polars as pl
+
+from variant_info_store import check_variant_info_store, open_variant_info_store, read_store_metadata, \
+    lookup_variants
+from gwas_file_reader import scan_gwas_file, list_gwas_files
+from extract_variants_by_pval import phenotype_from_file_name, print_status
+
+"""
+Cross-trait matrix of the GWAS results, to look up one variant (or one region) across all the traits at once.
+
+The beta and chi2 columns of every GWAS output file are transposed into two variants x traits matrices, with one row per
+variant of the variant info store, in genomic order (chromosome, then position). Each matrix is cut into chunks of
+CHUNK_ROWS rows (all the traits of a few hundred neighbouring variants), and every chunk is byte-shuffled and
+compressed with zlib on its own, like the chunks of a Zarr array. The chunks of a matrix are written one after the other
+in a single '<name>.chunks' file, with their offsets in '<name>.offsets.npy', so a lookup reads and decompresses only
+the chunks of the requested variants: milliseconds for a few variants, whatever the number of traits.
+
+Layout of the matrix folder:
+    metadata.json           Traits (column order), number of variants, chunk size, fingerprint of the variant store
+    variant_keys.npy        variant_key (see 'variant_info_store.py') of each row, rows in genomic order
+    rows.npy                Row of each variant_key
+    genomic_keys.npy        (chromosome << 32) + position of each row, sorted, for position range lookups
+    beta.chunks, beta.offsets.npy, chi2.chunks, chi2.offsets.npy
+
+Values are stored as float32, and variants missing from the GWAS output file of a trait are NaN. The matrix is built
+from a variant info store, and can only be read with that same store (the variant keys are the row numbers of the
+store).
+
+Usage: python trait_matrix.py /path/to/variant_info_extended.txt /path/to/gwas_output_files/ -o /path/to/trait_matrix
+"""
+
+MATRIX_ARRAYS = ["beta", "chi2"]
+CHUNK_ROWS = 256  # Variants per chunk. All the traits of a chunk are decompressed together.
+BLOCK_CHUNKS = 256  # Chunks assembled in memory at a time while building the matrix
+COMPRESSION_LEVEL = 6
+NULL_GENOMIC_KEY = np.iinfo(np.int64).max  # Variants with no chromosome go to the end
+
+
+def genomic_keys(chromosome: np.ndarray, position: np.ndarray) -> np.ndarray:
+    """Single sortable key for chromosome and position. Variants with no chromosome get NULL_GENOMIC_KEY."""
+    keys = (np.nan_to_num(chromosome, nan=0).astype(np.int64) << 32) + np.nan_to_num(position, nan=0).astype(np.int64)
+    return np.where(np.isnan(chromosome), NULL_GENOMIC_KEY, keys)
+
+
+def compress_chunk(chunk: np.ndarray) -> bytes:
+    """
+    Compress a chunk of float32 values. The bytes are shuffled first (all the first bytes of the values, then all the
+    second bytes...), which makes float data much more compressible.
+    """
+    return zlib.compress(np.ascontiguousarray(chunk, dtype=np.float32).view(np.uint8).reshape(-1, 4).T.tobytes(),
+                         COMPRESSION_LEVEL)
+
+
+def decompress_chunk(data: bytes, num_traits: int) -> np.ndarray:
+    shuffled = np.frombuffer(zlib.decompress(data), dtype=np.uint8).reshape(4, -1)
+    return shuffled.T.copy().view(np.float32).reshape(-1, num_traits)
+
+
+def read_trait_columns(gwas_file: str, store_df: pl.DataFrame, rows: np.ndarray) -> dict:
+    """
+    Read the beta and chi2 of every variant of a GWAS output file, as columns of the matrix.
+
+    :param gwas_file: Path to the GWAS output file (.res, plain or gzipped)
+    :param store_df: Variant info store, as returned by variant_info_store.open_variant_info_store()
+    :param rows: Row of each variant_key in the matrix
+    :return: Dictionary with a float32 array for beta and one for chi2, with one value per row of the matrix
+    """
+    gwas_df = scan_gwas_file(gwas_file).collect()
+    keys = lookup_variants(store_df, gwas_df["ID"]).select(["ID", "variant_key"])
+    gwas_df = gwas_df.join(keys, on="ID", how="inner")  # Variants missing from the store are left out
+    trait_rows = rows[gwas_df["variant_key"].to_numpy()]
+
+    columns = {}
+    for name in MATRIX_ARRAYS:
+        column = np.full(len(rows), np.nan, dtype=np.float32)
+        column[trait_rows] = gwas_df[name].to_numpy()
+        columns[name] = column
+    return columns
+
+
+def build_trait_matrix(variant_info_file: str, files_dir: str, matrix_dir: str, store_file: str = None,
+                       chunk_rows: int = CHUNK_ROWS) -> str:
+    """
+    Build the matrix from all the GWAS output files in a directory.
+
+    The files are read one at a time, and the beta and chi2 of each trait are first written to a temporary,
+    uncompressed column file (one float32 value per variant). The matrix is then assembled from those columns, a block
+    of rows at a time, so memory usage depends on the number of traits and not on the number of variants. The temporary
+    files take as much disk space as the uncompressed matrix.
+
+    :param variant_info_file: Path to the variant info file
+    :param files_dir: Directory containing the GWAS output files (.res, or gzipped .res.gz)
+    :param matrix_dir: Path to the matrix folder. Any previous matrix in it is replaced.
+    :param store_file: Path to the variant info store. Default: see variant_info_store.default_store_path()
+    :param chunk_rows: Number of variants per chunk
+    :return: Path to the matrix folder
+    """
+    store_file = check_variant_info_store(variant_info_file, store_file)
+    store_df = open_variant_info_store(variant_info_file, store_file)
+    gwas_files = list_gwas_files(files_dir)
+    traits = [phenotype_from_file_name(gwas_file) for gwas_file in gwas_files]
+    if not gwas_files:
+        raise ValueError(f"There are no GWAS output files in {files_dir}")
+
+    # Rows in genomic order
+    keys = genomic_keys(store_df["chromosome"].to_numpy().astype(np.float64),
+                        store_df["position"].to_numpy().astype(np.float64))
+    variant_keys = np.argsort(keys, kind="stable")
+    rows = np.empty_like(variant_keys)
+    rows[variant_keys] = np.arange(len(variant_keys))
+
+    if os.path.isdir(matrix_dir):
+        shutil.rmtree(matrix_dir)
+    tmp_dir = os.path.join(matrix_dir, "tmp")
+    os.makedirs(tmp_dir)
+    np.save(os.path.join(matrix_dir, "variant_keys.npy"), variant_keys.astype(np.int64))
+    np.save(os.path.join(matrix_dir, "rows.npy"), rows.astype(np.int64))
+    np.save(os.path.join(matrix_dir, "genomic_keys.npy"), keys[variant_keys])
+
+    # Transpose: one temporary column file per trait and array
+    for i, gwas_file in enumerate(gwas_files):
+        for name, column in read_trait_columns(gwas_file, store_df, rows).items():
+            np.save(os.path.join(tmp_dir, f"{name}_{i}.npy"), column)
+        print_status(int((i + 1) / len(gwas_files) * 50))
+
+    # Assemble the chunks of each matrix, a block of rows at a time
+    block_rows = chunk_rows * BLOCK_CHUNKS
+    for name in MATRIX_ARRAYS:
+        columns = [np.load(os.path.join(tmp_dir, f"{name}_{i}.npy"), mmap_mode="r") for i in range(len(traits))]
+        offsets = [0]
+        with open(os.path.join(matrix_dir, f"{name}.chunks"), "wb") as f:
+            for block_start in range(0, len(variant_keys), block_rows):
+                block = np.column_stack([column[block_start:block_start + block_rows] for column in columns])
+                for chunk_start in range(0, block.shape[0], chunk_rows):
+                    offsets.append(offsets[-1] + f.write(compress_chunk(block[chunk_start:chunk_start + chunk_rows])))
+        np.save(os.path.join(matrix_dir, f"{name}.offsets.npy"), np.array(offsets, dtype=np.int64))
+        del columns
+        print_status(50 + int((MATRIX_ARRAYS.index(name) + 1) / len(MATRIX_ARRAYS) * 50))
+    shutil.rmtree(tmp_dir)
+
+    metadata = {"traits": traits, "num_variants": len(variant_keys), "chunk_rows": chunk_rows,
+                "variant_info_store": read_store_metadata(store_file)}
+    with open(os.path.join(matrix_dir, "metadata.json"), "w") as f:
+        json.dump(metadata, f, indent=2)
+    return matrix_dir
+
+
+def open_trait_matrix(matrix_dir: str, variant_info_file: str = None, store_file: str = None) -> dict:
+    """
+    Open a matrix for lookups. The index arrays are memory-mapped, and nothing else is read until a lookup.
+
+    :param matrix_dir: Path to the matrix folder
+    :param variant_info_file: OPTIONAL. Path to the variant info file. If given, check that the matrix was built from
+     the current version of its store.
+    :param store_file: OPTIONAL. Path to the variant info store. Default: see variant_info_store.default_store_path()
+    :return: Dictionary with the metadata and the index arrays of the matrix
+    """
+    if not os.path.isfile(os.path.join(matrix_dir, "metadata.json")):
+        raise ValueError(f"There is no trait matrix in {matrix_dir}")
+    with open(os.path.join(matrix_dir, "metadata.json"), "r") as f:
+        matrix = json.load(f)
+    if variant_info_file is not None:
+        store_metadata = read_store_metadata(check_variant_info_store(variant_info_file, store_file))
+        if store_metadata.get("hash") != matrix["variant_info_store"].get("hash"):
+            raise ValueError(f"The trait matrix in {matrix_dir} was built from another variant info file. Rebuild it.")
+
+    matrix["dir"] = matrix_dir
+    for name in ["variant_keys", "rows", "genomic_keys"] + [f"{name}.offsets" for name in MATRIX_ARRAYS]:
+        matrix[name] = np.load(os.path.join(matrix_dir, name + ".npy"), mmap_mode="r")
+    return matrix
+
+
+def read_matrix_rows(matrix: dict, rows: np.ndarray) -> dict:
+    """
+    Values of all the traits for the given rows of the matrix. Each chunk is read and decompressed only once.
+
+    :param matrix: Matrix, as returned by open_trait_matrix()
+    :param rows: Rows of the matrix
+    :return: Dictionary with a (rows x traits) float32 array for beta and one for chi2
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    chunk_ids = rows // matrix["chunk_rows"]
+    num_traits = len(matrix["traits"])
+
+    values = {}
+    for name in MATRIX_ARRAYS:
+        offsets = matrix[f"{name}.offsets"]
+        values[name] = np.empty((len(rows), num_traits), dtype=np.float32)
+        with open(os.path.join(matrix["dir"], f"{name}.chunks"), "rb") as f:
+            for chunk_id in np.unique(chunk_ids):
+                f.seek(offsets[chunk_id])
+                chunk = decompress_chunk(f.read(offsets[chunk_id + 1] - offsets[chunk_id]), num_traits)
+                in_chunk = chunk_ids == chunk_id
+                values[name][in_chunk] = chunk[rows[in_chunk] - chunk_id * matrix["chunk_rows"]]
+    return values
+
+
+def rows_of_variant_keys(matrix: dict, variant_keys) -> np.ndarray:
+    return matrix["rows"][np.asarray(variant_keys, dtype=np.int64)]
+
+
+def rows_in_region(matrix: dict, chromosome: int, start: int, end: int) -> np.ndarray:
+    """Rows of the variants within a region (start and end included)."""
+    keys = matrix["genomic_keys"]
+    first = np.searchsorted(keys, (chromosome << 32) + start, side="left")
+    last = np.searchsorted(keys, (chromosome << 32) + end, side="right")
+    return np.arange(first, last)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build a variants x traits matrix of the beta and chi2 values of a "
+                                                 "set of GWAS output files, for cross-trait lookups (see 'phewas.py').")
+    parser.add_argument("variant_info_file",
+                        metavar="FILEPATH",
+                        help="Path to the variant info file.")
+    parser.add_argument("files_filepath",
+                        metavar="FOLDER_PATH",
+                        help="Path to the directory containing the GWAS output files (.res, or gzipped .res.gz).")
+    parser.add_argument("-s", "--variant_info_store",
+                        help="OPTIONAL. Path to the variant info store (see 'variant_info_store.py'). It must be built "
+                             "and up to date. Default: the variant info file path with the '.arrow' extension.")
+    parser.add_argument("-c", "--chunk_rows", type=int, default=CHUNK_ROWS,
+                        help=f"Number of variants per compressed chunk. Smaller chunks make lookups faster, but the "
+                             f"matrix larger. Default: {CHUNK_ROWS}")
+    parser.add_argument("-o", "--output_filepath", required=True,
+                        help="Path to the matrix folder. Any previous matrix in it is replaced.")
+
+    args = parser.parse_args()
+
+    # Input validation
+    if not os.path.isfile(args.variant_info_file):
+        raise ValueError(f"Variant info file {args.variant_info_file} does not exist")
+    if not os.path.isdir(args.files_filepath):
+        raise ValueError(f"GWAS output folder {args.files_filepath} does not exist")
+    if args.chunk_rows < 1:
+        raise ValueError("The number of variants per chunk must be at least 1")
+
+    build_trait_matrix(args.variant_info_file, args.files_filepath, args.output_filepath, args.variant_info_store,
+                       args.chunk_rows)
+    sys.stdout.write(f"\nDone! Trait matrix written to {args.output_filepath}\n")
@@ -0,0 +1,230 @@
+import os
+import sys
+import json
+import hashlib
+import argparse
+import tempfile
+
+import polars as pl
+
+from marker_parsing import decode_markers
+
+"""
+Persistent, pre-indexed copy of the 'variant_info_extended.txt' file.
+
+The text file is converted once into an uncompressed Arrow IPC file, sorted by ID, that every step of the pipeline can
+memory-map instead of parsing the CSV again. The store also contains the chromosome and position decoded from the Marker
+column, and an integer 'variant_key' (the row number in the store) that downstream steps can join on instead of the
+string ID.
+
+A small JSON sidecar ('<store>.json') records the size, modification time and hash of the source file. Only this script
+(the 'build_variant_info_store' rule of the Snakefile) builds the store: when the source changes, a different size or
+mtime triggers a re-hash of the source, and the store is only rebuilt if the hash is different too. The steps that read
+the store only compare the size and mtime of the source with the sidecar, and stop if they differ, so the hundreds of
+concurrent jobs of a run never hash the source or rebuild the store themselves. The store and its sidecar are written to
+temporary files first and moved into place, so readers never see them half written.
+
+Usage: python variant_info_store.py /path/to/variant_info_extended.txt -o /path/to/variant_info_extended.arrow
+"""
+
+STORE_COLUMNS = ["variant_key", "ID", "Marker", "chromosome", "position", "OA", "EA", "EAF", "Info"]
+
+
+def default_store_path(variant_info_file: str) -> str:
+    """Store file used when none is given: next to the source file, with the '.arrow' extension."""
+    return os.path.splitext(variant_info_file)[0] + ".arrow"
+
+
+def hash_file(filepath: str, chunk_size: int = 1 << 24) -> str:
+    """BLAKE2 hash of a file, read in chunks of 'chunk_size' bytes."""
+    file_hash = hashlib.blake2b()
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+def source_fingerprint(variant_info_file: str, with_hash: bool = True) -> dict:
+    """Size, mtime and (optionally) hash of the source file, as stored in the sidecar."""
+    stat = os.stat(variant_info_file)
+    fingerprint = {"source": os.path.abspath(variant_info_file), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    if with_hash:
+        fingerprint["hash"] = hash_file(variant_info_file)
+    return fingerprint
+
+
+def read_store_metadata(store_file: str):
+    """Contents of the JSON sidecar of a store, or None if there is no sidecar."""
+    if not os.path.isfile(store_file + ".json"):
+        return None
+    with open(store_file + ".json", "r") as f:
+        return json.load(f)
+
+
+def temporary_file_for(target_file: str) -> str:
+    """Unique temporary file next to 'target_file' (per process), to write it and then move it into place."""
+    fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(target_file)),
+                                    prefix=os.path.basename(target_file) + ".", suffix=".tmp")
+    os.close(fd)
+    return tmp_file
+
+
+def write_store_metadata(store_file: str, fingerprint: dict) -> None:
+    """Write the JSON sidecar of a store atomically, so that concurrent readers never see it half written."""
+    tmp_file = temporary_file_for(store_file + ".json")
+    try:
+        with open(tmp_file, "w") as f:
+            json.dump(fingerprint, f, indent=2)
+        os.replace(tmp_file, store_file + ".json")
+    finally:
+        if os.path.exists(tmp_file):  # Only if writing it failed
+            os.remove(tmp_file)
+
+
+def store_is_up_to_date(variant_info_file: str, store_file: str) -> bool:
+    """
+    Check whether the store reflects the current contents of the source file. If only the mtime of the source changed
+    but its hash did not (e.g. the file was copied or touched), the sidecar is updated and the store is kept.
+
+    :param variant_info_file: Path to the variant info file
+    :param store_file: Path to the store file
+    :return: True if the store can be used as is
+    """
+    metadata = read_store_metadata(store_file)
+    if not os.path.isfile(store_file) or metadata is None:
+        return False
+
+    current = source_fingerprint(variant_info_file, with_hash=False)
+    if current["size"] == metadata["size"] and current["mtime_ns"] == metadata["mtime_ns"]:
+        return True
+
+    current["hash"] = hash_file(variant_info_file)
+    if current["hash"] != metadata.get("hash"):
+        return False
+    write_store_metadata(store_file, current)  # Same contents, only refresh the mtime
+    os.utime(store_file)  # And mark the store as newer than the source, so Snakemake does not consider it outdated
+    return True
+
+
+def build_variant_info_store(variant_info_file: str, store_file: str = None) -> str:
+    """
+    Convert the variant info file into the Arrow IPC store. The file is written to a temporary name first and then
+    moved into place, so readers never see a half written store.
+
+    :param variant_info_file: Path to the variant info file
+    :param store_file: Path to the store file. Default: see default_store_path()
+    :return: Path to the store file
+    """
+    if store_file is None:
+        store_file = default_store_path(variant_info_file)
+
+    fingerprint = source_fingerprint(variant_info_file)
+
+    df = pl.read_csv(variant_info_file, separator='\t', columns=["ID", "Marker", "OA", "EA", "EAF", "Info"],
+                     dtypes={"ID": pl.Utf8, "Marker": pl.Utf8, "OA": pl.Utf8, "EA": pl.Utf8})
+    df = decode_markers(df).sort("ID")
+    df = df.with_row_count("variant_key").select(STORE_COLUMNS)
+
+    # Uncompressed, so that it can be memory-mapped
+    tmp_store_file = temporary_file_for(store_file)
+    try:
+        df.write_ipc(tmp_store_file, compression="uncompressed")
+        os.replace(tmp_store_file, store_file)
+    finally:
+        if os.path.exists(tmp_store_file):  # Only if writing it failed
+            os.remove(tmp_store_file)
+    write_store_metadata(store_file, fingerprint)
+
+    return store_file
+
+
+def ensure_variant_info_store(variant_info_file: str, store_file: str = None) -> str:
+    """Build the store if it does not exist or is out of date, and return its path."""
+    if store_file is None:
+        store_file = default_store_path(variant_info_file)
+    if not store_is_up_to_date(variant_info_file, store_file):
+        sys.stdout.write(f"Building variant info store {store_file} from {variant_info_file}...\n")
+        build_variant_info_store(variant_info_file, store_file)
+    return store_file
+
+
+def check_variant_info_store(variant_info_file: str, store_file: str = None) -> str:
+    """
+    Check that the store exists and was built from the current source file, and return its path. Only the size and
+    mtime of the source are compared with the sidecar: the source is not hashed and the store is never rebuilt here.
+
+    :param variant_info_file: Path to the variant info file
+    :param store_file: Path to the store file. Default: see default_store_path()
+    :return: Path to the store file
+    """
+    if store_file is None:
+        store_file = default_store_path(variant_info_file)
+    build_command = f"python variant_info_store.py {variant_info_file} -o {store_file}"
+    metadata = read_store_metadata(store_file)
+    if not os.path.isfile(store_file) or metadata is None:
+        raise ValueError(f"Variant info store {store_file} does not exist. Build it with '{build_command}'")
+    current = source_fingerprint(variant_info_file, with_hash=False)
+    if current["size"] != metadata["size"] or current["mtime_ns"] != metadata["mtime_ns"]:
+        raise ValueError(f"Variant info store {store_file} is out of date. Update it with '{build_command}'")
+    return store_file
+
+
+def open_variant_info_store(variant_info_file: str, store_file: str = None) -> pl.DataFrame:
+    """
+    Memory-map the variant info store, after checking that it is up to date (see check_variant_info_store()). Only
+    the pages that are actually accessed are read from disk.
+
+    :param variant_info_file: Path to the variant info file
+    :param store_file: Path to the store file. Default: see default_store_path()
+    :return: DataFrame backed by the memory-mapped store, sorted by ID
+    """
+    store_file = check_variant_info_store(variant_info_file, store_file)
+    store_df = pl.read_ipc(store_file, memory_map=True)
+    return store_df.with_columns(pl.col("ID").set_sorted())
+
+
+def scan_variant_info_store(variant_info_file: str, store_file: str = None) -> pl.LazyFrame:
+    """Same as open_variant_info_store(), but as a LazyFrame for full-table joins."""
+    store_file = check_variant_info_store(variant_info_file, store_file)
+    return pl.scan_ipc(store_file, memory_map=True)
+
+
+def lookup_variants(store_df: pl.DataFrame, ids: pl.Series) -> pl.DataFrame:
+    """
+    Fetch the store rows for a set of variant IDs with a binary search on the sorted ID column, instead of hashing the
+    whole store. IDs that are not in the store are left out.
+
+    :param store_df: Store, as returned by open_variant_info_store()
+    :param ids: Variant IDs to look up
+    :return: Store rows for the requested IDs
+    """
+    ids = ids.unique()
+    idx = store_df["ID"].search_sorted(ids)
+    found = (idx < store_df.height)
+    idx, ids = idx.filter(found), ids.filter(found)
+    rows = store_df[idx]
+    return rows.filter(rows["ID"] == ids)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert a 'variant_info.txt' file into a memory-mappable Arrow IPC "
+                                                 "store, sorted by ID, with decoded chromosome/position columns and an"
+                                                 " integer variant key.")
+    parser.add_argument("variant_info_file",
+                        metavar="FILEPATH",
+                        help="Path to the variant info file.")
+    parser.add_argument("-o", "--output_file",
+                        help="Path to the store file. Default: the variant info file path with the '.arrow' extension.")
+    parser.add_argument("-f", "--force", action="store_true",
+                        help="Rebuild the store even if it is up to date.")
+
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.variant_info_file):
+        raise ValueError(f"Variant info file {args.variant_info_file} does not exist")
+
+    if args.force:
+        store = build_variant_info_store(args.variant_info_file, args.output_file)
+    else:
+        store = ensure_variant_info_store(args.variant_info_file, args.output_file)
+    sys.stdout.write(f"Variant info store ready: {store}\n")
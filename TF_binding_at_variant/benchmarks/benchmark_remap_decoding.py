@@ -0,0 +1,82 @@
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+import polars as pl
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from remap_records import decode_remap_records, STUDIES_COLUMNS
+
+"""
+Benchmark of the decoding of the ReMap rows of a lookup. It compares the original implementation of
+extract_studies_for_single_snp() (a struct lambda for the peak center, a lambda for the distance, and three splits of
+the name column each followed by a lambda) against the native expressions in 'remap_records.py', on a synthetic slice
+of the ReMap file. Results are printed as rows per second.
+
+Usage: python benchmarks/benchmark_remap_decoding.py -n 1000000
+"""
+
+SNP_POS = 23939135
+
+
+def make_remap_slice(num_rows: int, seed: int = 0) -> pl.DataFrame:
+    """Synthetic ReMap rows around SNP_POS, with names drawn from a few thousand studies."""
+    rng = np.random.default_rng(seed)
+    start = SNP_POS - rng.integers(1, 2000, num_rows)
+    end = SNP_POS + rng.integers(0, 2000, num_rows)
+    thick_start = rng.integers(start, end)
+    study = rng.integers(0, 5000, num_rows)
+    names = [f"GSE{study_id}.TF{study_id % 800}.biotype{study_id % 300}" for study_id in study]
+    return pl.DataFrame({"chrom": "chr1", "start": start, "end": end, "name": names, "score": 0.0, "strand": ".",
+                         "thickStart": thick_start, "thickEnd": thick_start + 1, "itemRgb": "0,0,0"})
+
+
+def legacy_decode(df: pl.DataFrame) -> pl.DataFrame:
+    """The way extract_studies_for_single_snp() used to do it: one Python call per row and column."""
+    pos = str(SNP_POS)
+    df = df.with_columns(pl.struct(['thickStart', 'thickEnd'])
+                         .map_elements(lambda s: int((s['thickStart'] + s['thickEnd']) / 2)).cast(pl.Int64)
+                         .alias("thickCenter"))
+    df = df.with_columns(pl.col("thickCenter")
+                         .map_elements(lambda s: abs(int(s) - int(pos))).cast(pl.Int64)
+                         .alias("distance_to_peak"))
+    df = df.with_columns([pl.col("name").str.split(".").map_elements(lambda s: s[0]).alias("study_accession"),
+                          pl.col("name").str.split(".").map_elements(lambda s: s[1]).alias("transcription_factor"),
+                          pl.col("name").str.split(".").map_elements(lambda s: s[2]).alias("biotype")])
+    return df.select(STUDIES_COLUMNS)
+
+
+def native_decode(df: pl.DataFrame) -> pl.DataFrame:
+    return decode_remap_records(df, SNP_POS).select(STUDIES_COLUMNS)
+
+
+def time_it(function, df: pl.DataFrame, repeats: int) -> float:
+    """Best wall time out of 'repeats' runs."""
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function(df)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the decoding of the ReMap rows, before and after.")
+    parser.add_argument("-n", "--num_rows", type=int, default=1_000_000, help="Number of rows. Default: 1000000")
+    parser.add_argument("-r", "--repeats", type=int, default=3, help="Number of runs, the best is kept. Default: 3")
+    args = parser.parse_args()
+
+    remap_df = make_remap_slice(args.num_rows)
+
+    # Both implementations must agree before timing them
+    assert legacy_decode(remap_df.head(10000)).equals(native_decode(remap_df.head(10000)))
+
+    legacy_time = time_it(legacy_decode, remap_df, args.repeats)
+    native_time = time_it(native_decode, remap_df, args.repeats)
+
+    print(f"Rows: {args.num_rows}")
+    print(f"Before (struct lambda + three splits):  {args.num_rows / legacy_time:,.0f} rows/sec")
+    print(f"After (native expressions, one split):  {args.num_rows / native_time:,.0f} rows/sec")
+    print(f"Speed-up: {legacy_time / native_time:.1f}x")
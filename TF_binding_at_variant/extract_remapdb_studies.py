@@ -3,11 +3,28 @@ import os
 import argparse
 import sys
 
+from tabix_reader import open_tabix_file, fetch_lines, fetch_regions
+from remap_index import load_remap_index, overlap_pairs, query_remap_index
+from remap_records import STUDIES_COLUMNS, parse_remap_records, decode_remap_records
+
 """
 This script is used to look up the ReMap studies with ChIP-seq data for a transcription factor that binds over a SINGLE,
  specific genetic variant.
+
+It also contains the batch version of the lookup, extract_studies_for_snps(), which answers a whole list of variants
+with a single query to the ReMap file and returns one long-format table.
+
+The batch lookup has two backends:
+ - 'tabix': the ReMap file is read in-process through its tabix index (see 'tabix_reader.py'), only around the variants.
+   The tabix command line tool is not needed, and nothing is written to temporary files.
+ - 'scan': the peaks are loaded from a cached index of the whole ReMap file (see 'remap_index.py'), built by reading the
+   file once. This is faster for large snplists.
+By default ('auto'), the scan backend is used from SCAN_MODE_MIN_POSITIONS variant positions on.
 """
 
+LOOKUP_MODES = ["auto", "tabix", "scan"]
+SCAN_MODE_MIN_POSITIONS = 10000
+
 
 def extract_studies_for_single_snp(chr_pos: str, remap_file: str, tmp_dir: str, output: str,
                                    verbose: bool = False) -> None:
@@ -19,8 +36,8 @@ def extract_studies_for_single_snp(chr_pos: str, remap_file: str, tmp_dir: str,
 
     :param chr_pos: Position of the SNP in the format <chr>:<pos>
     :param remap_file: Path to ReMap BED file. Requires tabix index file.
-    :param tmp_dir: Directory to store temporary files (i.e. tabix "slices" of the remap metadata file for the queried
-     position). If none is specified, temporary files will be stored in the current working directory.
+    :param tmp_dir: No longer used: the tabix query is made in-process, without temporary files. Kept for
+     compatibility.
     :param output: Output file.
     :param verbose: If True, print progress to stdout.
     :return: None
@@ -48,26 +65,13 @@ def extract_studies_for_single_snp(chr_pos: str, remap_file: str, tmp_dir: str,
         sys.stdout.write(f"\nRequested position: <{snp_full_pos}>\n")
 
     # Check if ReMap file exists, it is bgzipped, and it has a tabix index file
-    if not os.path.isfile(remap_file):
-        raise ValueError("ReMap file does not exist")
-    if not remap_file.endswith(".gz"):
-        raise ValueError("ReMap file must be bgzipped")
-    if not os.path.isfile(remap_file + ".tbi"):
-        raise ValueError("No tabix index file could be found for the ReMap file.")
+    check_remap_file(remap_file)
 
-    # Check that tabix is installed, but don't print anything to stdout/stderr
-    if os.system("tabix --version > /dev/null 2>&1") != 0:
-        raise ValueError("tabix is not installed or cannot be reached. Please install tabix and try again.")
-
-    # Start processing the tabix query output
-    # Compose tabix query
-    command = f"tabix {remap_file} {snp_full_pos}"
-
-    # Run command and store output. Requires tabix.
-    query_output = os.popen(command).read()
+    # Query the ReMap file through its tabix index. BED coordinates are 0-based: the SNP is the interval [pos - 1, pos)
+    query_output = fetch_lines(open_tabix_file(remap_file), f"chr{chrom}", int(pos) - 1, int(pos))
 
     # Check if the output is empty. If so, give a warning, write an empty file, and return None to quit early.
-    if query_output == "":
+    if not query_output:
         sys.stderr.write(f"\nWARNING in extract_studies_for_single_snp : "
                          f"No ReMap entries found for position {snp_full_pos}\n")
         if verbose:
@@ -77,40 +81,11 @@ def extract_studies_for_single_snp(chr_pos: str, remap_file: str, tmp_dir: str,
             f.write("study_accession\ttranscription_factor\tbiotype\tdistance_to_peak\n")
         return None
 
-    # Save the output of the tabix query to a file
-    if not tmp_dir:  # If no tmp_dir is specified, use the current working directory
-        tmp_dir = os.getcwd()
-    # Check if a directory named 'tabix_slices' exists in the tmp_dir. If not, create it.
-    if not os.path.isdir(f"{tmp_dir}/tabix_slices"):
-        os.mkdir(f"{tmp_dir}/tabix_slices")
-    tmp_file = f"remap2022_all_macs2_hg38_v1_0.{snp_full_pos}.bed"
-    tmp_file_path = f"{tmp_dir}/tabix_slices/{tmp_file}"
-    with open(tmp_file_path, "w") as f:
-        f.write(query_output)
-
-    df = pl.read_csv(tmp_file_path, separator="\t", has_header=False,
-                     new_columns=["chrom", "start", "end", "name", "score", "strand", "thickStart", "thickEnd",
-                                  "itemRgb"],
-                     dtypes={"chrom": pl.Utf8, "start": pl.Int64, "end": pl.Int64, "name": pl.Utf8, "score": pl.Float64,
-                             "strand": pl.Utf8, "thickStart": pl.Int64, "thickEnd": pl.Int64, "itemRgb": pl.Utf8})
-
-    # Distance of SNP to peak. We'll use this to sort entries later
+    # Distance of SNP to peak (we'll use this to sort entries later), and the three fields of the name column.
     # It'd probably be fine to calculate distance to thickStart, but we'll calculate the center of the peak to be safe
-    df = df.with_columns(pl.struct(['thickStart', 'thickEnd'])
-                         .apply(lambda s: int((s['thickStart'] + s['thickEnd']) / 2)).cast(pl.Int64)
-                         .alias("thickCenter"))
-
-    # Calculate distance to SNP pos (stored in variable 'pos')
-    df = df.with_columns(pl.col("thickCenter")
-                         .apply(lambda s: abs(int(s) - int(pos))).cast(pl.Int64)
-                         .alias("distance_to_peak"))
+    df = decode_remap_records(parse_remap_records(b"\n".join(query_output)), int(pos))
 
-    # Split the name column by '.' and make new columns out of the three entries
-    df = df.with_columns([pl.col("name").str.split(".").apply(lambda s: s[0]).alias("study_accession"),
-                          pl.col("name").str.split(".").apply(lambda s: s[1]).alias("transcription_factor"),
-                          pl.col("name").str.split(".").apply(lambda s: s[2]).alias("biotype")])
-
-    out_df = df.select(["study_accession", "transcription_factor", "biotype", "distance_to_peak"])
+    out_df = df.select(STUDIES_COLUMNS)
 
     # Sort by distance from SNP to ChIP-seq peak.
     out_df = out_df.sort("distance_to_peak")
@@ -119,13 +94,156 @@ def extract_studies_for_single_snp(chr_pos: str, remap_file: str, tmp_dir: str,
     out_df.write_csv(output, separator="\t")
 
 
+def check_remap_file(remap_file: str) -> None:
+    """Check that the ReMap file exists, it is bgzipped, and it has a tabix index file."""
+    if not os.path.isfile(remap_file):
+        raise ValueError("ReMap file does not exist")
+    if not remap_file.endswith(".gz"):
+        raise ValueError("ReMap file must be bgzipped")
+    if not os.path.isfile(remap_file + ".tbi"):
+        raise ValueError("No tabix index file could be found for the ReMap file.")
+
+
+def read_snp_positions(snps_df: pl.DataFrame) -> pl.DataFrame:
+    """
+    Unique positions of a table of variants with the 'Chrom' and 'Pos' columns (e.g. a snplist).
+
+    :param snps_df: DataFrame with the 'Chrom' (with or without 'chr') and 'Pos' columns
+    :return: DataFrame with the columns chr (without 'chr'), pos and chrom (with 'chr', as in the ReMap file), sorted
+    """
+    positions_df = snps_df.select([pl.col("Chrom").cast(pl.Utf8).str.replace("chr", "").alias("chr"),
+                                   pl.col("Pos").cast(pl.Int64).alias("pos")]).unique()
+    positions_df = positions_df.with_columns((pl.lit("chr") + pl.col("chr")).alias("chrom"))
+    return positions_df.sort(["chrom", "pos"])
+
+
+def resolve_lookup_mode(mode: str, num_positions: int) -> str:
+    """The backend used for a number of variant positions: 'auto' is 'scan' from SCAN_MODE_MIN_POSITIONS on."""
+    if mode not in LOOKUP_MODES:
+        raise ValueError(f"Lookup mode must be one of {LOOKUP_MODES}")
+    if mode == "auto":
+        return "scan" if num_positions >= SCAN_MODE_MIN_POSITIONS else "tabix"
+    return mode
+
+
+def query_remap_tabix(remap_file: str, positions_df: pl.DataFrame) -> pl.DataFrame:
+    """
+    Fetch the ReMap entries overlapping any of the positions through the tabix index of the ReMap file, in-process. The
+    positions are sorted, so neighbouring positions share the decompressed blocks of the file.
+
+    :param remap_file: Path to ReMap BED file. Requires tabix index file.
+    :param positions_df: DataFrame with the 'chrom' (e.g. 'chr1') and 'pos' columns, as made by read_snp_positions()
+    :return: DataFrame with the REMAP_COLUMNS, in the order of the ReMap file
+    """
+    regions = [(chrom, pos - 1, pos) for chrom, pos in positions_df.select(["chrom", "pos"]).iter_rows()]
+    query_output = fetch_regions(open_tabix_file(remap_file), regions, with_offsets=True)
+
+    # Entries overlapping several of the regions are fetched once per region. They are told apart by their offset in
+    # the file, so that identical lines of the file are all kept, like in the 'scan' mode.
+    records = sorted(dict(query_output).items())
+    return parse_remap_records(b"\n".join(line for _, line in records))
+
+
+def assign_peaks_to_snps(records_df: pl.DataFrame, positions_df: pl.DataFrame) -> pl.DataFrame:
+    """
+    Pair every ReMap entry with every position it overlaps, like a tabix query for '<chrom>:<pos>-<pos>' would: BED
+    entries are 0-based and half-open, so an entry overlaps 'pos' if start < pos <= end (see
+    remap_index.overlap_pairs()).
+
+    :param records_df: DataFrame with (at least) the chrom, start and end columns of the ReMap entries
+    :param positions_df: DataFrame with the 'chr', 'chrom' and 'pos' columns, as made by read_snp_positions()
+    :return: records_df with the chr and pos columns added, with one row per entry and overlapped position
+    """
+    records_df = records_df.with_row_count("record")
+    pairs = []
+    for chrom in records_df["chrom"].unique(maintain_order=True):
+        chrom_records = records_df.filter(pl.col("chrom") == chrom)
+        chrom_positions = positions_df.filter(pl.col("chrom") == chrom)
+        record_idx, position_idx = overlap_pairs(chrom_records["start"].to_numpy(), chrom_records["end"].to_numpy(),
+                                                 chrom_positions["pos"].to_numpy())
+        pairs.append(pl.DataFrame([chrom_records["record"][record_idx],
+                                   chrom_positions["chr"][position_idx],
+                                   chrom_positions["pos"][position_idx]]))
+    if not pairs:
+        return records_df.drop("record").with_columns([pl.lit(None, pl.Utf8).alias("chr"),
+                                                       pl.lit(None, pl.Int64).alias("pos")])
+    return pl.concat(pairs).join(records_df, on="record", how="left").drop("record")
+
+
+def extract_studies_for_snps(snps_df: pl.DataFrame, remap_file: str, verbose: bool = False, biotypes: list = None,
+                             mode: str = "auto", index_file: str = None) -> pl.DataFrame:
+    """
+    Batch version of extract_studies_for_single_snp(): look up the ReMap studies for every variant of a table at once,
+    and return them as one long-format table. The ReMap file is either queried through its tabix index around the
+    variants, or read from the cached index of all its peaks (see the module docstring).
+
+    :param snps_df: DataFrame with the 'Chrom' and 'Pos' columns of the variants, e.g. the snplist
+    :param remap_file: Path to ReMap BED file. Requires tabix index file for the 'tabix' mode.
+    :param verbose: If True, print progress to stdout.
+    :param biotypes: OPTIONAL. Only keep the studies of these biotypes, e.g. as read by
+     produce_final_remap_output.read_filter_file(). The 'scan' mode applies the filter while building its index.
+    :param mode: OPTIONAL. One of LOOKUP_MODES: 'tabix', 'scan', or 'auto' to pick 'scan' from SCAN_MODE_MIN_POSITIONS
+     positions on. Default: 'auto'
+    :param index_file: OPTIONAL. Cache file of the 'scan' mode. Default: see remap_index.default_index_path()
+    :return: DataFrame with the columns chr, pos, study_accession, transcription_factor, biotype and distance_to_peak.
+     Sorted by chr and pos, and the studies of each position by distance from the variant to the peak.
+    """
+    positions_df = read_snp_positions(snps_df)
+    mode = resolve_lookup_mode(mode, positions_df.height)
+    if verbose:
+        sys.stdout.write(f"\nLooking up {positions_df.height} positions in {remap_file} ('{mode}' mode)\n")
+
+    if mode == "scan":
+        if not os.path.isfile(remap_file):
+            raise ValueError("ReMap file does not exist")
+        studies_df = query_remap_index(load_remap_index(remap_file, biotypes, index_file), positions_df)
+    else:
+        check_remap_file(remap_file)
+        records_df = query_remap_tabix(remap_file, positions_df)
+        studies_df = assign_peaks_to_snps(records_df, positions_df).with_row_count("record_order")
+
+    # Distance of SNP to the center of the peak, and the three fields of the name column (accession.TF.biotype)
+    studies_df = decode_remap_records(studies_df, "pos")
+    if biotypes:
+        studies_df = studies_df.filter(pl.col("biotype").is_in(biotypes))
+
+    missing = positions_df.join(studies_df, on=["chr", "pos"], how="anti")
+    if missing.height > 0:
+        sys.stderr.write(f"\nWARNING in extract_studies_for_snps : No ReMap entries found for {missing.height} of the "
+                         f"{positions_df.height} positions\n")
+
+    # Numeric chromosomes are sorted as numbers, the others (X, Y...) after them
+    return (studies_df.sort([pl.col("chr").cast(pl.Int64, strict=False), "chr", "pos", "distance_to_peak",
+                             "record_order"], nulls_last=True)
+            .select(["chr", "pos"] + STUDIES_COLUMNS))
+
+
+def write_studies_per_snp(studies_df: pl.DataFrame, snps_df: pl.DataFrame, output_dir: str) -> list:
+    """
+    Write the result of extract_studies_for_snps() as one file per variant position, 'remap_studies_<chr>:<pos>.txt',
+    with the same columns as extract_studies_for_single_snp(). Positions with no studies get an empty file.
+
+    :param studies_df: Long-format table, as returned by extract_studies_for_snps()
+    :param snps_df: DataFrame with the 'Chrom' and 'Pos' columns of the variants
+    :param output_dir: Directory where the files will be written to
+    :return: Paths to the files written
+    """
+    studies_by_position = studies_df.partition_by(["chr", "pos"], as_dict=True)
+    output_files = []
+    for chr_name, pos in read_snp_positions(snps_df).select(["chr", "pos"]).iter_rows():
+        output_file = os.path.join(output_dir, f"remap_studies_{chr_name}:{pos}.txt")
+        position_df = studies_by_position.get((chr_name, pos), studies_df.clear())
+        position_df.select(STUDIES_COLUMNS).write_csv(output_file, separator="\t")
+        output_files.append(output_file)
+    return output_files
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("chr_pos", help="Position of the SNP in the format <chr>:<pos>")
     parser.add_argument("-r", "--remap_file", required=True,
                         help="Path to ReMap BED file. Requires tabix index file.")
-    parser.add_argument("-t", "--tmp_dir", help="OPTIONAL. Directory to store temporary files. If none is specified, "
-                                                "temporary files will be stored in the current working directory.")
+    parser.add_argument("-t", "--tmp_dir", help="OPTIONAL. No longer used: no temporary files are written.")
     parser.add_argument("-o", "--output", required=True, help="Output file.")
     parser.add_argument("-v", "--verbose", action="store_true", help="Print verbose output.")
 
@@ -4,15 +4,51 @@ import polars as pl
 import argparse
 
 """
-This file will combine every individual file in the 'remap_lookup_outputs/' directory into a single file.
-The final file will have the following columns:
+This file will produce the final ReMap lookup file, with the following columns:
 chr | pos | study_accession | transcription_factor | biotype | distance_to_snp
 
+'remap_lookup_for_full_snplist.py' writes all the variants to a single long-format table (-f), sorted by chr and pos.
+That table already is the final file: it is only scanned lazily here (-i), to copy it and/or filter it by biotype. The
+table can be tab-separated, or Parquet if its name ends with '.parquet'.
+The old layout, with one file per variant position in a 'remap_lookup_outputs/' directory (-d), can still be combined.
+
 The script will also offer the chance to filter the entries by biotype.
 
 This script is expected to be run after 'remap_lookup_for_full_snplist.py'.
 """
 
+REMAP_OUTPUT_DTYPES = {"chr": pl.Utf8, "pos": pl.Int64, "study_accession": pl.Utf8, "transcription_factor": pl.Utf8,
+                       "biotype": pl.Utf8, "distance_to_peak": pl.Int64}
+
+
+def scan_remap_lookup_table(lookup_file: str) -> pl.LazyFrame:
+    """
+    Lazily scan the long-format table written by 'remap_lookup_for_full_snplist.py'.
+
+    :param lookup_file: Path to the table. Tab-separated, or Parquet if the name ends with '.parquet'
+    :return: LazyFrame with the chr, pos, study_accession, transcription_factor, biotype and distance_to_peak columns
+    """
+    if not os.path.isfile(lookup_file):
+        raise ValueError(f"ReMap lookup file {lookup_file} does not exist")
+    if lookup_file.endswith(".parquet"):
+        return pl.scan_parquet(lookup_file).select(list(REMAP_OUTPUT_DTYPES))
+    return pl.scan_csv(lookup_file, separator="\t", dtypes=REMAP_OUTPUT_DTYPES)
+
+
+def write_final_remap_output(lookup_file: str, output_file: str, biotypes: list = None) -> None:
+    """
+    Write the final ReMap lookup file from the long-format table, optionally keeping only some biotypes. The table is
+    already sorted by chr and pos, so nothing is combined or sorted: it is scanned once, filtered and written.
+
+    :param lookup_file: Path to the table written by 'remap_lookup_for_full_snplist.py'
+    :param output_file: Name of the output file (tab-separated)
+    :param biotypes: OPTIONAL. Biotypes to keep. Default: keep all the entries
+    """
+    lookup_lf = scan_remap_lookup_table(lookup_file)
+    if biotypes:
+        lookup_lf = lookup_lf.filter(pl.col("biotype").is_in(biotypes))
+    lookup_lf.collect().write_csv(output_file, separator="\t")
+
 
 def produce_final_remap_output(interim_file_dir: str, output_file: str) -> None:
     """
@@ -38,9 +74,10 @@ def produce_final_remap_output(interim_file_dir: str, output_file: str) -> None:
 
     files_list = os.listdir(interim_file_dir)  # Get the name of every file in the remap_lookup_outputs/ directory
     # Empty DataFrame with the correct schema
-    df = pl.DataFrame(schema=[("chr", pl.Int32), ("pos", pl.Int32), ("study_accession", pl.Utf8),
-                              ("transcription_factor", pl.Utf8), ("biotype", pl.Utf8), ("distance_to_peak", pl.Int32)])
-    # Fill up the DataFrame with the contents of each file
+    dfs = [pl.DataFrame(schema=[("chr", pl.Int32), ("pos", pl.Int32), ("study_accession", pl.Utf8),
+                                ("transcription_factor", pl.Utf8), ("biotype", pl.Utf8),
+                                ("distance_to_peak", pl.Int32)])]
+    # Read the contents of each file, and concatenate them all at once
     for file in files_list:
         # Get chr:pos from the filename
         chr_pos = file.replace("remap_studies_", "").replace(".txt", "")
@@ -53,10 +90,11 @@ def produce_final_remap_output(interim_file_dir: str, output_file: str) -> None:
         tmp_df = tmp_df.with_columns([pl.lit(chr_int).alias("chr"), pl.lit(pos_int).alias("pos")])
         # Reorder columns
         tmp_df = tmp_df.select(["chr", "pos", "study_accession", "transcription_factor", "biotype", "distance_to_peak"])
-        df = df.vstack(tmp_df)
+        dfs.append(tmp_df.with_columns([pl.col("chr").cast(pl.Int32), pl.col("pos").cast(pl.Int32)]))
+    df = pl.concat(dfs)
 
-    # Sort by chr and pos
-    df = df.sort(["chr", "pos"])
+    # Sort by chr and pos. The entries of each position keep the order of their file (by distance to the peak).
+    df = df.with_row_count("file_order").sort(["chr", "pos", "file_order"]).drop("file_order")
 
     # Write to file
     df.write_csv(output_file, separator="\t")
@@ -116,21 +154,30 @@ def filter_remap_output_file_by_biotype(full_file: str, biotypes_file: str, outp
 if __name__ == "__main__":
     parser = argparse.ArgumentParser("Look up the ReMap database and produce an output file with all the TFs that bind"
                                      "over the variants on interest. It is possible to filter the output by biotype.")
-    parser.add_argument("-d", "--interim_file_dir", type=str, help="Directory where the individual files are stored. "
-                                                                   "Usually named 'remap_lookup_outputs/'.")
+    parser.add_argument("-i", "--lookup_file", type=str, help="Long-format table written by "
+                                                              "'remap_lookup_for_full_snplist.py' (-f).")
+    parser.add_argument("-d", "--interim_file_dir", type=str, help="OPTIONAL. Instead of -i, directory where the "
+                                                                   "individual files are stored. Usually named "
+                                                                   "'remap_lookup_outputs/'.")
     parser.add_argument("-f", "--filter", help="File containing the list of biotypes to filter by. If no file is "
                                                "provided, no filtering will be done.")
     parser.add_argument("-o", "--output_file", required=True, help="Name of the output file.")
 
     args = parser.parse_args()
 
-    # Check that the interim file directory exists and is not empty
-    if not os.path.isdir(args.interim_file_dir):
-        raise ValueError("Directory does not exist")
-    if len(os.listdir(args.interim_file_dir)) == 0:
-        raise ValueError("Directory is empty")
+    if bool(args.lookup_file) == bool(args.interim_file_dir):
+        raise ValueError("Exactly one of -i (lookup table) and -d (directory of individual files) must be given")
+
+    if args.lookup_file:
+        write_final_remap_output(args.lookup_file, args.output_file)
+    else:
+        # Check that the interim file directory exists and is not empty
+        if not os.path.isdir(args.interim_file_dir):
+            raise ValueError("Directory does not exist")
+        if len(os.listdir(args.interim_file_dir)) == 0:
+            raise ValueError("Directory is empty")
 
-    produce_final_remap_output(args.interim_file_dir, args.output_file)
+        produce_final_remap_output(args.interim_file_dir, args.output_file)
     sys.stdout.write(f"\nWrote full ReMap lookup results to: {args.output_file}\n")
 
     if args.filter:
@@ -142,5 +189,8 @@ if __name__ == "__main__":
         sys.stdout.write("\nFiltered file requested. Creating second file with only the desired biotypes\n")
 
         filtered_file_name = args.output_file.replace(".tsv", "_filtered.tsv")
-        filter_remap_output_file_by_biotype(args.output_file, args.filter, filtered_file_name)
+        if args.lookup_file:
+            write_final_remap_output(args.lookup_file, filtered_file_name, read_filter_file(args.filter))
+        else:
+            filter_remap_output_file_by_biotype(args.output_file, args.filter, filtered_file_name)
         sys.stdout.write(f"\nWrote filtered ReMap lookup results to: {filtered_file_name}\n")
@@ -0,0 +1,241 @@
+import os
+import sys
+import gzip
+import json
+import hashlib
+import argparse
+import tempfile
+
+import numpy as np
+import polars as pl
+
+from produce_final_remap_output import read_filter_file
+from remap_records import parse_remap_records, thick_center_expr, name_fields_expr
+
+"""
+Preloaded index of the ReMap peaks, for looking up large snplists (tens of thousands of variants) in one go.
+
+Past a few thousand variants, one random-access tabix query per variant loses to reading the ReMap file once. This
+module streams the bgzipped BED file a chunk at a time, optionally keeping only the peaks of some biotypes (e.g. the
+list read by produce_final_remap_output.read_filter_file()), and keeps the peaks as numpy arrays sorted by chromosome
+and start position:
+    chroms, chrom_offsets     Chromosome names, and the rows [chrom_offsets[i], chrom_offsets[i + 1]) of each of them
+    start, end, thick_center  Peak coordinates (BED, 0-based and half-open), and the center of the thick part
+    name_code, names          Index of the name of each peak ('<study_accession>.<TF>.<biotype>') in 'names'
+
+The arrays are cached as a '.npz' file, with a JSON sidecar recording the size and mtime of the ReMap file and the
+biotype filter. The cache is rebuilt automatically when either of them changes. Both files are written to a temporary
+file first and moved into place, so concurrent readers never see them half written. The pipeline keeps the cache in a
+folder of its own ('remap_index_file' in the config file), since the ReMap file is usually shared and read-only;
+without a path, it is put next to the ReMap file. Overlaps for all the variants are then found with one vectorized
+sweep per chromosome, see overlap_pairs().
+
+Usage: python remap_index.py /path/to/remap2022_all_macs2_hg38_v1_0.bed.gz -b /path/to/biotypes.txt
+"""
+
+INDEX_ARRAYS = ["chroms", "chrom_offsets", "start", "end", "thick_center", "name_code", "names"]
+SCAN_CHUNK_BYTES = 1 << 26  # Decompressed bytes of the ReMap file parsed at once (64 MB)
+
+
+def default_index_path(remap_file: str, biotypes: list = None) -> str:
+    """
+    Cache file used when none is given: next to the ReMap file, with the '.remap_index.npz' extension. Indexes filtered
+    by biotype get a short hash of the biotype list in their name, so that several filters can be cached side by side.
+    """
+    remap_path = remap_file[:-3] if remap_file.endswith(".gz") else remap_file
+    remap_path = os.path.splitext(remap_path)[0]
+    if biotypes:
+        biotypes_hash = hashlib.blake2b("\n".join(sorted(set(biotypes))).encode(), digest_size=4).hexdigest()
+        return f"{remap_path}.remap_index.{biotypes_hash}.npz"
+    return remap_path + ".remap_index.npz"
+
+
+def index_fingerprint(remap_file: str, biotypes: list = None) -> dict:
+    """Size and mtime of the ReMap file, and the biotype filter, as stored in the JSON sidecar of the cache."""
+    stat = os.stat(remap_file)
+    return {"source": os.path.abspath(remap_file), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+            "biotypes": sorted(set(biotypes)) if biotypes else None}
+
+
+def index_is_up_to_date(remap_file: str, index_file: str, biotypes: list = None) -> bool:
+    """Check whether the cache exists and was built from the current ReMap file, with the same biotype filter."""
+    if not os.path.isfile(index_file) or not os.path.isfile(index_file + ".json"):
+        return False
+    with open(index_file + ".json", "r") as f:
+        return json.load(f) == index_fingerprint(remap_file, biotypes)
+
+
+def temporary_file_for(target_file: str) -> str:
+    """Unique temporary file next to 'target_file' (per process), to write it and then move it into place."""
+    fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(target_file)),
+                                    prefix=os.path.basename(target_file) + ".", suffix=".tmp")
+    os.close(fd)
+    return tmp_file
+
+
+def scan_remap_file(remap_file: str, biotypes: list = None, chunk_bytes: int = SCAN_CHUNK_BYTES):
+    """
+    Read the ReMap BED file (bgzipped or plain) sequentially, a chunk of lines at a time.
+
+    :param remap_file: Path to the ReMap BED file
+    :param biotypes: OPTIONAL. Only keep the peaks of these biotypes (third field of the 'name' column)
+    :param chunk_bytes: OPTIONAL. Decompressed bytes parsed at once. Default: SCAN_CHUNK_BYTES
+    :return: Generator of DataFrames with the chrom, start, end, thick_center and name columns, in file order
+    """
+    open_file = gzip.open if remap_file.endswith(".gz") else open
+    with open_file(remap_file, "rb") as f:
+        while True:
+            chunk = f.read(chunk_bytes)
+            if not chunk:
+                break
+            chunk += f.readline()  # Up to the end of the last line
+            chunk_df = parse_remap_records(chunk)
+            if biotypes:
+                chunk_df = chunk_df.filter(name_fields_expr().struct.field("biotype").is_in(biotypes))
+            yield chunk_df.select(["chrom", "start", "end", thick_center_expr(), "name"])
+
+
+def build_remap_index(remap_file: str, biotypes: list = None, index_file: str = None) -> str:
+    """
+    Stream the ReMap file once and save its peaks (optionally only those of some biotypes) as numpy arrays.
+
+    :param remap_file: Path to the ReMap BED file
+    :param biotypes: OPTIONAL. Only keep the peaks of these biotypes
+    :param index_file: Path to the cache file. Default: see default_index_path()
+    :return: Path to the cache file
+    """
+    if index_file is None:
+        index_file = default_index_path(remap_file, biotypes)
+    fingerprint = index_fingerprint(remap_file, biotypes)
+
+    # Names and chromosomes are coded as integers as the chunks come in, so that only numbers are kept in memory
+    name_codes, chrom_codes = {}, {}
+    chunks = []
+    for chunk_df in scan_remap_file(remap_file, biotypes):
+        for codes, column in [(name_codes, "name"), (chrom_codes, "chrom")]:
+            for value in chunk_df[column].unique().to_list():
+                codes.setdefault(value, len(codes))
+        chunks.append(chunk_df.select([pl.col("chrom").replace(chrom_codes, default=None).cast(pl.Int32),
+                                       pl.col("start").cast(pl.Int32), pl.col("end").cast(pl.Int32),
+                                       pl.col("thick_center").cast(pl.Int32),
+                                       pl.col("name").replace(name_codes, default=None).cast(pl.Int32)
+                                      .alias("name_code")]))
+
+    chroms = sorted(chrom_codes, key=chrom_codes.get)
+    peaks_df = pl.concat(chunks) if chunks else pl.DataFrame(schema={"chrom": pl.Int32, "start": pl.Int32,
+                                                                     "end": pl.Int32, "thick_center": pl.Int32,
+                                                                     "name_code": pl.Int32})
+    # Peaks sorted by chromosome and start, and peaks with the same start in the order of the file
+    peaks_df = peaks_df.with_row_count("file_order").sort(["chrom", "start", "file_order"])
+    chrom_offsets = np.searchsorted(peaks_df["chrom"].to_numpy(), np.arange(len(chroms) + 1))
+
+    tmp_index_file, tmp_metadata_file = temporary_file_for(index_file), temporary_file_for(index_file + ".json")
+    try:
+        with open(tmp_index_file, "wb") as f:
+            # Strings are saved as fixed width unicode arrays, so that the cache can be loaded without pickle
+            np.savez(f, chroms=np.array(chroms, dtype=str), chrom_offsets=chrom_offsets,
+                     start=peaks_df["start"].to_numpy(), end=peaks_df["end"].to_numpy(),
+                     thick_center=peaks_df["thick_center"].to_numpy(), name_code=peaks_df["name_code"].to_numpy(),
+                     names=np.array(sorted(name_codes, key=name_codes.get), dtype=str))
+        with open(tmp_metadata_file, "w") as f:
+            json.dump(fingerprint, f, indent=2)
+        os.replace(tmp_index_file, index_file)
+        os.replace(tmp_metadata_file, index_file + ".json")
+    finally:
+        for tmp_file in [tmp_index_file, tmp_metadata_file]:
+            if os.path.exists(tmp_file):  # Only if writing it failed
+                os.remove(tmp_file)
+
+    return index_file
+
+
+def load_remap_index(remap_file: str, biotypes: list = None, index_file: str = None) -> dict:
+    """
+    Load the index of the ReMap peaks, (re)building the cache first if it is missing or out of date.
+
+    :param remap_file: Path to the ReMap BED file
+    :param biotypes: OPTIONAL. Only keep the peaks of these biotypes
+    :param index_file: Path to the cache file. Default: see default_index_path()
+    :return: Dictionary of numpy arrays (see INDEX_ARRAYS)
+    """
+    if index_file is None:
+        index_file = default_index_path(remap_file, biotypes)
+    if not index_is_up_to_date(remap_file, index_file, biotypes):
+        sys.stdout.write(f"\nBuilding ReMap index {index_file} from {remap_file}...\n")
+        build_remap_index(remap_file, biotypes, index_file)
+    with np.load(index_file) as cached:
+        return {name: cached[name] for name in INDEX_ARRAYS}
+
+
+def overlap_pairs(start: np.ndarray, end: np.ndarray, positions: np.ndarray) -> tuple:
+    """
+    Pair every peak with every position it overlaps. Peaks are BED intervals (0-based, half-open), so a peak overlaps
+    the position 'pos' (1-based) if start < pos <= end. The positions must be sorted: the positions overlapped by each
+    peak are then a contiguous range, found with a binary search on its start and end, for all peaks at once.
+
+    :param start: Start of the peaks
+    :param end: End of the peaks
+    :param positions: Sorted positions
+    :return: Index of the peak and index of the position of each pair, peak-major
+    """
+    first = np.searchsorted(positions, start, side="right")  # First pos > start
+    last = np.searchsorted(positions, end, side="right")  # Past the last pos <= end
+    counts = np.maximum(last - first, 0)
+    peak_idx = np.repeat(np.arange(len(start)), counts)
+    # Index of every overlapped position: first, first + 1, ..., last - 1 for every peak
+    position_idx = np.repeat(first, counts) + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return peak_idx, position_idx
+
+
+def query_remap_index(remap_index: dict, positions_df: pl.DataFrame) -> pl.DataFrame:
+    """
+    Find the peaks of the index that overlap each of the positions.
+
+    :param remap_index: Index of the ReMap peaks, as returned by load_remap_index()
+    :param positions_df: DataFrame with the 'chr', 'chrom' (e.g. 'chr1') and 'pos' columns, sorted by chrom and pos
+    :return: DataFrame with one row per peak and overlapped position, and the columns chr, pos, name, thick_center and
+     record_order (row of the peak in the index, which follows the order of the ReMap file within a chromosome)
+    """
+    names = pl.Series("name", remap_index["names"], dtype=pl.Utf8)
+    chrom_rows = {chrom: i for i, chrom in enumerate(remap_index["chroms"].tolist())}
+    pairs = []
+    for chrom_positions in positions_df.partition_by("chrom", maintain_order=True):
+        chrom = chrom_positions["chrom"][0]
+        if chrom not in chrom_rows:
+            continue
+        first_row, last_row = remap_index["chrom_offsets"][chrom_rows[chrom]:chrom_rows[chrom] + 2]
+        peak_idx, position_idx = overlap_pairs(remap_index["start"][first_row:last_row],
+                                               remap_index["end"][first_row:last_row],
+                                               chrom_positions["pos"].to_numpy())
+        rows = first_row + peak_idx
+        pairs.append(pl.DataFrame([chrom_positions["chr"][position_idx], chrom_positions["pos"][position_idx],
+                                   names[remap_index["name_code"][rows]],
+                                   pl.Series("thick_center", remap_index["thick_center"][rows], dtype=pl.Int64),
+                                   pl.Series("record_order", rows, dtype=pl.Int64)]))
+    if not pairs:
+        return pl.DataFrame(schema={"chr": pl.Utf8, "pos": pl.Int64, "name": pl.Utf8, "thick_center": pl.Int64,
+                                    "record_order": pl.Int64})
+    return pl.concat(pairs)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build (or rebuild) the cached index of the ReMap peaks used by the "
+                                                 "'scan' lookup mode.")
+    parser.add_argument("remap_file", help="Path to ReMap BED file (bgzipped or plain).")
+    parser.add_argument("-b", "--biotypes_file",
+                        help="OPTIONAL. File with the biotypes to keep, one per line. Default: keep all the peaks.")
+    parser.add_argument("-o", "--index_file",
+                        help="OPTIONAL. Path to the cache file, and its JSON sidecar with the '.json' extension "
+                             "added. Default: next to the ReMap file, with the '.remap_index.npz' extension.")
+
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.remap_file):
+        raise ValueError("ReMap file does not exist")
+    if args.biotypes_file and not os.path.isfile(args.biotypes_file):
+        raise ValueError("Biotypes file does not exist")
+
+    biotype_list = [biotype for biotype in read_filter_file(args.biotypes_file) if biotype] if args.biotypes_file \
+        else None
+    index_path = build_remap_index(args.remap_file, biotype_list, args.index_file)
+    sys.stdout.write(f"\nWrote ReMap index to: {index_path}\n")
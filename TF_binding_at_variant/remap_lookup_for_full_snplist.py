@@ -3,22 +3,37 @@ import argparse
 import sys
 
 import polars as pl
-from extract_remapdb_studies import extract_studies_for_single_snp
+from extract_remapdb_studies import extract_studies_for_snps, write_studies_per_snp, LOOKUP_MODES
+from produce_final_remap_output import read_filter_file
 
 """
-Wrapper function to apply extract_studies_for_single_snp() to every SNP in a 'snplist' file.
+Wrapper to look up every SNP in a 'snplist' file in the ReMap database, with the batch lookup
+extract_studies_for_snps(). All the variants are answered with a single query, and the result is one long-format table
+(the input of 'produce_final_remap_output.py'). The old layout, with one file per variant position, can still be
+written as an optional export.
+
+Large snplists are looked up in a cached index of the whole ReMap file instead of through its tabix index, see
+'remap_index.py'. The backend is picked automatically from the number of variants, or can be forced with -m.
 """
 
 
-def remap_lookup_for_full_snplist(variant_list_file: str, remap_path: str, tmp_dir: str, output_dir: str) -> None:
+def remap_lookup_for_full_snplist(variant_list_file: str, remap_path: str, tmp_dir: str, output_dir: str = None,
+                                  output_file: str = None, biotypes_file: str = None, mode: str = "auto",
+                                  index_file: str = None) -> pl.DataFrame:
     """
-    This function will take a list of variants and produce a tabix query to the ReMap metadata file
+    This function will take a list of variants and look all of them up in the ReMap metadata file at once.
     :param variant_list_file: file with the variants to look up
     :param remap_path: Path to ReMap metadata file. Requires tabix index file.
-    :param tmp_dir: Directory to store temporary files (i.e. tabix "slices" of the remap metadata file for the queried
-        position). If none is specified, temporary files will be stored in the current working directory.
-    :param output_dir: Directory to store the output files
-    :return:
+    :param tmp_dir: No longer used: the ReMap file is queried in-process, without temporary files. Kept for
+        compatibility.
+    :param output_dir: OPTIONAL. Directory to store one output file per variant position, remap_studies_<chr:pos>.txt
+    :param output_file: OPTIONAL. File to write the long-format table to (tab-separated, or Parquet if the name ends
+        with '.parquet')
+    :param biotypes_file: OPTIONAL. File with the biotypes to keep, one per line. Default: keep all the studies
+    :param mode: OPTIONAL. Lookup backend: 'tabix', 'scan', or 'auto' to pick it from the number of variants
+    :param index_file: OPTIONAL. Cache file of the 'scan' backend. Default: next to the ReMap file
+    :return: Long-format table with the columns chr, pos, study_accession, transcription_factor, biotype and
+        distance_to_peak
     """
     # Read snplist
     df = pl.read_csv(variant_list_file, separator="\t", has_header=True,
@@ -28,29 +43,42 @@ def remap_lookup_for_full_snplist(variant_list_file: str, remap_path: str, tmp_d
     if df.columns != ["ID", "Chrom", "Pos", "OA", "EA"]:
         raise ValueError("Input file does not have the correct columns. The columns should be: ID, Chrom, Pos, OA, EA")
 
-    # Combine columns Chrom (without 'chr') and Pos with a ':' in between into a new column called chr_pos
-    df = df.with_columns([pl.format("{}:{}", pl.col("Chrom").str.replace("chr", ""), pl.col("Pos")).alias("chr_pos")])
+    # Look up all the variants with a single query
+    biotypes = [biotype for biotype in read_filter_file(biotypes_file) if biotype] if biotypes_file else None
+    studies_df = extract_studies_for_snps(df, remap_path, biotypes=biotypes, mode=mode, index_file=index_file)
 
-    # Run extract_studies_for_single_snp() for each chr_pos value. This will produce a file for each variant position.
-    df = df.with_columns(pl.col("chr_pos")
-                         .apply(lambda s: extract_studies_for_single_snp(s,  # s is the chr_pos value, <chr>:<pos>
-                                                                         remap_path,
-                                                                         tmp_dir,
-                                                                         os.path.join(output_dir,
-                                                                                      f"remap_studies_{str(s)}.txt"))))
+    if output_file:
+        if output_file.endswith(".parquet"):
+            studies_df.write_parquet(output_file)
+        else:
+            studies_df.write_csv(output_file, separator="\t")
+    if output_dir:  # One file per variant position, as extract_studies_for_single_snp() writes them
+        write_studies_per_snp(studies_df, df, output_dir)
+    return studies_df
 
 
 if __name__ == "__main__":
     # Parse arguments
-    parser = argparse.ArgumentParser(description="Run extract_studies_for_single_snp() for every SNP in a file")
+    parser = argparse.ArgumentParser(description="Look up every SNP in a file in the ReMap database")
     parser.add_argument("-s", "--snplist", required=True, help="Path to file with snplist")
     parser.add_argument("-r", "--remapdb", required=True, help="Path to ReMap database")
-    parser.add_argument("-t", "--tmp_dir", required=True,
-                        help="Path to temporary directory where intermediate files will be stored")
-    parser.add_argument("-o", "--output_dir", required=True,
-                        help="Path to output dir. If the snplist contains several SNPs, "
-                             "the output will be as many files, "
+    parser.add_argument("-t", "--tmp_dir",
+                        help="OPTIONAL. No longer used: no intermediate files are written")
+    parser.add_argument("-f", "--output_file",
+                        help="Path to the output file, with the studies of all the SNPs in long format (one row per "
+                             "SNP position and study). Tab-separated, or Parquet if the name ends with '.parquet'")
+    parser.add_argument("-o", "--output_dir",
+                        help="OPTIONAL. Path to output dir to also write one file per SNP position, "
                              "named remap_studies_<chr:pos>.txt")
+    parser.add_argument("-b", "--biotypes_file",
+                        help="OPTIONAL. File with the biotypes to keep, one per line. Default: keep all the studies")
+    parser.add_argument("-m", "--mode", choices=LOOKUP_MODES, default="auto",
+                        help="OPTIONAL. 'tabix' to query the ReMap file around each SNP, 'scan' to use a cached index "
+                             "of the whole file (faster for large snplists). Default: 'auto', pick it from the number "
+                             "of SNPs")
+    parser.add_argument("-i", "--index_file",
+                        help="OPTIONAL. Cache file of the 'scan' mode. Default: next to the ReMap file, with the "
+                             "'.remap_index.npz' extension")
 
     args = parser.parse_args()
 
@@ -61,11 +89,18 @@ if __name__ == "__main__":
     if not os.path.isfile(args.remapdb):
         raise ValueError("ReMap database file does not exist")
 
-    if not os.path.isdir(args.tmp_dir):
+    if args.tmp_dir and not os.path.isdir(args.tmp_dir):
         raise ValueError("Temporary directory does not exist")
 
-    if not os.path.isdir(args.output_dir):
+    if args.biotypes_file and not os.path.isfile(args.biotypes_file):
+        raise ValueError("Biotypes file does not exist")
+
+    if not args.output_file and not args.output_dir:
+        raise ValueError("No output requested. Use -f and/or -o")
+
+    if args.output_dir and not os.path.isdir(args.output_dir):
         sys.stdout.write(f"\nOutput directory {args.output_dir} does not exist. Creating it now.\n")
         os.mkdir(args.output_dir)
 
-    remap_lookup_for_full_snplist(args.snplist, args.remapdb, args.tmp_dir, args.output_dir)
+    remap_lookup_for_full_snplist(args.snplist, args.remapdb, args.tmp_dir, args.output_dir, args.output_file,
+                                  args.biotypes_file, args.mode, args.index_file)
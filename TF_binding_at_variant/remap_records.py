@@ -0,0 +1,58 @@
+import io
+
+import polars as pl
+
+"""
+Shared decoding of the rows of the ReMap BED file, used by every ReMap reader (the single-SNP lookup, the tabix and
+scan backends of the batch lookup, and the scan that builds the cached peak index).
+
+Everything is done with native polars expressions: integer arithmetic for the center of the peak and the distance to
+the variant, and a single split of the 'name' column (<study_accession>.<transcription_factor>.<biotype>) into a
+struct for its three fields.
+"""
+
+REMAP_COLUMNS = ["chrom", "start", "end", "name", "score", "strand", "thickStart", "thickEnd", "itemRgb"]
+REMAP_DTYPES = {"chrom": pl.Utf8, "start": pl.Int64, "end": pl.Int64, "name": pl.Utf8, "score": pl.Float64,
+                "strand": pl.Utf8, "thickStart": pl.Int64, "thickEnd": pl.Int64, "itemRgb": pl.Utf8}
+NAME_FIELDS = ["study_accession", "transcription_factor", "biotype"]
+STUDIES_COLUMNS = NAME_FIELDS + ["distance_to_peak"]
+
+
+def parse_remap_records(data: bytes) -> pl.DataFrame:
+    """
+    Parse lines of the ReMap BED file.
+
+    :param data: Lines of the file (uncompressed), e.g. b"\\n".join() of the output of tabix_reader.fetch_lines()
+    :return: DataFrame with the REMAP_COLUMNS
+    """
+    if not data.strip():
+        return pl.DataFrame(schema=REMAP_DTYPES)
+    return pl.read_csv(io.BytesIO(data), separator="\t", has_header=False, new_columns=REMAP_COLUMNS,
+                       dtypes=REMAP_DTYPES, comment_prefix="#")
+
+
+def thick_center_expr() -> pl.Expr:
+    """Center of the thick part of the peak (its summit in ReMap), rounded down."""
+    return ((pl.col("thickStart") + pl.col("thickEnd")) // 2).alias("thick_center")
+
+
+def name_fields_expr() -> pl.Expr:
+    """The 'name' column split once into a struct with the NAME_FIELDS."""
+    return pl.col("name").str.split_exact(".", 2).struct.rename_fields(NAME_FIELDS).alias("name_fields")
+
+
+def decode_remap_records(records_df: pl.DataFrame, pos) -> pl.DataFrame:
+    """
+    Add the study_accession, transcription_factor, biotype and distance_to_peak columns to ReMap rows.
+
+    :param records_df: DataFrame with the 'name' column and either the 'thick_center' column or the 'thickStart' and
+     'thickEnd' columns
+    :param pos: Position of the variant: either an int (same for all the rows), or the name of a column
+    :return: records_df with the thick_center (if missing) and STUDIES_COLUMNS columns added
+    """
+    if "thick_center" not in records_df.columns:
+        records_df = records_df.with_columns(thick_center_expr())
+    pos_expr = pl.col(pos) if isinstance(pos, str) else pl.lit(pos, dtype=pl.Int64)
+    return (records_df.with_columns([(pl.col("thick_center") - pos_expr).abs().alias("distance_to_peak"),
+                                     name_fields_expr()])
+            .unnest("name_fields"))
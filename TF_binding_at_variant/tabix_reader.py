@@ -0,0 +1,273 @@
+import os
+import gzip
+import zlib
+import struct
+import argparse
+import sys
+from bisect import bisect_right
+from collections import OrderedDict
+
+import numpy as np
+
+"""
+In-process reader for bgzipped, tabix-indexed files (e.g. the ReMap metadata BED file), so the lookups don't need to
+call the tabix command line tool and spill its output to temporary files.
+
+The .tbi index is parsed once. For a query, the binning index gives the chunks of the file (as BGZF virtual offsets)
+that may hold overlapping records, and the linear index skips the chunks that end before the start of the query. Only
+those BGZF blocks are read and decompressed. The last decompressed blocks are kept in a small LRU cache, so neighbouring
+queries (e.g. the variants of a snplist that are close to each other) share the I/O.
+
+Coordinates are 0-based and half-open, like in a BED file: a query for the position <pos> (1-based) is (pos - 1, pos).
+
+Usage: python tabix_reader.py /path/to/file.bed.gz chr1:1000000-1001000
+"""
+
+TBI_MAGIC = b"TBI\x01"
+BGZF_HEADER = b"\x1f\x8b\x08\x04"
+BLOCK_CACHE_SIZE = 64  # Decompressed BGZF blocks kept in memory (64 KB at most each)
+LINEAR_INDEX_SHIFT = 14  # The linear index has one offset per 16 kb window
+ZERO_BASED_FORMAT = 0x10000  # Flag of the index 'format' field for 0-based, half-open files such as BED
+
+
+def read_tabix_index(index_file: str) -> dict:
+    """
+    Parse a .tbi index file.
+
+    :param index_file: Path to the .tbi file
+    :return: Dictionary with the header fields of the index (format, col_seq, col_beg, col_end, meta, skip) and, for
+     each sequence name, its binning index ({bin: array of (chunk_begin, chunk_end) virtual offsets}) and its linear
+     index (array of virtual offsets)
+    """
+    with open(index_file, "rb") as f:
+        data = gzip.decompress(f.read())  # The index is itself bgzipped
+    if data[:4] != TBI_MAGIC:
+        raise ValueError(f"{index_file} is not a tabix index file")
+
+    n_ref, file_format, col_seq, col_beg, col_end, meta, skip, l_nm = struct.unpack_from("<8i", data, 4)
+    names = data[36:36 + l_nm].split(b"\0")[:n_ref]
+    offset = 36 + l_nm
+
+    sequences = {}
+    for name in names:
+        n_bin, = struct.unpack_from("<i", data, offset)
+        offset += 4
+        bins = {}
+        for _ in range(n_bin):
+            bin_number, n_chunk = struct.unpack_from("<Ii", data, offset)
+            offset += 8
+            bins[bin_number] = np.frombuffer(data, dtype="<u8", count=2 * n_chunk, offset=offset).reshape(-1, 2)
+            offset += 16 * n_chunk
+        n_intv, = struct.unpack_from("<i", data, offset)
+        offset += 4
+        linear_index = np.frombuffer(data, dtype="<u8", count=n_intv, offset=offset)
+        offset += 8 * n_intv
+        sequences[name.decode()] = {"bins": bins, "linear_index": linear_index}
+
+    return {"format": file_format, "col_seq": col_seq, "col_beg": col_beg, "col_end": col_end, "meta": chr(meta),
+            "skip": skip, "sequences": sequences}
+
+
+def open_tabix_file(data_file: str, index_file: str = None, cache_blocks: int = BLOCK_CACHE_SIZE) -> dict:
+    """
+    Open a bgzipped, tabix-indexed file for queries with fetch_lines() / fetch_regions().
+
+    :param data_file: Path to the bgzipped file
+    :param index_file: OPTIONAL. Path to the .tbi file. Default: data_file + '.tbi'
+    :param cache_blocks: OPTIONAL. Number of decompressed BGZF blocks to keep in memory. Default: BLOCK_CACHE_SIZE
+    :return: Dictionary with the path of the file, its index, and the cache of decompressed blocks
+    """
+    index_file = index_file or data_file + ".tbi"
+    if not os.path.isfile(data_file):
+        raise ValueError(f"File {data_file} does not exist")
+    if not os.path.isfile(index_file):
+        raise ValueError(f"No tabix index file could be found for {data_file}")
+    return {"file": data_file, "index": read_tabix_index(index_file), "cache": OrderedDict(),
+            "cache_blocks": cache_blocks}
+
+
+def read_bgzf_block(f, block_offset: int) -> tuple:
+    """
+    Read and decompress the BGZF block that starts at 'block_offset' (the compressed offset, in bytes) of an open file.
+
+    :return: Decompressed data of the block, and the offset of the next block
+    """
+    f.seek(block_offset)
+    header = f.read(12)
+    if len(header) < 12 or header[:4] != BGZF_HEADER:
+        raise ValueError(f"No BGZF block at offset {block_offset} of the file. Is it bgzipped?")
+    extra_length, = struct.unpack_from("<H", header, 10)
+    extra = f.read(extra_length)
+
+    # The 'BC' subfield of the extra field holds the total size of the block minus 1
+    block_size = None
+    position = 0
+    while position + 4 <= extra_length:
+        subfield_length, = struct.unpack_from("<H", extra, position + 2)
+        if extra[position:position + 2] == b"BC":
+            block_size = struct.unpack_from("<H", extra, position + 4)[0] + 1
+        position += 4 + subfield_length
+    if block_size is None:
+        raise ValueError(f"The block at offset {block_offset} of the file is not a BGZF block")
+
+    compressed = f.read(block_size - 12 - extra_length)
+    return zlib.decompress(compressed[:-8], -15), block_offset + block_size  # The last 8 bytes are CRC32 and ISIZE
+
+
+def get_block(tabix: dict, f, block_offset: int) -> tuple:
+    """read_bgzf_block(), through the LRU cache of decompressed blocks of the file."""
+    cache = tabix["cache"]
+    if block_offset in cache:
+        cache.move_to_end(block_offset)
+        return cache[block_offset]
+    block = read_bgzf_block(f, block_offset)
+    cache[block_offset] = block
+    if len(cache) > tabix["cache_blocks"]:
+        cache.popitem(last=False)
+    return block
+
+
+def region_bins(start: int, end: int) -> list:
+    """Bins of the tabix/BAI binning scheme that may hold records overlapping [start, end) (reg2bins in the specs)."""
+    end -= 1
+    bins = [0]
+    for first_bin, shift in [(1, 26), (9, 23), (73, 20), (585, 17), (4681, 14)]:
+        bins.extend(range(first_bin + (start >> shift), first_bin + (end >> shift) + 1))
+    return bins
+
+
+def query_chunks(tabix: dict, chrom: str, start: int, end: int) -> list:
+    """
+    Chunks of the file that may hold records overlapping [start, end) of 'chrom', as sorted and merged
+    (begin, end) pairs of BGZF virtual offsets.
+    """
+    sequence = tabix["index"]["sequences"].get(chrom)
+    if sequence is None or end <= start:
+        return []
+
+    # No record overlapping the query starts before the offset of its first window in the linear index
+    linear_index = sequence["linear_index"]
+    min_offset = int(linear_index[min(start >> LINEAR_INDEX_SHIFT, len(linear_index) - 1)]) if len(linear_index) else 0
+
+    chunks = [sequence["bins"][bin_number] for bin_number in region_bins(start, end) if bin_number in sequence["bins"]]
+    if not chunks:
+        return []
+    chunks = np.concatenate(chunks)
+    chunks = chunks[chunks[:, 1] > min_offset]
+    chunks = chunks[np.argsort(chunks[:, 0], kind="stable")]
+
+    merged = []
+    for chunk_begin, chunk_end in chunks.tolist():
+        if merged and chunk_begin <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], chunk_end)
+        else:
+            merged.append([max(chunk_begin, min_offset), chunk_end])
+    return merged
+
+
+def read_chunk(tabix: dict, f, chunk_begin: int, chunk_end: int, with_offsets: bool = False):
+    """
+    Decompressed data between two BGZF virtual offsets: (compressed offset << 16) | offset within the block.
+
+    With 'with_offsets', the data is returned with the position in the data where the part of each block starts, and
+    the virtual offset of that position, as two lists (see line_virtual_offset()).
+    """
+    block_offset, within_block = chunk_begin >> 16, chunk_begin & 0xFFFF
+    end_block_offset, end_within_block = chunk_end >> 16, chunk_end & 0xFFFF
+    pieces, piece_starts, piece_offsets = [], [], []
+    position = 0
+    while block_offset < end_block_offset or (block_offset == end_block_offset and within_block < end_within_block):
+        data, next_block_offset = get_block(tabix, f, block_offset)
+        pieces.append(data[within_block:end_within_block if block_offset == end_block_offset else len(data)])
+        piece_starts.append(position)
+        piece_offsets.append((block_offset << 16) | within_block)
+        position += len(pieces[-1])
+        block_offset, within_block = next_block_offset, 0
+    if with_offsets:
+        return b"".join(pieces), piece_starts, piece_offsets
+    return b"".join(pieces)
+
+
+def line_virtual_offset(piece_starts: list, piece_offsets: list, position: int) -> int:
+    """Virtual offset of a position of the data returned by read_chunk(), from the block it falls in."""
+    piece = bisect_right(piece_starts, position) - 1
+    return piece_offsets[piece] + position - piece_starts[piece]
+
+
+def fetch_lines(tabix: dict, chrom: str, start: int, end: int, f=None, with_offsets: bool = False) -> list:
+    """
+    Lines of the file with a record overlapping [start, end) (0-based, half-open) of 'chrom', in file order.
+
+    :param tabix: Open file, as returned by open_tabix_file()
+    :param chrom: Sequence name, as in the file (e.g. 'chr1')
+    :param start: Start of the query, 0-based
+    :param end: End of the query, excluded
+    :param f: OPTIONAL. The data file, already open in binary mode. Default: open it for this query
+    :param with_offsets: OPTIONAL. Return (virtual offset, line) pairs, so that the lines can be told apart from
+     identical lines elsewhere in the file. Default: False
+    :return: List of lines (bytes, without the newline)
+    """
+    if f is None:
+        with open(tabix["file"], "rb") as f:
+            return fetch_lines(tabix, chrom, start, end, f, with_offsets)
+
+    index = tabix["index"]
+    col_beg, col_end = index["col_beg"] - 1, index["col_end"] - 1  # Columns are 1-based in the index
+    zero_based = bool(index["format"] & ZERO_BASED_FORMAT)
+    meta = index["meta"].encode()
+    chrom_bytes = chrom.encode()
+
+    lines = []
+    for chunk_begin, chunk_end in query_chunks(tabix, chrom, start, end):
+        data, piece_starts, piece_offsets = read_chunk(tabix, f, chunk_begin, chunk_end, with_offsets=True)
+        line_start = 0
+        for line in data.split(b"\n"):
+            position, line_start = line_start, line_start + len(line) + 1
+            if not line or line.startswith(meta):
+                continue
+            fields = line.split(b"\t", max(col_beg, col_end) + 1)
+            if fields[index["col_seq"] - 1] != chrom_bytes:
+                continue
+            record_start = int(fields[col_beg]) - (0 if zero_based else 1)
+            if record_start >= end:  # Records are sorted by start: nothing else in the chunk overlaps
+                break
+            record_end = int(fields[col_end]) if col_end >= 0 else record_start + 1
+            if record_end > start:
+                lines.append((line_virtual_offset(piece_starts, piece_offsets, position), line) if with_offsets
+                             else line)
+    return lines
+
+
+def fetch_regions(tabix: dict, regions: list, with_offsets: bool = False) -> list:
+    """
+    fetch_lines() for several regions, with the file opened once and the decompressed blocks shared between the
+    queries. Records overlapping several of the regions are returned once per region.
+
+    :param tabix: Open file, as returned by open_tabix_file()
+    :param regions: (chrom, start, end) tuples, 0-based and half-open
+    :param with_offsets: OPTIONAL. Return (virtual offset, line) pairs, see fetch_lines(). Default: False
+    :return: List of lines (bytes, without the newline)
+    """
+    lines = []
+    with open(tabix["file"], "rb") as f:
+        for chrom, start, end in regions:
+            lines.extend(fetch_lines(tabix, chrom, start, end, f, with_offsets))
+    return lines
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Print the records of a bgzipped, tabix-indexed file that overlap a "
+                                                 "region, like 'tabix <file> <region>'.")
+    parser.add_argument("file", help="Path to the bgzipped file. Requires tabix index file.")
+    parser.add_argument("region", help="Region in the format <chrom>:<start>-<end>, 1-based and inclusive, as for "
+                                       "tabix.")
+
+    args = parser.parse_args()
+
+    if ":" not in args.region or "-" not in args.region.split(":")[1]:
+        raise ValueError("Region must be in the format '<chrom>:<start>-<end>'")
+    region_chrom, region_range = args.region.rsplit(":", 1)
+    region_start, region_end = [int(value.replace(",", "")) for value in region_range.split("-")]
+
+    for record in fetch_lines(open_tabix_file(args.file), region_chrom, region_start - 1, region_end):
+        sys.stdout.write(record.decode() + "\n")
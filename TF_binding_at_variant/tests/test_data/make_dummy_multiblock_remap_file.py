@@ -0,0 +1,108 @@
+import os
+import gzip
+import zlib
+import random
+import struct
+
+"""
+Writes 'dummy_multiblock_remap_file.bed.gz' and its tabix index, the fixture of the tabix_reader tests that need a file
+with many BGZF blocks. The tabix command line tool is not needed: the small blocks and the index are written here.
+
+Records are random ReMap-like peaks on three chromosomes, with lengths from 50 bp to 300 kb, so that they fall in every
+level of the binning index and the chunks of a query span several blocks. Every 16 kb window of the linear index gets
+the offset of the first record that overlaps it. A few records are written twice, as identical lines, like some lines of
+the ReMap file.
+
+Usage: python make_dummy_multiblock_remap_file.py
+"""
+
+CHROMS = ["chr1", "chr2", "chrX"]
+RECORDS_PER_CHROM = 1500
+PEAK_LENGTHS = [50, 300, 2000, 30000, 300000]
+BLOCK_BYTES = 4000  # Uncompressed bytes per BGZF block, much less than the 64 KB of bgzip
+BGZF_EOF = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+
+
+def bgzf_block(data: bytes) -> bytes:
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+    compressed = compressor.compress(data) + compressor.flush()
+    header = b"\x1f\x8b\x08\x04\0\0\0\0\0\xff\x06\0BC\x02\0" + struct.pack("<H", len(compressed) + 25)
+    return header + compressed + struct.pack("<II", zlib.crc32(data), len(data))
+
+
+def reg2bin(start: int, end: int) -> int:
+    """Smallest bin of the binning scheme that contains [start, end) (reg2bin in the specs)."""
+    end -= 1
+    for shift, first_bin in [(14, 4681), (17, 585), (20, 73), (23, 9), (26, 1)]:
+        if start >> shift == end >> shift:
+            return first_bin + (start >> shift)
+    return 0
+
+
+def make_records(seed: int = 1) -> list:
+    rng = random.Random(seed)
+    records = []
+    for chrom in CHROMS:
+        start = 0
+        for i in range(RECORDS_PER_CHROM):
+            start += rng.randint(0, 400)
+            end = start + rng.choice(PEAK_LENGTHS)
+            records.append((chrom, start, end, f"GSE{i}.TF{i % 50}.bio{i % 7}"))
+            if i % 500 == 250:
+                records.append(records[-1])
+    return records
+
+
+def write_bgzf_file(lines: list, data_file: str) -> tuple:
+    """Write the lines in BGZF blocks of at most BLOCK_BYTES, and return their virtual offsets and the end offset."""
+    compressed, block = bytearray(), bytearray()
+    virtual_offsets = []
+    for line in lines:
+        if len(block) + len(line) > BLOCK_BYTES:
+            compressed += bgzf_block(bytes(block))
+            block = bytearray()
+        virtual_offsets.append((len(compressed) << 16) | len(block))
+        block += line
+    compressed += bgzf_block(bytes(block))
+    end_offset = len(compressed) << 16
+    with open(data_file, "wb") as f:
+        f.write(compressed + BGZF_EOF)
+    return virtual_offsets, end_offset
+
+
+def write_tabix_index(records: list, virtual_offsets: list, end_offset: int, index_file: str) -> None:
+    bins = {chrom: {} for chrom in CHROMS}
+    linear_index = {chrom: {} for chrom in CHROMS}
+    for i, (chrom, start, end, _) in enumerate(records):
+        record_end_offset = virtual_offsets[i + 1] if i + 1 < len(records) else end_offset
+        chunks = bins[chrom].setdefault(reg2bin(start, end), [])
+        if chunks and chunks[-1][1] == virtual_offsets[i]:  # Consecutive records of the same bin share a chunk
+            chunks[-1][1] = record_end_offset
+        else:
+            chunks.append([virtual_offsets[i], record_end_offset])
+        for window in range(start >> 14, ((end - 1) >> 14) + 1):
+            linear_index[chrom].setdefault(window, virtual_offsets[i])
+
+    names = b"".join(chrom.encode() + b"\0" for chrom in CHROMS)
+    # BED format: 0-based (0x10000), chrom/start/end in columns 1/2/3, '#' comments, no header lines
+    data = b"TBI\x01" + struct.pack("<8i", len(CHROMS), 0x10000, 1, 2, 3, ord("#"), 0, len(names)) + names
+    for chrom in CHROMS:
+        data += struct.pack("<i", len(bins[chrom]))
+        for bin_number, chunks in bins[chrom].items():
+            data += struct.pack("<Ii", bin_number, len(chunks))
+            data += b"".join(struct.pack("<QQ", chunk_begin, chunk_end) for chunk_begin, chunk_end in chunks)
+        offsets = []
+        for window in range(max(linear_index[chrom]) + 1):  # Windows without records get the previous offset
+            offsets.append(linear_index[chrom].get(window, offsets[-1] if offsets else 0))
+        data += struct.pack("<i", len(offsets)) + struct.pack(f"<{len(offsets)}Q", *offsets)
+    with open(index_file, "wb") as f:
+        f.write(gzip.compress(data, mtime=0))
+
+
+if __name__ == "__main__":
+    output_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "dummy_multiblock_remap_file.bed.gz")
+    remap_records = make_records()
+    remap_lines = [f"{chrom}\t{start}\t{end}\t{name}\t0\t.\t{start}\t{end}\t0,0,0\n".encode()
+                   for chrom, start, end, name in remap_records]
+    offsets_of_lines, end_of_file = write_bgzf_file(remap_lines, output_file)
+    write_tabix_index(remap_records, offsets_of_lines, end_of_file, output_file + ".tbi")
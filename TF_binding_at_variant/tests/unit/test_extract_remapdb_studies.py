@@ -1,13 +1,16 @@
 import os
-from extract_remapdb_studies import extract_studies_for_single_snp
+import polars as pl
+import pytest
+from extract_remapdb_studies import extract_studies_for_single_snp, read_snp_positions, assign_peaks_to_snps, \
+    write_studies_per_snp, resolve_lookup_mode, SCAN_MODE_MIN_POSITIONS
 
 
-def test_extract_studies_for_single_snp():
+def test_extract_studies_for_single_snp(tmp_path):
     dir_of_file = os.path.dirname(os.path.abspath(__file__))
     tests_dir = os.path.split(dir_of_file)[0]
 
     remap_file = os.path.join(tests_dir, "test_data/dummy_remap_file.bed.gz")
-    tmp_dir = os.path.join(tests_dir, "tmp/")
+    tmp_dir = str(tmp_path)
     out_file = os.path.join(tests_dir, "test_data/output.tsv")
 
     extract_studies_for_single_snp("1:23939135", remap_file, tmp_dir, out_file, True)
@@ -15,8 +18,48 @@ def test_extract_studies_for_single_snp():
     # Assert that the output file exists
     assert os.path.isfile(out_file)
 
-    # Remove both the 'tabix_slices' directory, its contents, and the output file
+    # The ReMap file is queried in-process: no 'tabix_slices' are written to the tmp_dir
+    assert not os.path.exists(os.path.join(tmp_dir, "tabix_slices"))
+    assert pl.read_csv(out_file, separator="\t")["distance_to_peak"].is_sorted()
+
+    # Remove the output file
     os.remove(out_file)
-    for file in os.listdir(tmp_dir + "/tabix_slices/"):
-        os.remove(tmp_dir + "/tabix_slices/" + file)
-    os.rmdir(tmp_dir + "/tabix_slices")
+
+
+def test_assign_peaks_to_snps():
+    snps_df = pl.DataFrame({"Chrom": ["chr1", "1", "chr1", "chr2"], "Pos": [100, 150, 100, 100]})
+    positions_df = read_snp_positions(snps_df)
+    assert positions_df.rows() == [("1", 100, "chr1"), ("1", 150, "chr1"), ("2", 100, "chr2")]  # Duplicates removed
+
+    # BED entries are 0-based and half-open: the first one contains 100 but not 150, the second one neither
+    records_df = pl.DataFrame({"chrom": ["chr1", "chr1", "chr1", "chr3"], "start": [99, 100, 90, 90],
+                               "end": [100, 149, 200, 200], "name": ["a", "b", "c", "d"]})
+    pairs_df = assign_peaks_to_snps(records_df, positions_df)
+    assert sorted(pairs_df.select(["name", "pos"]).rows()) == [("a", 100), ("c", 100), ("c", 150)]
+
+
+def test_resolve_lookup_mode():
+    assert resolve_lookup_mode("auto", 50) == "tabix"
+    assert resolve_lookup_mode("auto", SCAN_MODE_MIN_POSITIONS) == "scan"
+    assert resolve_lookup_mode("tabix", SCAN_MODE_MIN_POSITIONS) == "tabix"  # Forced modes are kept
+    with pytest.raises(ValueError):
+        resolve_lookup_mode("bedtools", 50)
+
+
+def test_write_studies_per_snp(tmp_path):
+    dir_of_file = os.path.dirname(os.path.abspath(__file__))
+    tests_dir = os.path.split(dir_of_file)[0]
+    tmp_dir = str(tmp_path)
+
+    snps_df = pl.DataFrame({"Chrom": ["chr1", "chr1"], "Pos": [100, 200]})
+    studies_df = pl.DataFrame({"chr": ["1"], "pos": [100], "study_accession": ["GSE1"], "transcription_factor": ["TF"],
+                               "biotype": ["K-562"], "distance_to_peak": [5]})
+    output_files = write_studies_per_snp(studies_df, snps_df, tmp_dir)
+
+    assert [os.path.basename(file) for file in output_files] == ["remap_studies_1:100.txt", "remap_studies_1:200.txt"]
+    assert pl.read_csv(output_files[0], separator="\t").rows() == [("GSE1", "TF", "K-562", 5)]
+    assert pl.read_csv(output_files[1], separator="\t").height == 0  # No studies, but the file is still written
+
+    # Delete files once test is done
+    for file in output_files:
+        os.remove(file)
@@ -1,14 +1,15 @@
 import os
 import polars as pl
-from produce_final_remap_output import produce_final_remap_output, filter_remap_output_file_by_biotype
+from produce_final_remap_output import produce_final_remap_output, filter_remap_output_file_by_biotype, \
+    write_final_remap_output, read_filter_file
 
 
-def test_produce_final_remap_output():
+def test_produce_final_remap_output(tmp_path):
     dir_of_file = os.path.dirname(os.path.abspath(__file__))
     tests_dir = os.path.split(dir_of_file)[0]
 
     remap_lookup_outputs_dir = os.path.join(tests_dir, "test_data/dummy_remap_lookup_outputs/")
-    output_file = os.path.join(tests_dir, "tmp/tmp_test_remap_final_output.tsv")
+    output_file = str(tmp_path / "tmp_test_remap_final_output.tsv")
     produce_final_remap_output(remap_lookup_outputs_dir, output_file)
 
     # Ensure the file has been created
@@ -27,14 +28,14 @@ def test_produce_final_remap_output():
     os.remove(output_file)
 
 
-def test_filter_remap_output_file_by_biotype():
+def test_filter_remap_output_file_by_biotype(tmp_path):
     dir_of_file = os.path.dirname(os.path.abspath(__file__))
     tests_dir = os.path.split(dir_of_file)[0]
 
     input_file = os.path.join(tests_dir, "test_data/dummy_remap_final_output.tsv")
     filter_file = os.path.join(tests_dir, "test_data/dummy_biotype_list.txt")
     reference_output_file = os.path.join(tests_dir, "test_data/dummy_remap_final_output_filtered.tsv")
-    output_file = os.path.join(tests_dir, "tmp/tmp_test_remap_final_output_filtered.tsv")
+    output_file = str(tmp_path / "tmp_test_remap_final_output_filtered.tsv")
 
     filter_remap_output_file_by_biotype(input_file, filter_file, output_file)
 
@@ -45,3 +46,27 @@ def test_filter_remap_output_file_by_biotype():
 
     # Delete file once test is done
     os.remove(output_file)
+
+
+def test_write_final_remap_output(tmp_path):
+    dir_of_file = os.path.dirname(os.path.abspath(__file__))
+    tests_dir = os.path.split(dir_of_file)[0]
+
+    # The long-format table of the lookup already has the columns and order of the final file
+    lookup_file = os.path.join(tests_dir, "test_data/dummy_remap_final_output.tsv")
+    filter_file = os.path.join(tests_dir, "test_data/dummy_biotype_list.txt")
+    reference_output_file = os.path.join(tests_dir, "test_data/dummy_remap_final_output_filtered.tsv")
+    parquet_file = str(tmp_path / "tmp_test_remap_lookup.parquet")
+    output_file = str(tmp_path / "tmp_test_remap_final_output.tsv")
+
+    write_final_remap_output(lookup_file, output_file)
+    assert pl.read_csv(output_file, separator="\t").frame_equal(pl.read_csv(lookup_file, separator="\t"))
+
+    # Same from a Parquet table, filtered by biotype
+    pl.read_csv(lookup_file, separator="\t", dtypes={"chr": pl.Utf8}).write_parquet(parquet_file)
+    write_final_remap_output(parquet_file, output_file, read_filter_file(filter_file))
+    assert pl.read_csv(output_file, separator="\t").frame_equal(pl.read_csv(reference_output_file, separator="\t"))
+
+    # Delete files once test is done
+    os.remove(output_file)
+    os.remove(parquet_file)
@@ -0,0 +1,71 @@
+import os
+import random
+
+import numpy as np
+import polars as pl
+
+from remap_index import build_remap_index, load_remap_index, index_is_up_to_date, overlap_pairs, default_index_path
+from extract_remapdb_studies import extract_studies_for_snps
+from produce_final_remap_output import read_filter_file
+
+
+def test_overlap_pairs():
+    # BED entries are 0-based and half-open: [99, 100) contains 100, [100, 149) contains neither 100 nor 150
+    peak_idx, position_idx = overlap_pairs(np.array([99, 100, 90]), np.array([100, 149, 200]), np.array([100, 150]))
+    assert list(zip(peak_idx, position_idx)) == [(0, 0), (2, 0), (2, 1)]
+
+
+def test_default_index_path():
+    assert default_index_path("/data/remap.bed.gz") == "/data/remap.remap_index.npz"
+    assert default_index_path("/data/remap.bed.gz", ["K-562", "GM12878"]) == \
+           default_index_path("/data/remap.bed.gz", ["GM12878", "K-562"])
+
+
+def test_remap_index(tmp_path):
+    dir_of_file = os.path.dirname(os.path.abspath(__file__))
+    tests_dir = os.path.split(dir_of_file)[0]
+
+    remap_file = os.path.join(tests_dir, "test_data/dummy_remap_file.bed.gz")
+    biotypes = read_filter_file(os.path.join(tests_dir, "test_data/dummy_biotype_list.txt"))
+    index_file = str(tmp_path / "dummy_remap_file.remap_index.npz")
+
+    build_remap_index(remap_file, index_file=index_file)
+    assert index_is_up_to_date(remap_file, index_file)
+    assert not [file for file in os.listdir(os.path.dirname(index_file)) if file.endswith(".tmp")]  # All moved in place
+    assert not index_is_up_to_date(remap_file, index_file, biotypes)  # Built without the biotype filter
+    remap_index = load_remap_index(remap_file, index_file=index_file)
+    assert remap_index["chroms"].tolist() == ["chr1"]
+    assert remap_index["chrom_offsets"].tolist() == [0, 186]
+    assert np.all(np.diff(remap_index["start"]) >= 0)
+
+    # The scan and tabix modes find the same studies, with and without the biotype filter
+    snps_df = pl.read_csv(os.path.join(tests_dir, "test_data/dummy_variant_list.tsv"), separator="\t")
+    for biotype_filter in [None, biotypes]:
+        tabix_df = extract_studies_for_snps(snps_df, remap_file, biotypes=biotype_filter, mode="tabix")
+        scan_df = extract_studies_for_snps(snps_df, remap_file, biotypes=biotype_filter, mode="scan",
+                                           index_file=index_file)
+        assert scan_df.frame_equal(tabix_df)
+    assert index_is_up_to_date(remap_file, index_file, biotypes)  # Rebuilt with the filter
+
+    expected_df = pl.read_csv(os.path.join(tests_dir, "test_data/dummy_remap_final_output_filtered.tsv"),
+                              separator="\t", dtypes={"chr": pl.Utf8})
+    assert scan_df.frame_equal(expected_df)
+
+    # Delete files once test is done
+    os.remove(index_file)
+    os.remove(index_file + ".json")
+
+
+def test_tabix_and_scan_modes_agree(tmp_path):
+    dir_of_file = os.path.dirname(os.path.abspath(__file__))
+    tests_dir = os.path.split(dir_of_file)[0]
+    # Many BGZF blocks, peaks overlapping many positions each, and a few identical lines
+    remap_file = os.path.join(tests_dir, "test_data/dummy_multiblock_remap_file.bed.gz")
+
+    rng = random.Random(0)
+    snps_df = pl.DataFrame({"Chrom": [rng.choice(["1", "2", "X"]) for _ in range(400)],
+                            "Pos": [rng.randint(1, 650000) for _ in range(400)]})
+    tabix_df = extract_studies_for_snps(snps_df, remap_file, mode="tabix")
+    scan_df = extract_studies_for_snps(snps_df, remap_file, mode="scan", index_file=str(tmp_path / "index.npz"))
+    assert tabix_df.height > 400
+    assert scan_df.frame_equal(tabix_df)
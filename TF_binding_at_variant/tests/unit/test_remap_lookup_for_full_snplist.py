@@ -3,13 +3,13 @@ import polars as pl
 from remap_lookup_for_full_snplist import remap_lookup_for_full_snplist
 
 
-def test_remap_lookup_for_full_snplist():
+def test_remap_lookup_for_full_snplist(tmp_path):
     dir_of_file = os.path.dirname(os.path.abspath(__file__))
     tests_dir = os.path.split(dir_of_file)[0]
 
     snplist = os.path.join(tests_dir, "test_data/dummy_variant_list.tsv")
     remap_file = os.path.join(tests_dir, "test_data/dummy_remap_file.bed.gz")
-    tmp_dir = os.path.join(tests_dir, "tmp/")
+    tmp_dir = str(tmp_path)
 
     # Make a list of the expected output files
     df = pl.read_csv(snplist, separator="\t", has_header=True)
@@ -21,8 +21,8 @@ def test_remap_lookup_for_full_snplist():
 
     # Assert that the output files exist
     for file in expected_output_files:
-        assert os.path.isfile(os.path.join(tests_dir, "tmp/" + file))
+        assert os.path.isfile(os.path.join(tmp_path, file))
 
     # Delete files once test is done
     for file in expected_output_files:
-        os.remove(os.path.join(tests_dir, "tmp/" + file))
+        os.remove(os.path.join(tmp_path, file))
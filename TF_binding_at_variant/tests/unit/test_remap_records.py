@@ -0,0 +1,23 @@
+import polars as pl
+
+from remap_records import REMAP_COLUMNS, STUDIES_COLUMNS, parse_remap_records, decode_remap_records
+
+LINES = (b"chr1\t90\t200\tGSE1.CTCF.K-562\t0\t.\t140\t141\t0,0,0\n"
+         b"chr1\t99\t100\tENCSR2.REST.GM12878.rep1\t0\t.\t99\t100\t0,0,0\n")
+
+
+def test_parse_remap_records():
+    records_df = parse_remap_records(LINES)
+    assert records_df.columns == REMAP_COLUMNS
+    assert records_df["start"].to_list() == [90, 99]
+    assert parse_remap_records(b"").columns == REMAP_COLUMNS
+
+
+def test_decode_remap_records():
+    studies_df = decode_remap_records(parse_remap_records(LINES), 100).select(STUDIES_COLUMNS)
+    # Only the first three fields of the name are kept, and the center of the peak is rounded down
+    assert studies_df.rows() == [("GSE1", "CTCF", "K-562", 40), ("ENCSR2", "REST", "GM12878", 1)]
+
+    # The position can also be a column, e.g. when the rows of several variants are decoded at once
+    records_df = parse_remap_records(LINES).with_columns(pl.Series("pos", [150, 50]))
+    assert decode_remap_records(records_df, "pos")["distance_to_peak"].to_list() == [10, 49]
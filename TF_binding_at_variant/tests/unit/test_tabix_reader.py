@@ -0,0 +1,151 @@
+import os
+import gzip
+import random
+
+import pytest
+
+from tabix_reader import open_tabix_file, read_bgzf_block, fetch_lines, fetch_regions, region_bins, query_chunks, \
+    read_chunk, get_block, LINEAR_INDEX_SHIFT
+
+
+def get_remap_file(file_name="dummy_remap_file.bed.gz"):
+    dir_of_file = os.path.dirname(os.path.abspath(__file__))
+    tests_dir = os.path.split(dir_of_file)[0]
+    return os.path.join(tests_dir, "test_data", file_name)
+
+
+def get_multiblock_remap_file():
+    """Random peaks on chr1, chr2 and chrX in 4 KB BGZF blocks, see test_data/make_dummy_multiblock_remap_file.py"""
+    return get_remap_file("dummy_multiblock_remap_file.bed.gz")
+
+
+def block_offsets(data_file):
+    """Compressed offset of every BGZF block of the file, and the offset of its data in the decompressed file."""
+    offsets = {}
+    decompressed_offset = 0
+    with open(data_file, "rb") as f:
+        block_offset = 0
+        while block_offset < os.path.getsize(data_file):
+            offsets[block_offset] = decompressed_offset
+            data, next_block_offset = read_bgzf_block(f, block_offset)
+            decompressed_offset += len(data)
+            block_offset = next_block_offset
+    return offsets
+
+
+def overlapping_lines(remap_file, chrom, start, end):
+    """Brute force: every line of the file with a record overlapping [start, end)."""
+    lines = gzip.open(remap_file).read().decode().splitlines()
+    return [line for line in lines if line.split("\t")[0] == chrom and int(line.split("\t")[1]) < end
+            and int(line.split("\t")[2]) > start]
+
+
+def test_read_bgzf_block():
+    remap_file = get_remap_file()
+    blocks = []
+    with open(remap_file, "rb") as f:
+        block_offset = 0
+        while block_offset < os.path.getsize(remap_file):
+            data, block_offset = read_bgzf_block(f, block_offset)
+            blocks.append(data)
+    assert b"".join(blocks) == gzip.open(remap_file).read()
+
+    with open(remap_file, "rb") as f:
+        with pytest.raises(ValueError):
+            read_bgzf_block(f, 1)  # Not the start of a block
+
+
+def test_region_bins():
+    assert region_bins(0, 1) == [0, 1, 9, 73, 585, 4681]
+    assert region_bins(16384, 16385)[-1] == 4682
+
+
+def test_fetch_lines():
+    remap_file = get_remap_file()
+    tabix = open_tabix_file(remap_file, cache_blocks=1)
+
+    for pos in [23933929, 23935190, 23939135, 1000]:
+        lines = [line.decode() for line in fetch_lines(tabix, "chr1", pos - 1, pos)]
+        assert lines == overlapping_lines(remap_file, "chr1", pos - 1, pos)
+    assert len(fetch_lines(tabix, "chr1", 0, 2 ** 29)) == 186  # The whole file
+    assert fetch_lines(tabix, "chr2", 0, 2 ** 29) == []  # Not in the index
+    assert len(tabix["cache"]) == 1
+
+    regions = [("chr1", 23939134, 23939135), ("chr1", 23939134, 23939135)]
+    assert fetch_regions(tabix, regions) == 2 * fetch_lines(tabix, "chr1", 23939134, 23939135)
+
+    with pytest.raises(ValueError):
+        open_tabix_file(remap_file.replace(".bed.gz", ".tsv"))
+
+
+def test_read_chunk_across_blocks():
+    remap_file = get_multiblock_remap_file()
+    tabix = open_tabix_file(remap_file)
+    decompressed = gzip.open(remap_file).read()
+    offsets = block_offsets(remap_file)
+
+    chunks = query_chunks(tabix, "chr2", 100000, 400000)
+    assert any(chunk_end >> 16 > chunk_begin >> 16 for chunk_begin, chunk_end in chunks)  # Spans several blocks
+    with open(remap_file, "rb") as f:
+        for chunk_begin, chunk_end in chunks:
+            begin = offsets[chunk_begin >> 16] + (chunk_begin & 0xFFFF)
+            end = offsets[chunk_end >> 16] + (chunk_end & 0xFFFF)
+            assert read_chunk(tabix, f, chunk_begin, chunk_end) == decompressed[begin:end]
+
+
+def test_query_chunks_linear_index():
+    tabix = open_tabix_file(get_multiblock_remap_file())
+    linear_index = tabix["index"]["sequences"]["chr1"]["linear_index"]
+    start = 20 << LINEAR_INDEX_SHIFT
+    min_offset = int(linear_index[20])
+
+    # The chunks of the big bins start at the beginning of the chromosome: the linear index skips everything before
+    # the first record that overlaps the window of the query
+    chunks = query_chunks(tabix, "chr1", start, start + 1)
+    assert chunks and all(chunk_begin >= min_offset and chunk_end > min_offset for chunk_begin, chunk_end in chunks)
+    assert min(chunk_begin for chunk_begin, _ in query_chunks(tabix, "chr1", 0, start + 1)) < min_offset
+
+
+def test_fetch_lines_multiblock():
+    remap_file = get_multiblock_remap_file()
+    tabix = open_tabix_file(remap_file, cache_blocks=4)
+    records = [line.split("\t") for line in gzip.open(remap_file).read().decode().splitlines()]
+
+    rng = random.Random(0)
+    for _ in range(200):
+        chrom = rng.choice(["chr1", "chr2", "chrX"])
+        start = rng.randint(0, 650000)
+        end = start + rng.choice([1, 100, 50000])
+        lines = [line.decode() for line in fetch_lines(tabix, chrom, start, end)]
+        assert lines == ["\t".join(fields) for fields in records if fields[0] == chrom and int(fields[1]) < end
+                         and int(fields[2]) > start]
+        assert len(tabix["cache"]) <= 4
+    assert len(fetch_lines(tabix, "chrX", 0, 2 ** 29)) == 1503  # Including 3 records written twice
+
+    # With their virtual offsets, the identical lines are told apart, and each offset points at its line
+    offset_lines = fetch_lines(tabix, "chrX", 0, 2 ** 29, with_offsets=True)
+    assert [line for _, line in offset_lines] == fetch_lines(tabix, "chrX", 0, 2 ** 29)
+    assert len({offset for offset, _ in offset_lines}) == 1503
+    decompressed = gzip.open(remap_file).read()
+    offsets = block_offsets(remap_file)
+    for offset, line in offset_lines[::50]:
+        position = offsets[offset >> 16] + (offset & 0xFFFF)
+        assert decompressed[position:position + len(line) + 1] == line + b"\n"
+
+
+def test_block_cache_eviction():
+    remap_file = get_multiblock_remap_file()
+    tabix = open_tabix_file(remap_file, cache_blocks=2)
+    first_blocks = list(block_offsets(remap_file))[:4]
+
+    with open(remap_file, "rb") as f:
+        for block_offset in first_blocks[:3]:
+            get_block(tabix, f, block_offset)
+        assert list(tabix["cache"]) == first_blocks[1:3]  # The least recently used block was evicted
+        get_block(tabix, f, first_blocks[1])  # Used again: the other one is evicted next
+        get_block(tabix, f, first_blocks[3])
+        assert list(tabix["cache"]) == [first_blocks[1], first_blocks[3]]
+
+        # A cached block is not read from the file again
+        f.close()
+        assert get_block(tabix, f, first_blocks[3]) == tabix["cache"][first_blocks[3]]